@@ -1,22 +1,178 @@
+import argparse
+import bisect
+import csv
+import io
+import itertools
+import random
 import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 
 from passlib.hash import sha256_crypt
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData, Sequence, create_engine
+from sqlalchemy.schema import CreateIndex, CreateTable
 
-from shop.db import (Gender, order_product_table, order_table,
-                     product_table, token_table, user_order_table, user_table)
+from shop import partitions
+from shop.db import (Gender, ORDER_NUMBER_INCREMENT, ORDER_NUMBER_START, PRODUCT_CHANGES_CHANNEL,
+                     PRODUCT_CHANGES_RESET, PRODUCT_CHANGES_SETTING, PRODUCT_CHANGES_TRIGGER_SQL, order_product_table,
+                     order_table, product_sales_hourly_table, product_sales_table, product_table, revoked_token_table,
+                     token_table, user_order_table, user_table)
 from shop.settings import config
 
 DSN = 'postgresql://{user}:{password}@{host}:{port}/{database}'
 
+FIRST_NAMES = ['Ivan', 'Petr', 'Anna', 'Maria', 'Olga', 'Sergey', 'Dmitry', 'Elena', 'Alexey', 'Natalia']
+SURNAMES = ['Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Kuznetsov', 'Popov', 'Vasiliev', 'Sokolov']
+MIDDLE_NAMES = ['Ivanovich', 'Petrovich', 'Sergeevich', 'Alekseevich', None]
+PRODUCT_KINDS = ['Chocolate', 'Juice', 'Coffee', 'Tea', 'Cookies', 'Cheese', 'Bread', 'Milk', 'Honey', 'Jam']
+PRODUCT_ADJECTIVES = ['Fresh', 'Organic', 'Classic', 'Premium', 'Homemade', 'Light', 'Spicy', 'Sweet']
+ORDER_HISTORY_DAYS = 90
+
+
+ORDER_TABLES = [order_table, order_product_table, user_order_table]
+
+# Цены строк и суммы заказов для БД, созданных до того, как они стали сохраняться вместе с заказом.
+# Цены на момент старых заказов неизвестны, поэтому используются текущие цены продуктов.
+ADD_ORDER_PRICES_SQL = {
+    ('orders_products', 'price'): (
+        'ALTER TABLE orders_products ADD COLUMN price numeric',
+        'UPDATE orders_products op '
+        'SET price = coalesce((SELECT p.price FROM products p WHERE p.id = op.product_id), 0)',
+        'ALTER TABLE orders_products ALTER COLUMN price SET NOT NULL'
+    ),
+    ('orders', 'total'): (
+        'ALTER TABLE orders ADD COLUMN total numeric',
+        'UPDATE orders o SET total = t.total '
+        'FROM (SELECT order_id, sum(price * quantity) AS total FROM orders_products GROUP BY order_id) t '
+        'WHERE t.order_id = o.id',
+        'UPDATE orders SET total = 0 WHERE total IS NULL',
+        'ALTER TABLE orders ALTER COLUMN total SET NOT NULL'
+    )
+}
+
+# Построчный триггер уведомлений об изменениях продуктов, замененный триггерами на запрос.
+DROP_ROW_PRODUCT_CHANGES_TRIGGER_SQL = ('DROP TRIGGER IF EXISTS products_notify_change ON products; '
+                                        'DROP FUNCTION IF EXISTS notify_product_change()')
+
+
+def get_partitioning():
+    """
+    Получить параметры секционирования таблиц заказов.
+
+    :return: параметры секционирования, None - таблицы не секционированы
+    """
+    partitioning = config.get('partitioning', {})
+    if not partitioning.get('enabled', False):
+        return None
+    return {'partition_size': partitioning.get('partition_size', 1000000), 'premake': partitioning.get('premake', 2)}
+
+
+def run_partitions(engine, function, **kwargs):
+    """
+    Выполнить функцию на курсоре psycopg2 в отдельной транзакции.
+
+    Секционирование - это обычный DDL, общий с приложением, поэтому он выполняется на курсоре psycopg2.
+
+    :param engine: engine БД
+    :param function: функция, принимающая курсор и `kwargs`
+    :param kwargs: именованные аргументы функции
+    :return: результат функции
+    """
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            result = function(cursor, **kwargs)
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+def add_order_prices(cursor):
+    """
+    Добавить и заполнить отсутствующие цены строк и суммы заказов.
+
+    Для таблиц, в которых они уже есть, ничего не делает.
+
+    :param cursor: курсор psycopg2
+    """
+    for (table, column), statements in ADD_ORDER_PRICES_SQL.items():
+        cursor.execute('SELECT 1 FROM information_schema.columns '
+                       'WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s',
+                       (table, column))
+        if cursor.fetchone() is not None:
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_partitioned_order_tables(engine, shard=False):
+    """
+    Создать секционированные таблицы заказов и их первые секции.
+
+    :param engine: engine БД
+    :param shard: таблицы создаются на шарде заказов, без внешних ключей на пользователей и продукты
+    """
+    run_partitions(engine, partitions.create_partitioned_tables, shard=shard)
+    run_partitions(engine, partitions.maintain, **get_partitioning())
+
 
 def create_tables(engine):
+    # Триграммные индексы продуктов требуют расширения pg_trgm.
+    engine.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
     meta = MetaData()
     tables = [
-        user_table, token_table, product_table,
-        order_table, order_product_table, user_order_table
+        user_table, token_table, revoked_token_table, product_table,
+        product_sales_table, product_sales_hourly_table
     ]
+    if get_partitioning() is None:
+        meta.create_all(bind=engine, tables=tables + ORDER_TABLES)
+        return
+
+    order_table.c.number.default.create(bind=engine, checkfirst=True)
     meta.create_all(bind=engine, tables=tables)
+    create_partitioned_order_tables(engine)
+
+
+def create_shard_tables(engine, shard_id):
+    """
+    Создать таблицы заказов на шарде.
+
+    :param engine: engine шарда
+    :param shard_id: идентификатор шарда
+    """
+    # Пользователи и продукты остаются в основной БД, поэтому на шарде заказов нет внешних ключей на них.
+    # Собственная последовательность номеров шарда сохраняет номера уникальными и определяет шард по номеру.
+    sequence = Sequence('order_number_seq', start=ORDER_NUMBER_START + shard_id, increment=ORDER_NUMBER_INCREMENT)
+    sequence.create(bind=engine, checkfirst=True)
+    if get_partitioning() is not None:
+        create_partitioned_order_tables(engine, shard=True)
+        return
+
+    with engine.begin() as conn:
+        for table in ORDER_TABLES:
+            if engine.dialect.has_table(conn, table.name):
+                continue
+            foreign_keys = [constraint for constraint in table.foreign_key_constraints
+                            if constraint.referred_table in ORDER_TABLES]
+            conn.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+            for index in table.indexes:
+                conn.execute(CreateIndex(index))
+
+
+def get_shard_engines():
+    """
+    Создать engine-ы шардов заказов.
+
+    :return: список кортежей вида (идентификатор шарда, engine) по возрастанию идентификаторов,
+        пустой, если шардирование выключено
+    """
+    sharding = config.get('sharding', {})
+    if not sharding.get('enabled', False):
+        return []
+    shards = sorted(sharding.get('shards', []), key=lambda shard: shard['id'])
+    return [(shard['id'], create_engine(DSN.format(**dict(config['postgres'], **shard)))) for shard in shards]
 
 
 def insert_users(conn):
@@ -73,16 +229,336 @@ def insert_products(conn):
     }])
 
 
-def seed_db(engine):
-    with engine.connect() as conn:
-        insert_users(conn)
-        insert_tokens(conn)
-        insert_products(conn)
+class ZipfSampler:
+    """
+    Выборка индексов 0..n-1 с вероятностью, пропорциональной 1 / (ранг ** s).
+
+    Ранги перемешиваются, поэтому самые популярные элементы распределены по всему диапазону,
+    а не являются первыми добавленными.
+    """
+
+    def __init__(self, rng, n, s):
+        """
+        Инициализация экземпляра класса выборки.
+
+        :param rng: генератор случайных чисел
+        :param n: количество элементов
+        :param s: показатель степени распределения Ципфа: чем он больше, тем сильнее перекос
+        """
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+        self.items = list(range(n))
+        rng.shuffle(self.items)
+
+    def sample(self):
+        """
+        Выбрать индекс элемента.
+
+        :return: индекс элемента
+        """
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_left(self.cumulative, point)]
+
+
+class CopyBuffer:
+    """Буфер, накапливающий строки в памяти в формате CSV и загружающий их порциями через COPY."""
+
+    def __init__(self, cursor, table, columns):
+        """
+        Инициализация экземпляра класса буфера.
+
+        :param cursor: курсор psycopg2
+        :param table: таблица, в которую загружаются строки
+        :param columns: наименования загружаемых колонок
+        """
+        self.cursor = cursor
+        self.sql = 'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+            table=table.name, columns=', '.join(columns))
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = 0
+
+    def add(self, row):
+        """
+        Добавить строку в буфер.
+
+        :param row: значения колонок строки
+        """
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def flush(self):
+        """Загрузить накопленные строки через COPY и очистить буфер."""
+        if self.rows:
+            self.buffer.seek(0)
+            self.cursor.copy_expert(self.sql, self.buffer)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.rows = 0
+
+
+def random_uuid(rng):
+    """
+    Сгенерировать воспроизводимый UUID4.
+
+    :param rng: генератор случайных чисел
+    :return: UUID
+    """
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def generate_users(cursor, rng, count, batch_size):
+    """
+    Сгенерировать пользователей с токенами.
+
+    :param cursor: курсор psycopg2
+    :param rng: генератор случайных чисел
+    :param count: количество пользователей
+    :param batch_size: количество строк в порции COPY
+    :return: список идентификаторов пользователей
+    """
+    # Хэширование намеренно медленное, поэтому у всех сгенерированных пользователей пароль "password".
+    password = sha256_crypt.hash('password')
+    users = CopyBuffer(cursor, user_table, ['id', 'login', 'password', 'first_name', 'surname',
+                                            'middle_name', 'sex', 'age'])
+    tokens = CopyBuffer(cursor, token_table, ['id', 'token', 'user_id'])
+    user_ids = []
+    for n in range(count):
+        user_id = random_uuid(rng)
+        user_ids.append(user_id)
+        users.add((user_id, 'gen_user{n}'.format(n=n), password, rng.choice(FIRST_NAMES), rng.choice(SURNAMES),
+                   rng.choice(MIDDLE_NAMES), rng.choice(list(Gender)).name, int(rng.triangular(18, 80, 30))))
+        tokens.add((random_uuid(rng), '{:064x}'.format(rng.getrandbits(256)), user_id))
+        if users.rows >= batch_size:
+            users.flush()
+            tokens.flush()
+    users.flush()
+    tokens.flush()
+    return user_ids
+
+
+def generate_products(cursor, rng, count, batch_size):
+    """
+    Сгенерировать продукты.
+
+    :param cursor: курсор psycopg2
+    :param rng: генератор случайных чисел
+    :param count: количество продуктов
+    :param batch_size: количество строк в порции COPY
+    :return: кортеж вида (список идентификаторов продуктов, список цен продуктов)
+    """
+    products = CopyBuffer(cursor, product_table, ['id', 'name', 'description', 'slug', 'price', 'left_in_stock'])
+    product_ids = []
+    product_prices = []
+    for n in range(count):
+        product_id = random_uuid(rng)
+        name = '{adjective} {kind} {n}'.format(
+            adjective=rng.choice(PRODUCT_ADJECTIVES), kind=rng.choice(PRODUCT_KINDS), n=n)
+        description = 'Generated product: {name}'.format(name=name.lower())
+        price = Decimal(str(round(rng.lognormvariate(1.5, 0.8) + 0.1, 2)))
+        product_ids.append(product_id)
+        product_prices.append(price)
+        products.add((product_id, name, description, 'gen-product-{n}'.format(n=n),
+                      price, rng.randint(0, 10000)))
+        if products.rows >= batch_size:
+            products.flush()
+    products.flush()
+    return product_ids, product_prices
+
+
+class OrderWriter:
+    """Загрузчик сгенерированных заказов в одну БД (основную или шард заказов), продолжающий ее последовательность."""
+
+    def __init__(self, cursor, partitioning=None):
+        """
+        Инициализация экземпляра класса загрузчика.
+
+        :param cursor: курсор psycopg2
+        :param partitioning: параметры секционирования таблиц заказов, None - таблицы не секционированы
+        """
+        self.cursor = cursor
+        self.partitioning = partitioning
+        self.orders = CopyBuffer(cursor, order_table, ['id', 'number', 'created_at', 'total'])
+        self.order_products = CopyBuffer(cursor, order_product_table,
+                                         ['order_id', 'order_number', 'product_id', 'quantity', 'price'])
+        self.user_orders = CopyBuffer(cursor, user_order_table, ['user_id', 'order_id', 'order_number'])
+        cursor.execute("SELECT nextval('order_number_seq')")
+        self.number = cursor.fetchone()[0]
+        self.flushed_number = self.number
+
+    def add_line(self, order_id, product_id, quantity, price):
+        """
+        Добавить строку заказа, который будет добавлен следующим.
+
+        :param order_id: идентификатор заказа
+        :param product_id: идентификатор продукта
+        :param quantity: количество продукта
+        :param price: цена продукта
+        """
+        self.order_products.add((order_id, self.number, product_id, quantity, price))
+
+    def add(self, order_id, user_id, created_at, total):
+        """
+        Добавить заказ со следующим номером.
+
+        :param order_id: идентификатор заказа
+        :param user_id: идентификатор пользователя
+        :param created_at: дата и время создания заказа
+        :param total: сумма заказа
+        """
+        self.orders.add((order_id, self.number, created_at.isoformat(), total))
+        self.user_orders.add((user_id, order_id, self.number))
+        self.number += ORDER_NUMBER_INCREMENT
+
+    def flush(self):
+        """Загрузить накопленные заказы."""
+        if self.partitioning is not None and self.number > self.flushed_number:
+            # Секции, созданные при создании таблиц, покрывают только номера рядом с текущим значением
+            # последовательности, поэтому секции для номеров порции создаются перед ее загрузкой.
+            partitions.create_partitions(self.cursor, self.flushed_number, self.number - ORDER_NUMBER_INCREMENT,
+                                         self.partitioning['partition_size'])
+        for buffer in (self.orders, self.order_products, self.user_orders):
+            buffer.flush()
+        self.flushed_number = self.number
+
+    def close(self):
+        """Загрузить оставшиеся заказы и продвинуть последовательность номеров заказов."""
+        self.flush()
+        self.cursor.execute("SELECT setval('order_number_seq', %s)", (self.number - ORDER_NUMBER_INCREMENT,))
+        if self.partitioning is not None:
+            # Секции впрок после последнего сгенерированного номера.
+            partitions.maintain(self.cursor, **self.partitioning)
+
+
+def generate_orders(writers, rng, user_ids, product_ids, product_prices, count, max_lines, zipf_s, batch_size):
+    """
+    Сгенерировать заказы.
+
+    :param writers: загрузчики заказов по шардам (один, если шардирование выключено)
+    :param rng: генератор случайных чисел
+    :param user_ids: идентификаторы пользователей
+    :param product_ids: идентификаторы продуктов
+    :param product_prices: цены продуктов
+    :param count: количество заказов
+    :param max_lines: максимальное количество продуктов в заказе
+    :param zipf_s: перекос популярности продуктов
+    :param batch_size: количество строк в порции COPY
+    """
+    # Несколько активных покупателей и самых продаваемых продуктов и длинный хвост всех остальных.
+    user_sampler = ZipfSampler(rng, len(user_ids), zipf_s / 2)
+    product_sampler = ZipfSampler(rng, len(product_ids), zipf_s)
+
+    # Заказы равномерно распределены по последним дням, чтобы у аналитики была история.
+    created_at = datetime.now(timezone.utc) - timedelta(days=ORDER_HISTORY_DAYS)
+    step = timedelta(days=ORDER_HISTORY_DAYS) / count
+    for _ in range(count):
+        order_id = random_uuid(rng)
+        user_id = user_ids[user_sampler.sample()]
+        # Та же маршрутизация, что и в ShardMap.for_user, чтобы приложение находило заказы пользователя.
+        writer = writers[user_id.int % len(writers)]
+        lines = min(max_lines, int(rng.expovariate(1 / 2)) + 1, len(product_ids))
+        total = Decimal(0)
+        for product_index in {product_sampler.sample() for _ in range(lines)}:
+            quantity = int(rng.paretovariate(2.5))
+            price = product_prices[product_index]
+            writer.add_line(order_id, product_ids[product_index], quantity, price)
+            total += price * quantity
+        writer.add(order_id, user_id, created_at, total)
+        created_at += step
+
+        if writer.orders.rows >= batch_size:
+            writer.flush()
+    for writer in writers:
+        writer.close()
+
+
+def generate_data(engine, shard_engines=(), users=0, products=0, orders=0, max_lines=5, zipf_s=1.1, seed=0,
+                  batch_size=100000):
+    """
+    Загрузить через COPY синтетические данные с перекошенными распределениями.
+
+    Одно и то же зерно всегда дает один и тот же набор данных (кроме номеров заказов,
+    которые продолжают существующую последовательность). Если переданы шарды заказов, заказы загружаются в них.
+
+    :param engine: engine основной БД
+    :param shard_engines: engine-ы шардов заказов
+    :param users: количество пользователей
+    :param products: количество продуктов
+    :param orders: количество заказов
+    :param max_lines: максимальное количество продуктов в заказе
+    :param zipf_s: перекос популярности продуктов
+    :param seed: зерно генератора случайных чисел
+    :param batch_size: количество строк в порции COPY
+    """
+    rng = random.Random(seed)
+    conn = engine.raw_connection()
+    shard_conns = [shard_engine.raw_connection() for shard_engine in shard_engines]
+    try:
+        with conn.cursor() as cursor:
+            # Вместо уведомлений на каждую порцию COPY приложение получает один сброс.
+            cursor.execute("SELECT set_config(%s, 'off', true)", (PRODUCT_CHANGES_SETTING,))
+            user_ids = generate_users(cursor, rng, users, batch_size)
+            product_ids, product_prices = generate_products(cursor, rng, products, batch_size)
+            if product_ids:
+                cursor.execute('SELECT pg_notify(%s, %s)', (PRODUCT_CHANGES_CHANNEL, PRODUCT_CHANGES_RESET))
+            if orders and user_ids and product_ids:
+                cursors = [shard_conn.cursor() for shard_conn in shard_conns] or [cursor]
+                writers = [OrderWriter(order_cursor, get_partitioning()) for order_cursor in cursors]
+                generate_orders(writers, rng, user_ids, product_ids, product_prices, orders, max_lines, zipf_s,
+                                batch_size)
+        for shard_conn in shard_conns:
+            shard_conn.commit()
+        conn.commit()
+    finally:
+        for db_conn in [conn, *shard_conns]:
+            db_conn.close()
+
+
+def seed_db(engine, fixtures=True, shard_engines=(), **generator_options):
+    if fixtures:
+        with engine.connect() as conn:
+            insert_users(conn)
+            insert_tokens(conn)
+            insert_products(conn)
+    if any(generator_options.get(option) for option in ('users', 'products', 'orders')):
+        generate_data(engine, shard_engines=shard_engines, **generator_options)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Create tables and fill the database with test data')
+    parser.add_argument('--no-fixtures', dest='fixtures', action='store_false',
+                        help='do not insert the small hand-written fixture set')
+    parser.add_argument('--users', type=int, default=0, help='number of generated users (with tokens)')
+    parser.add_argument('--products', type=int, default=0, help='number of generated products')
+    parser.add_argument('--orders', type=int, default=0, help='number of generated orders')
+    parser.add_argument('--max-lines', type=int, default=5, help='maximum number of products in an order')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='skew of product popularity')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--batch-size', type=int, default=100000, help='rows per COPY batch')
+    parser.add_argument('--migrate', action='store_true',
+                        help='only migrate the existing tables: replace the product change triggers, '
+                             'add the line prices and order totals, add the order numbers to the order lines '
+                             'and user links and, if partitioning is enabled, move the orders to partitioned tables '
+                             '(stop the application first)')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = vars(parse_args())
     db_url = DSN.format(**config['postgres'])
     db_engine = create_engine(db_url)
 
-    create_tables(db_engine)
-    seed_db(db_engine)
+    shards = get_shard_engines()
+
+    if args.pop('migrate'):
+        with db_engine.begin() as db_conn:
+            db_conn.execute(DROP_ROW_PRODUCT_CHANGES_TRIGGER_SQL)
+            db_conn.execute(PRODUCT_CHANGES_TRIGGER_SQL)
+        for _, order_engine in shards or [(None, db_engine)]:
+            run_partitions(order_engine, add_order_prices)
+            run_partitions(order_engine, partitions.migrate, shard=bool(shards), **(get_partitioning() or {}))
+    else:
+        create_tables(db_engine)
+        for shard_id, shard_engine in shards:
+            create_shard_tables(shard_engine, shard_id)
+        seed_db(db_engine, shard_engines=[shard_engine for _, shard_engine in shards], **args)
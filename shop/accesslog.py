@@ -0,0 +1,149 @@
+import json
+import logging
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+from aiohttp.abc import AbstractAccessLogger
+from aiohttp.web import BaseRequest, StreamResponse
+
+ACCESS_LOGGER_NAME = 'shop.access'
+
+access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записей, сообщение которых является словарем, в виде json-строк."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Сериализовать сообщение записи в json.
+
+        :param record: запись журнала
+        :return: json-строка
+        """
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg, separators=(',', ':'), default=str)
+        return super().format(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Обработчик, помещающий записи в очередь без форматирования.
+
+    В отличие от `QueueHandler`, форматирование выполняется не в потоке
+    event loop-а, а обработчиками `QueueListener`-а в отдельном потоке.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Подготовить запись к помещению в очередь.
+
+        :param record: запись журнала
+        :return: та же запись без изменений
+        """
+        return record
+
+
+class JsonAccessLogger(AbstractAccessLogger):
+    """
+    Структурированный (json lines) журнал доступа с выборочной записью.
+
+    Для каждого запроса записываются шаблон маршрута, статус ответа, время обработки,
+    время и количество запросов к БД, время ожидания соединения в пуле и идентификатор
+    пользователя. Доля записываемых запросов задается в разделе `access_log` настроек
+    отдельно для ошибок сервера, ошибок клиента и успешных ответов; запросы, обработанные
+    дольше `slow_request` секунд, записываются всегда.
+    """
+
+    @property
+    def enabled(self) -> bool:
+        """Проверить, включен ли журнал доступа."""
+        return self.logger.isEnabledFor(logging.INFO)
+
+    def log(self, request: BaseRequest, response: StreamResponse, time_taken: float) -> None:
+        """
+        Записать обработанный запрос в журнал, если он попал в выборку.
+
+        :param request: экземпляр запроса
+        :param response: экземпляр ответа
+        :param time_taken: время обработки запроса, в секундах
+        """
+        config = request.app['config'].get('access_log', {})
+        if not _is_sampled(config, response.status, time_taken):
+            return
+
+        resource = request.match_info.route.resource
+        entry = {
+            'ts': round(time.time(), 3),
+            'method': request.method,
+            'route': resource.canonical if resource is not None else None,
+            'status': response.status,
+            'latency_ms': round(time_taken * 1000, 2)
+        }
+        stats = request.get('db_stats')
+        if stats is not None:
+            entry['db_time_ms'] = round(stats.time * 1000, 2)
+            entry['db_queries'] = stats.count
+        if 'db_pool_wait' in request:
+            entry['db_pool_wait_ms'] = round(request['db_pool_wait'] * 1000, 2)
+        user = request.get('user')
+        if user is not None:
+            entry['user_id'] = user.id.hex
+        if 'trace_id' in request:
+            entry['trace_id'] = request['trace_id']
+        self.logger.info(entry)
+
+
+def _is_sampled(config: dict, status: int, time_taken: float) -> bool:
+    if time_taken >= config.get('slow_request', float('inf')):
+        return True
+
+    rates = config.get('sample_rates', {})
+    if status >= 500:
+        rate = rates.get('server_error', 1.0)
+    elif status >= 400:
+        rate = rates.get('client_error', 1.0)
+    else:
+        rate = rates.get('success', 1.0)
+    return rate >= 1 or random.random() < rate
+
+
+async def init_access_log(app) -> None:
+    """
+    Настройка журнала доступа.
+
+    Записи помещаются в очередь, а форматируются и записываются (в файл `path`
+    или в stdout) в отдельном потоке, чтобы не блокировать event loop.
+    """
+    config = app['config'].get('access_log', {})
+    access_logger.propagate = False
+    if not config.get('enabled', True):
+        access_logger.setLevel(logging.WARNING)
+        return
+
+    path = config.get('path')
+    handler = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+
+    queue = SimpleQueue()
+    listener = QueueListener(queue, handler)
+    access_logger.addHandler(DeferredQueueHandler(queue))
+    access_logger.setLevel(logging.INFO)
+    listener.start()
+    app['access_log_listener'] = listener
+
+
+async def close_access_log(app) -> None:
+    """Запись оставшихся в очереди записей и остановка потока журнала доступа."""
+    listener = app.get('access_log_listener')
+    if listener is None:
+        return
+
+    listener.stop()
+    for handler in access_logger.handlers[:]:
+        access_logger.removeHandler(handler)
+    for handler in listener.handlers:
+        handler.close()
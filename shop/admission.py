@@ -0,0 +1,189 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from aiohttp import hdrs, web
+
+READ_METHODS = (hdrs.METH_GET, hdrs.METH_HEAD, hdrs.METH_OPTIONS)
+
+
+def classify_route(request: web.Request, routes: Dict[str, str]) -> str:
+    """
+    Определить класс маршрута запроса.
+
+    Класс ищется в `routes` сначала по методу и шаблону пути (например, "GET /products"),
+    затем по шаблону пути, а для остальных маршрутов определяется по HTTP-методу:
+    read (GET, HEAD, OPTIONS) или write.
+
+    :param request: экземпляр запроса
+    :param routes: классы маршрутов по методу и шаблону пути или по шаблону пути
+    :return: наименование класса маршрута
+    """
+    resource = request.match_info.route.resource
+    if resource is not None:
+        name = routes.get('{method} {path}'.format(method=request.method, path=resource.canonical))
+        if name is None:
+            name = routes.get(resource.canonical)
+        if name is not None:
+            return name
+    return 'read' if request.method in READ_METHODS else 'write'
+
+
+class AdmissionLimiter:
+    """
+    Ограничитель количества одновременно обрабатываемых запросов одного класса.
+
+    Запросы сверх лимита ждут в очереди ограниченного размера не дольше `queue_timeout`.
+    Если очередь заполнена или время ожидания истекло, запрос отклоняется.
+
+    При включенной адаптации лимит подстраивается под нагрузку (AIMD): если средняя
+    задержка обработки или ожидания соединения с БД за окно наблюдений превышает
+    целевую, лимит уменьшается на 10%, если нет и лимит был исчерпан - увеличивается на единицу.
+    """
+
+    def __init__(self,
+                 limit: int,
+                 queue_size: int,
+                 queue_timeout: float,
+                 adaptive: bool = False,
+                 min_limit: int = 1,
+                 max_limit: Optional[int] = None,
+                 target_latency: float = 0.5,
+                 target_pool_wait: float = 0.05,
+                 window: int = 100) -> None:
+        """
+        Инициализация ограничителя.
+
+        :param limit: начальный лимит одновременно обрабатываемых запросов
+        :param queue_size: максимальное количество ожидающих запросов
+        :param queue_timeout: максимальное время ожидания в очереди, в секундах
+        :param adaptive: подстраивать ли лимит под наблюдаемую задержку
+        :param min_limit: минимальный лимит при адаптации
+        :param max_limit: максимальный лимит при адаптации (по умолчанию - начальный лимит)
+        :param target_latency: целевая средняя задержка обработки запроса, в секундах
+        :param target_pool_wait: целевое среднее время ожидания соединения с БД, в секундах
+        :param window: количество запросов в окне наблюдений
+        """
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit
+        self.target_latency = target_latency
+        self.target_pool_wait = target_pool_wait
+        self.window = window
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._samples = 0
+        self._latency_sum = 0.0
+        self._pool_wait_sum = 0.0
+        self._saturated = False
+
+    async def acquire(self) -> bool:
+        """
+        Занять место для обработки запроса.
+
+        :return: True, если запрос допущен к обработке, False - если его следует отклонить
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # Место могло быть передано запросу одновременно с его отменой.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+        return True
+
+    def release(self, latency: Optional[float] = None, pool_wait: Optional[float] = None) -> None:
+        """
+        Освободить место после обработки запроса и передать его следующему ожидающему.
+
+        :param latency: время обработки запроса, в секундах
+        :param pool_wait: время ожидания соединения с БД, в секундах
+        """
+        self._saturated = self._saturated or self.in_flight >= self.limit
+        self.in_flight -= 1
+        if self.adaptive and latency is not None:
+            self._observe(latency, pool_wait or 0.0)
+
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def _observe(self, latency: float, pool_wait: float) -> None:
+        self._samples += 1
+        self._latency_sum += latency
+        self._pool_wait_sum += pool_wait
+        if self._samples < self.window:
+            return
+
+        overloaded = self._latency_sum / self._samples > self.target_latency
+        if self._pool_wait_sum / self._samples > self.target_pool_wait:
+            overloaded = True
+
+        if overloaded:
+            self.limit = max(self.min_limit, int(self.limit * 0.9))
+        elif self._saturated:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+        self._samples = 0
+        self._latency_sum = 0.0
+        self._pool_wait_sum = 0.0
+        self._saturated = False
+
+
+class AdmissionController:
+    """
+    Контроль допуска запросов к обработке по классам маршрутов.
+
+    Класс маршрута определяется по разделу `routes` настроек (см. `classify_route`).
+    """
+
+    def __init__(self, config: dict) -> None:
+        """
+        Инициализация контроллера по разделу `admission` конфигурационного файла.
+
+        :param config: словарь настроек контроля допуска
+        """
+        adaptive = config.get('adaptive', {})
+        self.retry_after = config.get('retry_after', 1)
+        self.routes: Dict[str, str] = config.get('routes', {})
+        self.limiters: Dict[str, AdmissionLimiter] = {
+            name: AdmissionLimiter(**dict(adaptive, **options))
+            for name, options in config.get('classes', {}).items()
+        }
+
+    def classify(self, request: web.Request) -> str:
+        """
+        Определить класс маршрута запроса.
+
+        :param request: экземпляр запроса
+        :return: наименование класса маршрута
+        """
+        return classify_route(request, self.routes)
+
+    def get_limiter(self, request: web.Request) -> Optional[AdmissionLimiter]:
+        """
+        Вернуть ограничитель для класса маршрута запроса.
+
+        :param request: экземпляр запроса
+        :return: ограничитель или None, если класс маршрута не ограничен
+        """
+        return self.limiters.get(self.classify(request))
@@ -0,0 +1,121 @@
+"""
+Пересчет агрегатов продаж продуктов с нуля.
+
+Агрегаты (product_sales и product_sales_hourly) обновляются инкрементально
+при создании заказа. Команда check пересчитывает их по заказам и сравнивает
+с сохраненными значениями, не изменяя данные; команда rebuild заменяет
+сохраненные значения пересчитанными.
+
+Выручка пересчитывается по ценам, сохраненным в строках заказов.
+При шардировании заказов (раздел `sharding` конфигурационного файла) их нет
+в основной БД, поэтому пересчет недоступен.
+
+Пример использования из командной строки:
+    python shop/analytics.py check
+    python shop/analytics.py rebuild
+"""
+import argparse
+import json
+import sys
+from typing import List
+
+from catalog import connect
+from settings import config
+
+MAX_REPORTED_MISMATCHES = 100
+
+HOURLY_SALES_SQL = """
+    SELECT op.product_id,
+           date_trunc('hour', o.created_at) AS bucket,
+           sum(op.quantity) AS units_sold,
+           sum(op.quantity * op.price) AS revenue
+    FROM orders_products op
+    JOIN orders o ON o.id = op.order_id
+    GROUP BY op.product_id, date_trunc('hour', o.created_at)
+"""
+
+# Блокировка не мешает чтению агрегатов, но приостанавливает создание заказов до конца пересчета.
+LOCK_SQL = 'LOCK TABLE product_sales, product_sales_hourly IN EXCLUSIVE MODE'
+REBUILD_SQL = (
+    'DELETE FROM product_sales_hourly',
+    'DELETE FROM product_sales',
+    'INSERT INTO product_sales_hourly (product_id, bucket, units_sold, revenue) ' + HOURLY_SALES_SQL,
+    'INSERT INTO product_sales (product_id, units_sold, revenue) '
+    'SELECT product_id, sum(units_sold), sum(revenue) FROM product_sales_hourly GROUP BY product_id'
+)
+CHECK_SQL = """
+    WITH expected AS (
+        SELECT product_id, sum(units_sold) AS units_sold, sum(revenue) AS revenue
+        FROM ({hourly}) hourly
+        GROUP BY product_id
+    )
+    SELECT coalesce(e.product_id, s.product_id)::text, e.units_sold, e.revenue::text, s.units_sold, s.revenue::text
+    FROM expected e
+    FULL JOIN product_sales s ON s.product_id = e.product_id
+    WHERE e.units_sold IS DISTINCT FROM s.units_sold OR e.revenue IS DISTINCT FROM s.revenue
+""".format(hourly=HOURLY_SALES_SQL)
+
+
+def check_sales(conn) -> List[dict]:
+    """
+    Сравнить итоги продаж за все время с пересчитанными по заказам.
+
+    Сравнение выполняется одним запросом, то есть на одном снимке данных,
+    поэтому одновременно создаваемые заказы не приводят к ложным расхождениям.
+
+    :param conn: синхронное подключение psycopg2
+    :return: список расхождений по продуктам
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(CHECK_SQL)
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    return [{
+        'product_id': product_id,
+        'expected': {'units_sold': expected_units, 'revenue': expected_revenue},
+        'actual': {'units_sold': actual_units, 'revenue': actual_revenue}
+    } for product_id, expected_units, expected_revenue, actual_units, actual_revenue in rows]
+
+
+def rebuild_sales(conn) -> None:
+    """
+    Пересчитать агрегаты продаж по заказам с нуля в одной транзакции.
+
+    :param conn: синхронное подключение psycopg2
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(LOCK_SQL)
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+    conn.commit()
+
+
+def main() -> None:
+    """Точка входа CLI проверки/пересчета агрегатов продаж."""
+    parser = argparse.ArgumentParser(description='Check or rebuild the product sales aggregates')
+    parser.add_argument('command', choices=('check', 'rebuild'))
+    args = parser.parse_args()
+    if config.get('sharding', {}).get('enabled', False):
+        # Пересчет по пустым таблицам заказов основной БД обнулил бы агрегаты.
+        parser.error('orders are sharded, the aggregates can not be recomputed from the main database')
+
+    conn = connect()
+    try:
+        if args.command == 'rebuild':
+            rebuild_sales(conn)
+            return
+
+        mismatches = check_sales(conn)
+    finally:
+        conn.close()
+
+    json.dump({'mismatched': len(mismatches), 'products': mismatches[:MAX_REPORTED_MISMATCHES]},
+              sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Массовый импорт и экспорт каталога продуктов.
+
+Импорт выполняется через COPY во временную (staging) таблицу с последующим
+upsert-ом по slug, экспорт - через COPY ... TO STDOUT. Поддерживаются форматы
+CSV (с заголовком) и NDJSON (один json-объект продукта на строку).
+
+aiopg не поддерживает COPY в асинхронном режиме, поэтому все операции
+выполняются через синхронное подключение psycopg2 и из aiohttp-приложения
+запускаются в executor-е. Экспорт при этом передается в event loop частями
+через очередь ограниченного размера, не накапливаясь во временном файле.
+
+Пример использования из командной строки:
+    python shop/catalog.py import products.csv
+    python shop/catalog.py export products.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+import tempfile
+import uuid
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, IO, Iterator, Optional, Tuple
+
+import psycopg2
+
+from exceptions import CatalogExportCancelledException, InvalidCatalogRowException
+from schemas import PRODUCT_IMPORT_SCHEMA
+from settings import config
+from storage import Entity, Product
+from validation import compile_schema
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+MAX_REPORTED_ERRORS = 1000
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+EXPORT_QUEUE_SIZE = 4
+
+STAGING_SQL = 'CREATE TEMP TABLE products_staging (LIKE products INCLUDING DEFAULTS) ON COMMIT DROP'
+COPY_IN_SQL = ('COPY products_staging (id, name, description, slug, price, left_in_stock) '
+               'FROM STDIN WITH (FORMAT csv)')
+UPSERT_SQL = """
+    WITH upserted AS (
+        INSERT INTO products (id, name, description, slug, price, left_in_stock)
+        SELECT id, name, description, slug, price, left_in_stock FROM products_staging
+        ON CONFLICT (slug) DO UPDATE SET
+            name = EXCLUDED.name,
+            description = EXCLUDED.description,
+            price = EXCLUDED.price,
+            left_in_stock = EXCLUDED.left_in_stock
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+"""
+EXPORT_QUERY = 'SELECT name, description, slug, price, left_in_stock FROM products ORDER BY slug'
+COPY_OUT_SQL = {
+    'csv': 'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)'.format(query=EXPORT_QUERY),
+    'ndjson': 'COPY (SELECT row_to_json(p) FROM ({query}) p) TO STDOUT'.format(query=EXPORT_QUERY)
+}
+
+validate_product = compile_schema(PRODUCT_IMPORT_SCHEMA)
+
+
+class ImportReport(Entity):
+    """Отчет о результатах импорта каталога."""
+
+    def __init__(self) -> None:
+        """Конструктор инициализации пустого отчета."""
+        self.inserted = 0
+        self.updated = 0
+        self.errors_count = 0
+        self.errors = []
+
+    def add_error(self, line: int, message: str) -> None:
+        """
+        Зарегистрировать ошибку в строке импортируемого файла.
+
+        В самом отчете сохраняются только первые `MAX_REPORTED_ERRORS` ошибок,
+        при этом общее количество ошибок учитывается полностью.
+
+        :param line: номер строки файла
+        :param message: описание ошибки
+        """
+        self.errors_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+
+class _NdjsonCopyWriter:
+    """
+    Файлоподобный объект, преобразующий вывод COPY в текстовом формате в NDJSON.
+
+    В текстовом формате COPY экранирует обратную косую черту. Json, полученный
+    из `row_to_json`, не содержит управляющих символов, поэтому достаточно
+    вернуть удвоенные обратные косые черты к исходному виду.
+    """
+
+    def __init__(self, target: IO[bytes]) -> None:
+        self.target = target
+
+    def write(self, data: bytes) -> int:
+        return self.target.write(data.replace(b'\\\\', b'\\'))
+
+
+class _ChunkWriter:
+    """
+    Файлоподобный объект, передающий вывод COPY из потока executor-а в event loop частями.
+
+    Запись блокирует поток executor-а, пока очередь заполнена, поэтому COPY
+    читается из БД не быстрее, чем клиент принимает выгрузку.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, chunk_size: int) -> None:
+        self.loop = loop
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.cancelled = False
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer.extend(data)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, chunk: Optional[bytes]) -> None:
+        if self.cancelled:
+            raise CatalogExportCancelledException()
+        asyncio.run_coroutine_threadsafe(self.queue.put(chunk), self.loop).result()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def _export_chunks(writer: _ChunkWriter, fmt: str) -> None:
+    try:
+        export_file(writer, fmt)
+        writer.flush()
+    finally:
+        if not writer.cancelled:
+            writer.put(None)
+
+
+def _reject_constant(value: str) -> None:
+    raise InvalidCatalogRowException('Invalid number {value}'.format(value=value))
+
+
+def _read_ndjson(source: IO[str]) -> Iterator[Tuple[int, str]]:
+    for line_no, line in enumerate(source, start=1):
+        if line.strip():
+            yield line_no, line
+
+
+def _decode_ndjson(line: str) -> Any:
+    try:
+        return json.loads(line, parse_float=Decimal, parse_constant=_reject_constant)
+    except ValueError:
+        raise InvalidCatalogRowException('Invalid JSON')
+
+
+def _read_csv(source: IO[str]) -> Iterator[Tuple[int, dict]]:
+    reader = csv.DictReader(source)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _decode_csv(row: dict) -> dict:
+    if None in row:
+        raise InvalidCatalogRowException('Unexpected extra columns')
+
+    data = {key: value for key, value in row.items() if value not in (None, '')}
+    try:
+        if 'price' in data:
+            data['price'] = Decimal(data['price'])
+        if 'left_in_stock' in data:
+            data['left_in_stock'] = int(data['left_in_stock'])
+    except (InvalidOperation, ValueError):
+        raise InvalidCatalogRowException('Invalid number')
+    return data
+
+
+FORMAT_HANDLERS = {
+    'csv': (_read_csv, _decode_csv),
+    'ndjson': (_read_ndjson, _decode_ndjson)
+}
+
+
+def _decode_product(data: Any) -> Product:
+    price = data.get('price') if isinstance(data, dict) else None
+    if isinstance(price, Decimal) and not price.is_finite():
+        raise InvalidCatalogRowException('Invalid number')
+
+    error_message = validate_product(data)
+    if error_message is not None:
+        raise InvalidCatalogRowException(error_message)
+    return Product(**data)
+
+
+def prepare_import(source: IO[str], fmt: str, report: ImportReport) -> IO[str]:
+    """
+    Разобрать и провалидировать импортируемый файл, подготовив данные для COPY.
+
+    Некорректные строки и повторы slug-а не прерывают импорт, а попадают в отчет.
+    Синтаксически поврежденный CSV-файл дальше места повреждения не читается.
+
+    :param source: текстовый поток с данными в формате `fmt`
+    :param fmt: формат файла ('csv' или 'ndjson')
+    :param report: отчет, в который регистрируются ошибки
+    :return: временный файл с корректными строками в формате COPY CSV
+    """
+    read, decode = FORMAT_HANDLERS[fmt]
+    rows = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+', newline='', encoding='utf-8')
+    writer = csv.writer(rows)
+    seen_slugs = set()
+    line_no = 0
+    try:
+        for line_no, raw in read(source):
+            try:
+                product = _decode_product(decode(raw))
+            except InvalidCatalogRowException as e:
+                report.add_error(line_no, str(e))
+                continue
+
+            if product.slug in seen_slugs:
+                report.add_error(line_no, 'Duplicate slug "{slug}"'.format(slug=product.slug))
+                continue
+
+            seen_slugs.add(product.slug)
+            writer.writerow((uuid.uuid4(), product.name, product.description,
+                             product.slug, product.price, product.left_in_stock))
+    except csv.Error as e:
+        report.add_error(line_no + 1, 'Malformed CSV: {error}'.format(error=e))
+
+    rows.seek(0)
+    return rows
+
+
+def import_catalog(conn, source: IO[str], fmt: str) -> ImportReport:
+    """
+    Импортировать каталог продуктов одной транзакцией.
+
+    Корректные строки загружаются через COPY во временную таблицу, после чего
+    переносятся в `products` единственным запросом INSERT ... ON CONFLICT (slug) DO UPDATE.
+
+    :param conn: синхронное подключение psycopg2
+    :param source: текстовый поток с данными в формате `fmt`
+    :param fmt: формат файла ('csv' или 'ndjson')
+    :return: отчет об импорте
+    """
+    report = ImportReport()
+    with prepare_import(source, fmt, report) as rows, conn.cursor() as cursor:
+        cursor.execute(STAGING_SQL)
+        cursor.copy_expert(COPY_IN_SQL, rows)
+        cursor.execute(UPSERT_SQL)
+        report.inserted, report.updated = cursor.fetchone()
+    conn.commit()
+    return report
+
+
+def export_catalog(conn, target: IO[bytes], fmt: str) -> None:
+    """
+    Выгрузить каталог продуктов, упорядоченный по slug.
+
+    :param conn: синхронное подключение psycopg2
+    :param target: бинарный поток, в который записываются данные
+    :param fmt: формат выгрузки ('csv' или 'ndjson')
+    """
+    if fmt == 'ndjson':
+        target = _NdjsonCopyWriter(target)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(COPY_OUT_SQL[fmt], target)
+    conn.rollback()
+
+
+def connect():
+    """
+    Открыть синхронное подключение к БД по настройкам из конфигурационного файла.
+
+    :return: подключение psycopg2
+    """
+    return psycopg2.connect(**config['postgres'])
+
+
+def import_file(file: IO[bytes], fmt: str) -> ImportReport:
+    """
+    Импортировать каталог из бинарного файла в отдельном подключении к БД.
+
+    Предназначен для запуска в executor-е из асинхронного кода.
+
+    :param file: бинарный поток с данными в кодировке utf-8
+    :param fmt: формат файла ('csv' или 'ndjson')
+    :return: отчет об импорте
+    """
+    conn = connect()
+    try:
+        source = io.TextIOWrapper(file, encoding='utf-8', newline='')
+        return import_catalog(conn, source, fmt)
+    finally:
+        conn.close()
+
+
+def export_file(file: IO[bytes], fmt: str) -> None:
+    """
+    Выгрузить каталог в бинарный файл в отдельном подключении к БД.
+
+    Предназначен для запуска в executor-е из асинхронного кода.
+
+    :param file: бинарный поток, в который записываются данные
+    :param fmt: формат выгрузки ('csv' или 'ndjson')
+    """
+    conn = connect()
+    try:
+        export_catalog(conn, file, fmt)
+    finally:
+        conn.close()
+
+
+async def iter_export(fmt: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    Выгрузить каталог продуктов потоком частей.
+
+    COPY выполняется в executor-е, части передаются через очередь из `EXPORT_QUEUE_SIZE`
+    элементов. Если итерирование прервано до конца выгрузки, COPY прерывается,
+    а подключение к БД закрывается.
+
+    :param fmt: формат выгрузки ('csv' или 'ndjson')
+    :param chunk_size: минимальный размер части в байтах (кроме последней)
+    :return: асинхронный итератор частей выгрузки
+    :raise psycopg2.Error: выбрасывается, если выгрузка завершилась ошибкой БД
+    """
+    loop = asyncio.get_event_loop()
+    writer = _ChunkWriter(loop, asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE), chunk_size)
+    exporting = loop.run_in_executor(None, _export_chunks, writer, fmt)
+    try:
+        chunk = await writer.queue.get()
+        while chunk is not None:
+            yield chunk
+            chunk = await writer.queue.get()
+        await exporting
+    finally:
+        if not exporting.done():
+            writer.cancel()
+            exporting.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+
+def _guess_format(path: str) -> str:
+    extension = path.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else 'ndjson'
+
+
+def main() -> None:
+    """Точка входа CLI импорта/экспорта каталога."""
+    parser = argparse.ArgumentParser(description='Bulk import/export of the product catalog')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('path', help='path to the file, "-" for stdin/stdout')
+    parser.add_argument('--format', choices=FORMATS, help='file format, guessed by extension by default')
+    args = parser.parse_args()
+    fmt = args.format or _guess_format(args.path)
+
+    if args.command == 'export':
+        if args.path == '-':
+            export_file(sys.stdout.buffer, fmt)
+        else:
+            with open(args.path, 'wb') as file:
+                export_file(file, fmt)
+        return
+
+    if args.path == '-':
+        report = import_file(sys.stdin.buffer, fmt)
+    else:
+        with open(args.path, 'rb') as file:
+            report = import_file(file, fmt)
+    json.dump(dict(report), sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if report.errors_count:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
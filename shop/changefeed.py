@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiopg
+
+from db import PRODUCT_CHANGES_CHANNEL
+from exceptions import TooManySubscribersException
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_PARAMS = ('database', 'user', 'password', 'host', 'port')
+
+
+class ProductChangeSubscriber:
+    """
+    Подписчик на изменения продуктов с ограниченным буфером.
+
+    Неотправленные изменения одного продукта объединяются: в буфере хранится
+    только последнее. Если в буфере накопилось больше `buffer_size` продуктов
+    (подписчик не успевает их получать), буфер очищается, а подписчик получает
+    признак сброса и должен перечитать каталог целиком.
+    """
+
+    def __init__(self, buffer_size: int) -> None:
+        """
+        Инициализация подписчика.
+
+        :param buffer_size: максимальное количество продуктов с неотправленными изменениями
+        """
+        self.buffer_size = buffer_size
+        self.closed = False
+        self._pending: Dict[str, dict] = OrderedDict()
+        self._reset = False
+        self._event = asyncio.Event()
+
+    def put(self, change: dict) -> None:
+        """
+        Добавить изменение продукта в буфер.
+
+        :param change: изменение продукта
+        """
+        slug = change['slug']
+        if slug not in self._pending and len(self._pending) >= self.buffer_size:
+            self.reset()
+            return
+
+        self._pending[slug] = change
+        self._event.set()
+
+    def reset(self) -> None:
+        """Сбросить буфер: подписчик должен перечитать каталог целиком."""
+        self._pending.clear()
+        self._reset = True
+        self._event.set()
+
+    def close(self) -> None:
+        """Закрыть подписку (например, при остановке приложения)."""
+        self.closed = True
+        self._event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Дождаться изменений или закрытия подписки.
+
+        :param timeout: максимальное время ожидания, в секундах
+        :return: True, если есть изменения, сброс или подписка закрыта; False - по истечении времени
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def drain(self) -> Tuple[bool, List[dict]]:
+        """
+        Забрать накопленные изменения.
+
+        :return: признак сброса и список изменений продуктов
+        """
+        reset, changes = self._reset, list(self._pending.values())
+        self._reset = False
+        self._pending.clear()
+        if not self.closed:
+            self._event.clear()
+        return reset, changes
+
+
+class ProductChangeHub:
+    """
+    Раздача изменений продуктов подписчикам процесса.
+
+    Изменения поступают из одного общего источника (LISTEN на соединении с БД
+    или уведомления хранилища в памяти) и копируются в буферы всех подписчиков.
+    """
+
+    def __init__(self, max_subscribers: int = 1000, buffer_size: int = 1000) -> None:
+        """
+        Инициализация раздачи.
+
+        :param max_subscribers: максимальное количество подписчиков
+        :param buffer_size: размер буфера подписчика (количество продуктов)
+        """
+        self.max_subscribers = max_subscribers
+        self.buffer_size = buffer_size
+        self.subscribers: Set[ProductChangeSubscriber] = set()
+
+    def subscribe(self) -> ProductChangeSubscriber:
+        """
+        Подписаться на изменения продуктов.
+
+        :return: подписчик
+        :raise TooManySubscribersException: выбрасывается, если достигнуто максимальное количество подписчиков
+        """
+        if len(self.subscribers) >= self.max_subscribers:
+            raise TooManySubscribersException
+
+        subscriber = ProductChangeSubscriber(buffer_size=self.buffer_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: ProductChangeSubscriber) -> None:
+        """
+        Отписаться от изменений продуктов.
+
+        :param subscriber: подписчик
+        """
+        self.subscribers.discard(subscriber)
+
+    def publish(self, payload: str) -> None:
+        """
+        Раздать уведомление об изменениях продуктов всем подписчикам.
+
+        Уведомление о сбросе (изменено слишком много продуктов) сбрасывает буферы подписчиков.
+
+        :param payload: json-массив изменений продуктов или сброс {"op": "reset"}
+        """
+        try:
+            changes = json.loads(payload)
+        except ValueError:
+            logger.warning('Malformed product change notification: %r', payload)
+            return
+
+        if isinstance(changes, dict) and changes.get('op') == 'reset':
+            self.reset()
+            return
+        for subscriber in self.subscribers:
+            for change in changes:
+                subscriber.put(change)
+
+    def reset(self) -> None:
+        """Сбросить буферы всех подписчиков, если часть изменений могла быть потеряна."""
+        for subscriber in self.subscribers:
+            subscriber.reset()
+
+    def close(self) -> None:
+        """Закрыть подписки всех подписчиков."""
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+
+async def _listen(hub: ProductChangeHub, params: dict, check_interval: float, reconnect_interval: float) -> None:
+    while True:
+        try:
+            async with aiopg.connect(**params) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute('LISTEN {channel}'.format(channel=PRODUCT_CHANGES_CHANNEL))
+                    # Изменения, произошедшие до подписки (или во время переподключения), не доставлены.
+                    hub.reset()
+                    while True:
+                        try:
+                            notification = await asyncio.wait_for(conn.notifies.get(), check_interval)
+                        except asyncio.TimeoutError:
+                            # Очередь уведомлений не сообщает о разрыве соединения, поэтому оно проверяется запросом.
+                            await cursor.execute('SELECT 1')
+                            continue
+                        hub.publish(notification.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Product change listener failed, reconnecting')
+        await asyncio.sleep(reconnect_interval)
+
+
+async def init_changefeed(app) -> None:
+    """
+    Запуск раздачи изменений продуктов.
+
+    Каждый процесс держит одно выделенное (не из пула) соединение с LISTEN на канале
+    изменений продуктов; для хранилища в памяти используются его уведомления.
+    """
+    config = app['config'].get('product_stream', {})
+    hub = ProductChangeHub(max_subscribers=config.get('max_subscribers', 1000),
+                           buffer_size=config.get('buffer_size', 1000))
+    app['product_changes'] = hub
+    if app['dao_backend'] == 'memory':
+        app['db'].listen(PRODUCT_CHANGES_CHANNEL, hub.publish)
+        return
+
+    params = {key: value for key, value in app['config']['postgres'].items() if key in CONNECTION_PARAMS}
+    app['product_changes_task'] = asyncio.ensure_future(_listen(
+        hub, params,
+        check_interval=config.get('check_interval', 30),
+        reconnect_interval=config.get('reconnect_interval', 1)))
+
+
+async def shutdown_changefeed(app) -> None:
+    """Закрытие подписок, чтобы открытые потоки изменений завершились до остановки сервера."""
+    hub: Optional[ProductChangeHub] = app.get('product_changes')
+    if hub is not None:
+        hub.close()
+
+
+async def close_changefeed(app) -> None:
+    """Остановка прослушивания изменений продуктов."""
+    task = app.get('product_changes_task')
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,100 @@
+import gzip
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli является необязательной зависимостью
+    brotli = None
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _deflate(body: bytes, level: int) -> bytes:
+    return zlib.compress(body, level)
+
+
+def _brotli(body: bytes, level: int) -> bytes:
+    # Уровни brotli (0-11) не совпадают с уровнями zlib (0-9), поэтому используется быстрый уровень.
+    return brotli.compress(body, quality=min(level, 5))
+
+
+CODECS: Dict[str, Callable[[bytes, int], bytes]] = OrderedDict([('gzip', _gzip), ('deflate', _deflate)])
+if brotli is not None:
+    CODECS['br'] = _brotli
+    CODECS.move_to_end('br', last=False)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбрать алгоритм сжатия по заголовку "Accept-Encoding".
+
+    Из приемлемых для клиента алгоритмов выбирается алгоритм с наибольшим весом (q),
+    при равных весах - в порядке предпочтения сервера (br, gzip, deflate).
+
+    :param accept_encoding: значение заголовка "Accept-Encoding"
+    :return: наименование алгоритма или None, если сжатие не требуется
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    wildcard = weights.get('*', 0.0)
+    candidates = [(weights.get(coding, wildcard), -order, coding) for order, coding in enumerate(CODECS)]
+    weight, _, coding = max(candidates)
+    return coding if weight > 0 else None
+
+
+class CompressedBodyCache:
+    """
+    LRU-кэш сжатых тел ответов.
+
+    Ключ задается вызывающим и должен однозначно определять содержимое тела без его чтения
+    (например, алгоритм, адрес ресурса и ETag ответа), поэтому неизменившееся содержимое
+    (например, список продуктов из снимка каталога) сжимается один раз, а при изменении
+    содержимого устаревшая запись вытесняется новыми.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        """
+        Инициализация кэша.
+
+        :param max_entries: максимальное количество хранимых сжатых тел
+        """
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, bytes] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """
+        Вернуть сжатое тело из кэша.
+
+        :param key: ключ содержимого
+        :return: сжатое тело или None, если его нет в кэше
+        """
+        compressed = self._entries.get(key)
+        if compressed is not None:
+            self._entries.move_to_end(key)
+        return compressed
+
+    def put(self, key: Hashable, compressed: bytes) -> None:
+        """
+        Сохранить сжатое тело в кэш, вытеснив давно не использованное при переполнении.
+
+        :param key: ключ содержимого
+        :param compressed: сжатое тело
+        """
+        self._entries[key] = compressed
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
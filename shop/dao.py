@@ -1,15 +1,28 @@
+import copy
+import json
+import re
+import time
 from abc import ABC, abstractmethod
-from typing import Iterable
-from uuid import UUID
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
 
 import sqlalchemy as sa
 from aiopg.sa.connection import SAConnection
 from overrides import overrides
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import ClauseElement
 
-from db import order_product_table, order_table, product_table, token_table, user_order_table, user_table
-from exceptions import (OrderNotFoundException, ProductNotFoundException, TokenNotFoundException,
-                        UserNotFoundException)
-from storage import AccessToken, Order, OrderProduct, Product, User, UserOrder
+from db import (PRODUCT_CHANGES_CHANNEL, PRODUCT_SEARCH_CONFIG, order_product_table, order_table,
+                product_sales_hourly_table, product_sales_table, product_search_vector, product_table,
+                revoked_token_table, token_table, user_order_table, user_table)
+from exceptions import (OrderNotFoundException, ProductAlreadyExistsException, ProductNotEnoughException,
+                        ProductNotFoundException, TokenNotFoundException, UserNotFoundException)
+from memory import MemoryConnection
+from storage import (AccessToken, Order, OrderProduct, Product, ProductSales, ProductSearch, TokenClaims, User,
+                     UserOrder)
+from tracing import traced_methods
 
 
 class UserDAO(ABC):
@@ -53,6 +66,28 @@ class AccessTokenDAO(ABC):
         pass
 
 
+class RevokedTokenDAO(ABC):
+    """Абстрактный слой доступа к БД (DAO) для списка отозванных подписанных токенов."""
+
+    @abstractmethod
+    async def get_active_ids(self) -> Iterable[str]:
+        """
+        Получить идентификаторы отозванных токенов, срок действия которых еще не истек.
+
+        :return: коллекция идентификаторов токенов
+        """
+        pass
+
+    @abstractmethod
+    async def create(self, claims: TokenClaims) -> None:
+        """
+        Отозвать токен.
+
+        :param claims: утверждения отзываемого токена
+        """
+        pass
+
+
 class ProductDAO(ABC):
     """Абстрактный слой доступа к БД (DAO) для сущности Продукт (Product)."""
 
@@ -75,6 +110,25 @@ class ProductDAO(ABC):
         """
         pass
 
+    @abstractmethod
+    async def get_all_slugs(self) -> List[str]:
+        """
+        Вернуть короткие имена (slug) всех продуктов.
+
+        :return: список slug-ов продуктов
+        """
+        pass
+
+    @abstractmethod
+    async def search(self, search: ProductSearch) -> Iterable[Product]:
+        """
+        Найти продукты, упорядоченные по релевантности.
+
+        :param search: параметры поиска
+        :return: страница коллекции объектов класса `Product`
+        """
+        pass
+
     @abstractmethod
     async def create(self, product: Product) -> Product:
         """
@@ -86,26 +140,45 @@ class ProductDAO(ABC):
 
         :param product: экземпляр продукта, который необходимо создать
         :return: созданный экземпляр продукта
+        :raise ProductAlreadyExistsException: исключение в случае, если продукт с таким slug уже существует
         """
         pass
 
     @abstractmethod
-    async def update(self, product: Product) -> Product:
+    async def update_by_slug(self, slug: str, values: Dict[str, Any]) -> Product:
         """
-        Обновить продукт.
+        Обновить продукт по slug.
 
-        :param product: экземпляр продукта с данными, которые необходимо обновить
+        :param slug: короткое наименование продукта
+        :param values: новые значения изменяемых полей продукта
         :return: обновленный экземпляр продукта
+        :raise ProductNotFoundException: исключение в случае, если продукт не был найден
+        """
+        pass
+
+    @abstractmethod
+    async def take_from_stock(self, product: Product, quantity: int) -> Product:
+        """
+        Списать количество продукта со склада.
+
+        Остаток уменьшается одной атомарной операцией и только если его достаточно,
+        поэтому одновременные заказы не перезаписывают списания друг друга.
+
+        :param product: экземпляр продукта
+        :param quantity: списываемое количество
+        :return: экземпляр продукта с новым остатком
+        :raise ProductNotEnoughException: исключение в случае, если продукта на складе недостаточно
         """
         pass
 
     @abstractmethod
-    async def delete(self, product: Product) -> Product:
+    async def delete_by_slug(self, slug: str) -> Product:
         """
-        Удалить продукт.
+        Удалить продукт по slug.
 
-        :param product: экземпляр продукта, который необходимо удалить
+        :param slug: короткое наименование продукта
         :return: удаленный экземпляр продукта
+        :raise ProductNotFoundException: исключение в случае, если продукт не был найден
         """
         pass
 
@@ -125,10 +198,27 @@ class OrderDAO(ABC):
         pass
 
     @abstractmethod
-    async def create(self) -> Order:
+    async def get_all_by_user(self, user_id: UUID, before: Optional[int], limit: int) -> Iterable[Order]:
+        """
+        Получить страницу заказов пользователя, упорядоченных по убыванию номера.
+
+        Используется keyset-пагинация: в выборку попадают только заказы
+        с номером меньше `before`, что позволяет не сканировать предыдущие страницы.
+
+        :param user_id: идентификатор пользователя
+        :param before: номер заказа, с которого начинается страница (не включительно),
+                       None - первая страница
+        :param limit: максимальное количество заказов на странице
+        :return: коллекция экземпляров заказов
+        """
+        pass
+
+    @abstractmethod
+    async def create(self, total: Decimal) -> Order:
         """
         Создать заказ.
 
+        :param total: сумма заказа
         :return: созданный экземпляр заказа
         """
         pass
@@ -138,21 +228,32 @@ class OrderProductDAO(ABC):
     """Абстрактный слой доступа к БД (DAO) для связи Продуктов и Заказов (OrderProduct)."""
 
     @abstractmethod
-    async def get_all(self, order_id: UUID) -> Iterable[OrderProduct]:
+    async def get_all(self, order: Order) -> Iterable[OrderProduct]:
         """
-        Получить все связи продукта и заказа по идентификатора заказа.
+        Получить все связи продукта и заказа по заказу.
 
-        :param order_id: идентификатор заказа
+        :param order: экземпляр заказа
         :return: коллекция экземпляров связей
         """
         pass
 
     @abstractmethod
-    async def create(self, order_product: OrderProduct) -> OrderProduct:
+    async def get_all_by_orders(self, orders: Iterable[Order]) -> Iterable[OrderProduct]:
+        """
+        Получить все связи продукта и заказа для нескольких заказов одним запросом.
+
+        :param orders: коллекция экземпляров заказов
+        :return: коллекция экземпляров связей
+        """
+        pass
+
+    @abstractmethod
+    async def create(self, order_product: OrderProduct, order_number: int) -> OrderProduct:
         """
         Создать связь продукта и заказа.
 
         :param order_product: экземпляр связи, которую необходимо создать
+        :param order_number: номер заказа
         :return: созданный экземпляр связи
         """
         pass
@@ -172,16 +273,84 @@ class UserOrderDAO(ABC):
         pass
 
     @abstractmethod
-    async def create(self, user_order: UserOrder) -> UserOrder:
+    async def create(self, user_order: UserOrder, order_number: int) -> UserOrder:
         """
         Создать связь пользователя и продукта.
 
         :param user_order: экземпляр связи, которую необходимо создать
+        :param order_number: номер заказа
         :return: созданный экземпляр связи
         """
         pass
 
 
+class ProductSalesDAO(ABC):
+    """Абстрактный слой доступа к БД (DAO) для агрегатов продаж продуктов."""
+
+    @abstractmethod
+    async def add(self, sales: Iterable[ProductSales]) -> None:
+        """
+        Прибавить продажи к итогам за все время и к почасовой корзине текущего часа.
+
+        :param sales: коллекция продаж, не более одной на продукт
+        """
+        pass
+
+    @abstractmethod
+    async def get_top(self,
+                      since: Optional[datetime],
+                      until: Optional[datetime],
+                      order_by: str,
+                      limit: int) -> Iterable[ProductSales]:
+        """
+        Получить самые продаваемые продукты за период.
+
+        Границы периода округляются вниз до начала часа.
+
+        :param since: начало периода (включительно), None - без ограничения
+        :param until: конец периода (не включительно), None - без ограничения
+        :param order_by: поле сортировки по убыванию ('units_sold' или 'revenue')
+        :param limit: максимальное количество продуктов
+        :return: коллекция продаж продуктов с их slug и наименованием
+        """
+        pass
+
+
+def _escape_like(value: str) -> str:
+    """Экранировать спецсимволы шаблона LIKE."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _prefix_search(text: str) -> Tuple[ClauseElement, ClauseElement]:
+    condition = sa.func.lower(product_table.c.name).like(_escape_like(text.lower()) + '%')
+    rank = sa.func.similarity(product_table.c.name, text)
+    return condition, rank
+
+
+def _substring_search(text: str) -> Tuple[ClauseElement, ClauseElement]:
+    pattern = '%' + _escape_like(text) + '%'
+    condition = sa.or_(product_table.c.name.ilike(pattern), product_table.c.description.ilike(pattern))
+    rank = sa.func.greatest(sa.func.similarity(product_table.c.name, text),
+                            sa.func.similarity(product_table.c.description, text))
+    return condition, rank
+
+
+def _fulltext_search(text: str) -> Tuple[ClauseElement, ClauseElement]:
+    vector = product_search_vector()
+    tsquery = sa.func.websearch_to_tsquery(sa.literal_column("'{config}'".format(config=PRODUCT_SEARCH_CONFIG)), text)
+    return vector.op('@@')(tsquery), sa.func.ts_rank(vector, tsquery)
+
+
+PRODUCT_SEARCH_MODES = {
+    'prefix': _prefix_search,
+    'substring': _substring_search,
+    'fulltext': _fulltext_search
+}
+
+# Номер заказа в orders_products нужен только для секционирования и не входит в сущность OrderProduct.
+ORDER_PRODUCT_COLUMNS = [column for column in order_product_table.c if column.name != 'order_number']
+
+
 class BaseSqlAlchemyDAO(ABC):
     """Базовый DAO-класс, инкапсулирующий в себе конструктор, принимающий подключение к БД."""
 
@@ -194,6 +363,7 @@ class BaseSqlAlchemyDAO(ABC):
         self.conn = conn
 
 
+@traced_methods
 class SqlAlchemyUserDAO(BaseSqlAlchemyDAO, UserDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для сущности Пользователь (User)."""
 
@@ -221,6 +391,7 @@ class SqlAlchemyUserDAO(BaseSqlAlchemyDAO, UserDAO):
         return User(**row)
 
 
+@traced_methods
 class SqlAlchemyTokenDAO(BaseSqlAlchemyDAO, AccessTokenDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для сущности Токен (AccessToken)."""
 
@@ -237,6 +408,28 @@ class SqlAlchemyTokenDAO(BaseSqlAlchemyDAO, AccessTokenDAO):
         return AccessToken(**row)
 
 
+@traced_methods
+class SqlAlchemyRevokedTokenDAO(BaseSqlAlchemyDAO, RevokedTokenDAO):
+    """Реализация абстрактного слоя доступа к БД (DAO) для списка отозванных подписанных токенов."""
+
+    @overrides
+    async def get_active_ids(self) -> Iterable[str]:
+        query = sa.select([revoked_token_table.c.id]). \
+            where(revoked_token_table.c.expires_at > sa.func.now())
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [row.id for row in rows]
+
+    @overrides
+    async def create(self, claims: TokenClaims) -> None:
+        expires_at = datetime.fromtimestamp(claims.expires_at, tz=timezone.utc)
+        query = insert(revoked_token_table). \
+            values(id=claims.id, expires_at=expires_at). \
+            on_conflict_do_nothing()
+        await self.conn.execute(query)
+
+
+@traced_methods
 class SqlAlchemyProductDAO(BaseSqlAlchemyDAO, ProductDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для сущности Продукт (Product)."""
 
@@ -259,30 +452,90 @@ class SqlAlchemyProductDAO(BaseSqlAlchemyDAO, ProductDAO):
         products = [Product(**row) for row in rows]
         return products
 
+    @overrides
+    async def get_all_slugs(self) -> List[str]:
+        query = sa.select([product_table.c.slug])
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [row.slug for row in rows]
+
+    @overrides
+    async def search(self, search: ProductSearch) -> Iterable[Product]:
+        condition, rank = PRODUCT_SEARCH_MODES[search.mode](search.text)
+        conditions = [condition]
+        if search.min_price is not None:
+            conditions.append(product_table.c.price >= search.min_price)
+        if search.max_price is not None:
+            conditions.append(product_table.c.price <= search.max_price)
+        if search.in_stock:
+            conditions.append(product_table.c.left_in_stock > 0)
+
+        query = product_table.select(). \
+            where(sa.and_(*conditions)). \
+            order_by(rank.desc(), product_table.c.slug). \
+            limit(search.limit). \
+            offset(search.offset)
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [Product(**row) for row in rows]
+
     @overrides
     async def create(self, product: Product) -> Product:
-        insert = product_table.insert(). \
+        query = insert(product_table). \
             values(**dict(product)). \
-            returning(product_table.c.id)
-        result = await self.conn.execute(insert)
-        inserted_primary_key = await result.scalar()
-        return Product(id=inserted_primary_key, **dict(product))
+            on_conflict_do_nothing(index_elements=[product_table.c.slug]). \
+            returning(*product_table.c)
+        result = await self.conn.execute(query)
+        row = await result.fetchone()
+
+        if row is None:
+            raise ProductAlreadyExistsException
+
+        return Product(**row)
 
     @overrides
-    async def update(self, product: Product) -> Product:
+    async def update_by_slug(self, slug: str, values: Dict[str, Any]) -> Product:
         query = product_table.update(). \
-            where(product_table.c.id == product.id). \
-            values(**dict(product))
-        await self.conn.execute(query)
-        return product
+            where(product_table.c.slug == slug). \
+            values(**values). \
+            returning(*product_table.c)
+        result = await self.conn.execute(query)
+        row = await result.fetchone()
+
+        if row is None:
+            raise ProductNotFoundException
+
+        return Product(**row)
 
     @overrides
-    async def delete(self, product: Product) -> Product:
-        query = product_table.delete().where(product_table.c.id == product.id)
-        await self.conn.execute(query)
-        return product
+    async def take_from_stock(self, product: Product, quantity: int) -> Product:
+        query = product_table.update(). \
+            where(sa.and_(product_table.c.slug == product.slug, product_table.c.left_in_stock >= quantity)). \
+            values(left_in_stock=product_table.c.left_in_stock - quantity). \
+            returning(*product_table.c)
+        result = await self.conn.execute(query)
+        row = await result.fetchone()
+
+        if row is None:
+            raise ProductNotEnoughException(product=product)
 
+        return Product(**row)
+
+    @overrides
+    async def delete_by_slug(self, slug: str) -> Product:
+        query = product_table.delete(). \
+            where(product_table.c.slug == slug). \
+            returning(*product_table.c)
+        result = await self.conn.execute(query)
+        row = await result.fetchone()
+
+        if row is None:
+            raise ProductNotFoundException
 
+        return Product(**row)
+
+
+@traced_methods
 class SqlAlchemyOrderDAO(BaseSqlAlchemyDAO, OrderDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для сущности Заказ (Order)."""
 
@@ -299,33 +552,70 @@ class SqlAlchemyOrderDAO(BaseSqlAlchemyDAO, OrderDAO):
         return Order(**row)
 
     @overrides
-    async def create(self) -> Order:
+    async def get_all_by_user(self, user_id: UUID, before: Optional[int], limit: int) -> Iterable[Order]:
+        # Номера заказов страницы выбираются по индексу users_orders, а сами заказы - по списку номеров,
+        # чтобы при секционировании orders запрос затрагивал только секции с этими номерами.
+        query = sa.select([user_order_table.c.order_number]). \
+            where(user_order_table.c.user_id == user_id)
+        if before is not None:
+            query = query.where(user_order_table.c.order_number < before)
+        query = query.order_by(user_order_table.c.order_number.desc()).limit(limit)
+        result = await self.conn.execute(query)
+        numbers = [row[0] for row in await result.fetchall()]
+        if not numbers:
+            return []
+
+        query = order_table.select(). \
+            where(order_table.c.number.in_(numbers)). \
+            order_by(order_table.c.number.desc())
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [Order(**row) for row in rows]
+
+    @overrides
+    async def create(self, total: Decimal) -> Order:
         query = order_table.insert(). \
-            values(). \
-            returning(order_table.c.id, order_table.c.number)
+            values(total=total). \
+            returning(order_table.c.id, order_table.c.number, order_table.c.total, order_table.c.created_at)
         result = await self.conn.execute(query)
         fields = await result.fetchone()
-        return Order(id=fields.id, number=fields.number)
+        return Order(**fields)
 
 
+@traced_methods
 class SqlAlchemyOrderProductDAO(BaseSqlAlchemyDAO, OrderProductDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для связи Продуктов и Заказов (OrderProduct)."""
 
     @overrides
-    async def get_all(self, order_id: UUID) -> Iterable[OrderProduct]:
-        query = order_product_table.select(). \
-            where(order_product_table.c.order_id == order_id)
+    async def get_all(self, order: Order) -> Iterable[OrderProduct]:
+        query = sa.select(ORDER_PRODUCT_COLUMNS). \
+            where(order_product_table.c.order_number == order.number). \
+            where(order_product_table.c.order_id == order.id)
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [OrderProduct(**row) for row in rows]
+
+    @overrides
+    async def get_all_by_orders(self, orders: Iterable[Order]) -> Iterable[OrderProduct]:
+        orders = list(orders)
+        if not orders:
+            return []
+
+        query = sa.select(ORDER_PRODUCT_COLUMNS). \
+            where(order_product_table.c.order_number.in_([order.number for order in orders])). \
+            where(order_product_table.c.order_id.in_([order.id for order in orders]))
         result = await self.conn.execute(query)
         rows = await result.fetchall()
         return [OrderProduct(**row) for row in rows]
 
     @overrides
-    async def create(self, order_product: OrderProduct) -> OrderProduct:
-        query = order_product_table.insert().values(**dict(order_product))
+    async def create(self, order_product: OrderProduct, order_number: int) -> OrderProduct:
+        query = order_product_table.insert().values(order_number=order_number, **dict(order_product))
         await self.conn.execute(query)
         return order_product
 
 
+@traced_methods
 class SqlAlchemyUserOrderDAO(BaseSqlAlchemyDAO, UserOrderDAO):
     """Реализация абстрактного слоя доступа к БД (DAO) для связи Пользователей и Заказов (UserOrder)."""
 
@@ -341,7 +631,402 @@ class SqlAlchemyUserOrderDAO(BaseSqlAlchemyDAO, UserOrderDAO):
         return await result.scalar()
 
     @overrides
-    async def create(self, user_order: UserOrder) -> UserOrder:
-        query = user_order_table.insert().values(**dict(user_order))
+    async def create(self, user_order: UserOrder, order_number: int) -> UserOrder:
+        query = user_order_table.insert().values(order_number=order_number, **dict(user_order))
         await self.conn.execute(query)
         return user_order
+
+
+@traced_methods
+class SqlAlchemyProductSalesDAO(BaseSqlAlchemyDAO, ProductSalesDAO):
+    """Реализация абстрактного слоя доступа к БД (DAO) для агрегатов продаж продуктов."""
+
+    @overrides
+    async def add(self, sales: Iterable[ProductSales]) -> None:
+        # Строки блокируются в порядке идентификаторов продуктов, чтобы одновременные заказы не взаимоблокировались.
+        values = [{'product_id': item.product_id, 'units_sold': item.units_sold, 'revenue': item.revenue}
+                  for item in sorted(sales, key=lambda item: item.product_id)]
+        if not values:
+            return
+
+        bucket = sa.func.date_trunc('hour', sa.func.now())
+        for table, extra_values, index_elements in (
+                (product_sales_table, {}, ['product_id']),
+                (product_sales_hourly_table, {'bucket': bucket}, ['product_id', 'bucket'])):
+            query = insert(table).values([dict(value, **extra_values) for value in values])
+            query = query.on_conflict_do_update(index_elements=index_elements, set_={
+                'units_sold': table.c.units_sold + query.excluded.units_sold,
+                'revenue': table.c.revenue + query.excluded.revenue
+            })
+            await self.conn.execute(query)
+
+    @overrides
+    async def get_top(self,
+                      since: Optional[datetime],
+                      until: Optional[datetime],
+                      order_by: str,
+                      limit: int) -> Iterable[ProductSales]:
+        if since is None and until is None:
+            sales = product_sales_table
+        else:
+            hourly = product_sales_hourly_table
+            conditions = []
+            if since is not None:
+                conditions.append(hourly.c.bucket >= sa.func.date_trunc('hour', since))
+            if until is not None:
+                conditions.append(hourly.c.bucket < sa.func.date_trunc('hour', until))
+            sales = sa.select([
+                hourly.c.product_id,
+                sa.cast(sa.func.sum(hourly.c.units_sold), sa.BigInteger).label('units_sold'),
+                sa.func.sum(hourly.c.revenue).label('revenue')
+            ]).where(sa.and_(*conditions)).group_by(hourly.c.product_id).alias('sales')
+
+        top = sa.select([sales]). \
+            order_by(sales.c[order_by].desc(), sales.c.product_id). \
+            limit(limit). \
+            alias('top')
+        join = sa.join(top, product_table, product_table.c.id == top.c.product_id)
+        query = sa.select([top, product_table.c.slug, product_table.c.name]). \
+            select_from(join). \
+            order_by(top.c[order_by].desc(), top.c.product_id)
+        result = await self.conn.execute(query)
+        rows = await result.fetchall()
+        return [ProductSales(**row) for row in rows]
+
+
+WORD_RE = re.compile(r'\w+')
+
+
+def _memory_prefix_rank(product: Product, text: str) -> Optional[float]:
+    if not product.name.lower().startswith(text.lower()):
+        return None
+    return len(text) / len(product.name)
+
+
+def _memory_substring_rank(product: Product, text: str) -> Optional[float]:
+    pattern = text.lower()
+    ranks = [len(text) / len(field) for field in (product.name, product.description) if pattern in field.lower()]
+    return max(ranks) if ranks else None
+
+
+def _memory_fulltext_rank(product: Product, text: str) -> Optional[float]:
+    words = set(WORD_RE.findall(text.lower()))
+    document = WORD_RE.findall((product.name + ' ' + product.description).lower())
+    if not words or not words.issubset(document):
+        return None
+    return sum(word in words for word in document) / len(document)
+
+
+# Приближения условий и релевантности PRODUCT_SEARCH_MODES для хранилища в памяти.
+MEMORY_PRODUCT_SEARCH_MODES = {
+    'prefix': _memory_prefix_rank,
+    'substring': _memory_substring_rank,
+    'fulltext': _memory_fulltext_rank
+}
+
+
+def _matches_filters(product: Product, search: ProductSearch) -> bool:
+    if search.min_price is not None and product.price < search.min_price:
+        return False
+    if search.max_price is not None and product.price > search.max_price:
+        return False
+    return not search.in_stock or product.left_in_stock > 0
+
+
+def _product_change_payload(op: str, product: Product) -> str:
+    """Сформировать уведомление об изменении продукта так же, как триггер notify_product_changes."""
+    change = {'op': op, 'slug': product.slug}
+    if op != 'delete':
+        change.update(price=float(product.price), left_in_stock=product.left_in_stock)
+    return json.dumps([change])
+
+
+def _hour_bucket(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class BaseMemoryDAO(ABC):
+    """Базовый DAO-класс, инкапсулирующий в себе конструктор, принимающий подключение к хранилищу в памяти."""
+
+    def __init__(self, conn: MemoryConnection) -> None:
+        """
+        Инициализация DAO-экземпляра.
+
+        :param conn: экземпляр подключения к хранилищу в памяти
+        """
+        self.conn = conn
+        self.store = conn.store
+
+
+@traced_methods
+class MemoryUserDAO(BaseMemoryDAO, UserDAO):
+    """Реализация слоя доступа к данным (DAO) для сущности Пользователь (User) в памяти."""
+
+    @overrides
+    async def get_by_login(self, login: str) -> User:
+        user = self.store.users.get_by('login', login)
+        if user is None:
+            raise UserNotFoundException
+
+        return user
+
+    @overrides
+    async def get_by_token(self, token: str) -> User:
+        access_token = self.store.access_tokens.get_by('token', token)
+        user = self.store.users.get(access_token.user_id) if access_token is not None else None
+        if user is None:
+            raise UserNotFoundException
+
+        return user
+
+
+@traced_methods
+class MemoryTokenDAO(BaseMemoryDAO, AccessTokenDAO):
+    """Реализация слоя доступа к данным (DAO) для сущности Токен (AccessToken) в памяти."""
+
+    @overrides
+    async def get_by_login(self, login: str) -> AccessToken:
+        user = self.store.users.get_by('login', login)
+        access_tokens = self.store.access_tokens.group('user_id', user.id) if user is not None else []
+        if not access_tokens:
+            raise TokenNotFoundException
+
+        return access_tokens[0]
+
+
+@traced_methods
+class MemoryRevokedTokenDAO(BaseMemoryDAO, RevokedTokenDAO):
+    """Реализация слоя доступа к данным (DAO) для списка отозванных подписанных токенов в памяти."""
+
+    @overrides
+    async def get_active_ids(self) -> Iterable[str]:
+        now = time.time()
+        return [claims.id for claims in self.store.revoked_tokens.scan() if claims.expires_at > now]
+
+    @overrides
+    async def create(self, claims: TokenClaims) -> None:
+        await self.conn.lock()
+        if self.store.revoked_tokens.get(claims.id) is None:
+            self.conn.write(self.store.revoked_tokens, claims.id, claims)
+
+
+@traced_methods
+class MemoryProductDAO(BaseMemoryDAO, ProductDAO):
+    """Реализация слоя доступа к данным (DAO) для сущности Продукт (Product) в памяти."""
+
+    @overrides
+    async def get_by_slug(self, slug: str) -> Product:
+        product = self.store.products.get_by('slug', slug)
+        if product is None:
+            raise ProductNotFoundException
+
+        return product
+
+    @overrides
+    async def get_all(self) -> Iterable[Product]:
+        return [copy.copy(product) for product in self.store.products.scan()]
+
+    @overrides
+    async def get_all_slugs(self) -> List[str]:
+        return [product.slug for product in self.store.products.scan()]
+
+    @overrides
+    async def search(self, search: ProductSearch) -> Iterable[Product]:
+        get_rank = MEMORY_PRODUCT_SEARCH_MODES[search.mode]
+        found = []
+        for product in self.store.products.scan():
+            rank = get_rank(product, search.text) if _matches_filters(product, search) else None
+            if rank is not None:
+                found.append((rank, product))
+
+        found.sort(key=lambda item: (-item[0], item[1].slug))
+        return [copy.copy(product) for _, product in found[search.offset:search.offset + search.limit]]
+
+    @overrides
+    async def create(self, product: Product) -> Product:
+        await self.conn.lock()
+        if self.store.products.exists_by('slug', product.slug):
+            raise ProductAlreadyExistsException
+
+        created = copy.copy(product)
+        if created.id is None:
+            created.id = uuid4()
+        self.conn.write(self.store.products, created.id, created)
+        self.conn.notify(PRODUCT_CHANGES_CHANNEL, _product_change_payload('insert', created))
+        return created
+
+    @overrides
+    async def update_by_slug(self, slug: str, values: Dict[str, Any]) -> Product:
+        await self.conn.lock()
+        product = await self.get_by_slug(slug)
+        previous = (product.price, product.left_in_stock)
+        for prop, value in values.items():
+            setattr(product, prop, value)
+
+        self.conn.write(self.store.products, product.id, product)
+        if (product.price, product.left_in_stock) != previous:
+            self.conn.notify(PRODUCT_CHANGES_CHANNEL, _product_change_payload('update', product))
+        return product
+
+    @overrides
+    async def take_from_stock(self, product: Product, quantity: int) -> Product:
+        await self.conn.lock()
+        stored = self.store.products.get_by('slug', product.slug)
+        if stored is None or not stored.is_enough_in_stock(quantity):
+            raise ProductNotEnoughException(product=product)
+
+        stored.left_in_stock -= quantity
+        self.conn.write(self.store.products, stored.id, stored)
+        self.conn.notify(PRODUCT_CHANGES_CHANNEL, _product_change_payload('update', stored))
+        return copy.copy(stored)
+
+    @overrides
+    async def delete_by_slug(self, slug: str) -> Product:
+        await self.conn.lock()
+        product = await self.get_by_slug(slug)
+        self.conn.write(self.store.products, product.id, None)
+        self.conn.notify(PRODUCT_CHANGES_CHANNEL, _product_change_payload('delete', product))
+        return product
+
+
+@traced_methods
+class MemoryOrderDAO(BaseMemoryDAO, OrderDAO):
+    """Реализация слоя доступа к данным (DAO) для сущности Заказ (Order) в памяти."""
+
+    @overrides
+    async def get_by_number(self, number: int) -> Order:
+        order = self.store.orders.get_by('number', number)
+        if order is None:
+            raise OrderNotFoundException
+
+        return order
+
+    @overrides
+    async def get_all_by_user(self, user_id: UUID, before: Optional[int], limit: int) -> Iterable[Order]:
+        orders = [self.store.orders.get(user_order.order_id)
+                  for user_order in self.store.user_orders.group('user_id', user_id)]
+        orders = [order for order in orders if order is not None]
+        if before is not None:
+            orders = [order for order in orders if order.number < before]
+        orders.sort(key=lambda order: order.number, reverse=True)
+        return orders[:limit]
+
+    @overrides
+    async def create(self, total: Decimal) -> Order:
+        await self.conn.lock()
+        order = Order(id=uuid4(), number=self.store.next_order_number(), total=total,
+                      created_at=datetime.now(timezone.utc))
+        self.conn.write(self.store.orders, order.id, order)
+        return order
+
+
+@traced_methods
+class MemoryOrderProductDAO(BaseMemoryDAO, OrderProductDAO):
+    """Реализация слоя доступа к данным (DAO) для связи Продуктов и Заказов (OrderProduct) в памяти."""
+
+    @overrides
+    async def get_all(self, order: Order) -> Iterable[OrderProduct]:
+        return self.store.order_products.group('order_id', order.id)
+
+    @overrides
+    async def get_all_by_orders(self, orders: Iterable[Order]) -> Iterable[OrderProduct]:
+        return [order_product
+                for order in orders
+                for order_product in self.store.order_products.group('order_id', order.id)]
+
+    @overrides
+    async def create(self, order_product: OrderProduct, order_number: int) -> OrderProduct:
+        await self.conn.lock()
+        self.conn.write(self.store.order_products, (order_product.order_id, order_product.product_id), order_product)
+        return order_product
+
+
+@traced_methods
+class MemoryUserOrderDAO(BaseMemoryDAO, UserOrderDAO):
+    """Реализация слоя доступа к данным (DAO) для связи Пользователей и Заказов (UserOrder) в памяти."""
+
+    @overrides
+    async def exists(self, user_order: UserOrder) -> bool:
+        return self.store.user_orders.get((user_order.user_id, user_order.order_id)) is not None
+
+    @overrides
+    async def create(self, user_order: UserOrder, order_number: int) -> UserOrder:
+        await self.conn.lock()
+        self.conn.write(self.store.user_orders, (user_order.user_id, user_order.order_id), user_order)
+        return user_order
+
+
+@traced_methods
+class MemoryProductSalesDAO(BaseMemoryDAO, ProductSalesDAO):
+    """Реализация слоя доступа к данным (DAO) для агрегатов продаж продуктов в памяти."""
+
+    @overrides
+    async def add(self, sales: Iterable[ProductSales]) -> None:
+        await self.conn.lock()
+        bucket = _hour_bucket(datetime.now(timezone.utc))
+        for item in sales:
+            for table, pk in ((self.store.product_sales, item.product_id),
+                              (self.store.product_sales_hourly, (item.product_id, bucket))):
+                current = table.get(pk)
+                if current is None:
+                    current = ProductSales(product_id=item.product_id, units_sold=0, revenue=Decimal(0))
+                current.units_sold += item.units_sold
+                current.revenue += item.revenue
+                self.conn.write(table, pk, current)
+
+    @overrides
+    async def get_top(self,
+                      since: Optional[datetime],
+                      until: Optional[datetime],
+                      order_by: str,
+                      limit: int) -> Iterable[ProductSales]:
+        if since is None and until is None:
+            sales = [copy.copy(item) for item in self.store.product_sales.scan()]
+        else:
+            totals: Dict[UUID, ProductSales] = {}
+            for (product_id, bucket), item in list(self.store.product_sales_hourly.rows.items()):
+                if since is not None and bucket < _hour_bucket(since):
+                    continue
+                if until is not None and bucket >= _hour_bucket(until):
+                    continue
+                total = totals.setdefault(product_id, ProductSales(product_id=product_id, units_sold=0,
+                                                                   revenue=Decimal(0)))
+                total.units_sold += item.units_sold
+                total.revenue += item.revenue
+            sales = list(totals.values())
+
+        sales.sort(key=lambda item: (-getattr(item, order_by), item.product_id))
+        top = []
+        for item in sales[:limit]:
+            product = self.store.products.get(item.product_id)
+            if product is not None:
+                item.slug, item.name = product.slug, product.name
+                top.append(item)
+        return top
+
+
+DEFAULT_DAO_BACKEND = 'sqlalchemy'
+
+# Реализации DAO по наименованию backend-а хранения данных (раздел `dao` настроек).
+DAO_BACKENDS = {
+    'sqlalchemy': {
+        'user': SqlAlchemyUserDAO,
+        'access_token': SqlAlchemyTokenDAO,
+        'revoked_token': SqlAlchemyRevokedTokenDAO,
+        'product': SqlAlchemyProductDAO,
+        'order': SqlAlchemyOrderDAO,
+        'order_product': SqlAlchemyOrderProductDAO,
+        'user_order': SqlAlchemyUserOrderDAO,
+        'product_sales': SqlAlchemyProductSalesDAO
+    },
+    'memory': {
+        'user': MemoryUserDAO,
+        'access_token': MemoryTokenDAO,
+        'revoked_token': MemoryRevokedTokenDAO,
+        'product': MemoryProductDAO,
+        'order': MemoryOrderDAO,
+        'order_product': MemoryOrderProductDAO,
+        'user_order': MemoryUserOrderDAO,
+        'product_sales': MemoryProductSalesDAO
+    }
+}
@@ -2,11 +2,20 @@ import enum
 import uuid
 
 from aiopg.sa import create_engine
-from sqlalchemy import (Column, Enum, ForeignKey, Integer, MetaData, Numeric, Sequence, String, Table, Text)
+from sqlalchemy import (BigInteger, Column, DDL, DateTime, Enum, ForeignKey, Index, Integer, MetaData, Numeric,
+                        PrimaryKeyConstraint, Sequence, String, Table, Text, event, func, literal_column, text)
 from sqlalchemy.dialects.postgresql import UUID
 
 meta = MetaData()
 
+# Конфигурация полнотекстового поиска: 'simple' не зависит от языка описаний продуктов.
+PRODUCT_SEARCH_CONFIG = 'simple'
+
+# Последовательность номеров заказов. Шаг - максимальное количество шардов заказов:
+# на шарде последовательность начинается с ORDER_NUMBER_START + идентификатор шарда.
+ORDER_NUMBER_START = 1000
+ORDER_NUMBER_INCREMENT = 10
+
 
 class Gender(enum.Enum):
     """Перечисление (Enum) полов."""
@@ -36,11 +45,24 @@ token_table = Table(
     Column('user_id', UUID(as_uuid=True), ForeignKey('users.id'))
 )
 
+revoked_token_table = Table(
+    'revoked_tokens', meta,
+
+    Column('id', String(32), primary_key=True, nullable=False),
+    Column('expires_at', DateTime(timezone=True), nullable=False, index=True)
+)
+
 user_order_table = Table(
     'users_orders', meta,
 
     Column('user_id', UUID(as_uuid=True), ForeignKey('users.id')),
     Column('order_id', UUID(as_uuid=True), ForeignKey('orders.id')),
+    # Номер заказа - ключ секционирования orders (shop/partitions.py): история заказов
+    # выбирается по нему, чтобы запросы к orders затрагивали только нужные секции.
+    Column('order_number', Integer, nullable=False),
+
+    Index('users_orders_user_id_order_id_idx', 'user_id', 'order_id'),
+    Index('users_orders_user_id_order_number_idx', 'user_id', 'order_number')
 )
 
 order_table = Table(
@@ -48,7 +70,10 @@ order_table = Table(
 
     Column('id', UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False),
     Column('number', Integer, Sequence(
-        'order_number_seq', start=1000, increment=10), unique=True, nullable=False)
+        'order_number_seq', start=ORDER_NUMBER_START, increment=ORDER_NUMBER_INCREMENT), unique=True, nullable=False),
+    Column('created_at', DateTime(timezone=True), server_default=func.now(), nullable=False),
+    # Сумма заказа по ценам на момент его создания.
+    Column('total', Numeric, nullable=False)
 )
 
 order_product_table = Table(
@@ -56,7 +81,13 @@ order_product_table = Table(
 
     Column('product_id', UUID(as_uuid=True), ForeignKey('products.id')),
     Column('order_id', UUID(as_uuid=True), ForeignKey('orders.id')),
-    Column('quantity', Integer, nullable=False)
+    # Номер заказа - ключ секционирования orders_products (shop/partitions.py).
+    Column('order_number', Integer, nullable=False),
+    Column('quantity', Integer, nullable=False),
+    # Цена единицы продукта на момент создания заказа.
+    Column('price', Numeric, nullable=False),
+
+    Index('orders_products_order_id_idx', 'order_id')
 )
 
 product_table = Table(
@@ -67,9 +98,133 @@ product_table = Table(
     Column('description', Text, nullable=False),
     Column('slug', String(255), unique=True, nullable=False),
     Column('price', Numeric, nullable=False),
-    Column('left_in_stock', Integer, nullable=False)
+    Column('left_in_stock', Integer, nullable=False),
+
+    Index('products_name_prefix_idx', text('lower(name) text_pattern_ops')),
+    Index('products_name_trgm_idx', 'name',
+          postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    Index('products_description_trgm_idx', 'description',
+          postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}),
+    Index('products_search_idx',
+          text("to_tsvector('{config}', name || ' ' || description)".format(config=PRODUCT_SEARCH_CONFIG)),
+          postgresql_using='gin')
 )
 
+# Канал уведомлений (LISTEN/NOTIFY) об изменении цены и остатка продуктов.
+PRODUCT_CHANGES_CHANNEL = 'product_changes'
+
+# Уведомление содержит json-массив изменений продуктов, выполненных одним запросом. Если запрос
+# изменил больше PRODUCT_CHANGES_MAX_ROWS продуктов (импорт каталога, генерация данных) или массив
+# не помещается в уведомление (до 8000 байт), вместо него отправляется сброс {"op": "reset"}:
+# подписчики перечитывают каталог целиком.
+PRODUCT_CHANGES_MAX_ROWS = 50
+PRODUCT_CHANGES_MAX_PAYLOAD = 7900
+PRODUCT_CHANGES_RESET = '{"op": "reset"}'
+
+# Параметр сеанса, отключающий уведомления (значение 'off'). Используется при массовой загрузке
+# продуктов, после которой загрузчик сам отправляет сброс.
+PRODUCT_CHANGES_SETTING = 'shop.notify_product_changes'
+
+# Уведомления отправляются триггером, поэтому изменения приходят при фиксации транзакции
+# независимо от того, кто изменил продукт (заказ, API, импорт каталога), без лишних запросов.
+# Триггеры срабатывают один раз на запрос (FOR EACH STATEMENT) и читают измененные строки
+# из таблиц переходов; таблицы переходов нельзя задать для триггера на несколько событий,
+# поэтому на каждое событие создается свой триггер.
+PRODUCT_CHANGES_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION notify_product_changes() RETURNS trigger AS $$
+    DECLARE
+        changed integer;
+        changes json;
+    BEGIN
+        IF current_setting('{setting}', true) = 'off' THEN
+            RETURN NULL;
+        END IF;
+
+        IF TG_OP = 'INSERT' THEN
+            SELECT count(*), json_agg(c) INTO changed, changes FROM (
+                SELECT json_build_object('op', 'insert', 'slug', n.slug,
+                                         'price', n.price, 'left_in_stock', n.left_in_stock) AS c
+                FROM new_products n LIMIT {max_rows} + 1
+            ) t;
+        ELSIF TG_OP = 'UPDATE' THEN
+            SELECT count(*), json_agg(c) INTO changed, changes FROM (
+                SELECT json_build_object('op', 'update', 'slug', n.slug,
+                                         'price', n.price, 'left_in_stock', n.left_in_stock) AS c
+                FROM new_products n JOIN old_products o ON o.id = n.id
+                WHERE n.price IS DISTINCT FROM o.price OR n.left_in_stock IS DISTINCT FROM o.left_in_stock
+                LIMIT {max_rows} + 1
+            ) t;
+        ELSE
+            SELECT count(*), json_agg(c) INTO changed, changes FROM (
+                SELECT json_build_object('op', 'delete', 'slug', o.slug) AS c
+                FROM old_products o LIMIT {max_rows} + 1
+            ) t;
+        END IF;
+
+        IF changed = 0 THEN
+            RETURN NULL;
+        ELSIF changed > {max_rows} OR octet_length(changes::text) > {max_payload} THEN
+            PERFORM pg_notify('{channel}', '{reset}');
+        ELSE
+            PERFORM pg_notify('{channel}', changes::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS products_notify_insert ON products;
+    CREATE TRIGGER products_notify_insert
+        AFTER INSERT ON products REFERENCING NEW TABLE AS new_products
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_product_changes();
+
+    DROP TRIGGER IF EXISTS products_notify_update ON products;
+    CREATE TRIGGER products_notify_update
+        AFTER UPDATE ON products REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_product_changes();
+
+    DROP TRIGGER IF EXISTS products_notify_delete ON products;
+    CREATE TRIGGER products_notify_delete
+        AFTER DELETE ON products REFERENCING OLD TABLE AS old_products
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_product_changes();
+""".format(channel=PRODUCT_CHANGES_CHANNEL, setting=PRODUCT_CHANGES_SETTING, reset=PRODUCT_CHANGES_RESET,
+           max_rows=PRODUCT_CHANGES_MAX_ROWS, max_payload=PRODUCT_CHANGES_MAX_PAYLOAD)
+PRODUCT_CHANGES_TRIGGER = DDL(PRODUCT_CHANGES_TRIGGER_SQL)
+event.listen(product_table, 'after_create', PRODUCT_CHANGES_TRIGGER)
+
+# Агрегаты продаж, обновляемые инкрементально при создании заказа:
+# итоги за все время и почасовые корзины (bucket - начало часа).
+product_sales_table = Table(
+    'product_sales', meta,
+
+    Column('product_id', UUID(as_uuid=True), ForeignKey('products.id'), primary_key=True, nullable=False),
+    Column('units_sold', BigInteger, nullable=False),
+    Column('revenue', Numeric, nullable=False)
+)
+
+product_sales_hourly_table = Table(
+    'product_sales_hourly', meta,
+
+    Column('product_id', UUID(as_uuid=True), ForeignKey('products.id'), nullable=False),
+    Column('bucket', DateTime(timezone=True), nullable=False),
+    Column('units_sold', BigInteger, nullable=False),
+    Column('revenue', Numeric, nullable=False),
+
+    PrimaryKeyConstraint('product_id', 'bucket'),
+    Index('product_sales_hourly_bucket_idx', 'bucket')
+)
+
+
+def product_search_vector():
+    """
+    Вернуть выражение tsvector для полнотекстового поиска продуктов.
+
+    Выражение должно совпадать с выражением индекса `products_search_idx`,
+    иначе планировщик не сможет использовать индекс.
+    """
+    config = literal_column("'{config}'".format(config=PRODUCT_SEARCH_CONFIG))
+    document = product_table.c.name.concat(literal_column("' '")).concat(product_table.c.description)
+    return func.to_tsvector(config, document)
+
 
 async def init_pg(app) -> None:
     """Инициализация объекта engine БД."""
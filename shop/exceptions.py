@@ -31,6 +31,12 @@ class ProductNotFoundException(DAOException):
     pass
 
 
+class ProductAlreadyExistsException(DAOException):
+    """Исключение, выбрасываемое из DAO-слоя в случае, если продукт (Product) с таким slug уже существует."""
+
+    pass
+
+
 class OrderNotFoundException(DAOException):
     """Исключение, выбрасываемое из DAO-слоя в случае, если объект заказа (Order) не найден."""
 
@@ -49,3 +55,27 @@ class ProductNotEnoughException(BaseShopException):
         """
         super().__init__(*args)
         self.product = product
+
+
+class InvalidCatalogRowException(BaseShopException):
+    """Исключение, выбрасываемое при импорте каталога в случае некорректной строки файла."""
+
+    pass
+
+
+class CatalogExportCancelledException(BaseShopException):
+    """Исключение, прерывающее выгрузку каталога в случае, если ее получатель отключился."""
+
+    pass
+
+
+class InvalidTokenException(BaseShopException):
+    """Исключение, выбрасываемое в случае, если подписанный токен поврежден, подделан или просрочен."""
+
+    pass
+
+
+class TooManySubscribersException(BaseShopException):
+    """Исключение, выбрасываемое при превышении количества подписчиков на поток изменений продуктов."""
+
+    pass
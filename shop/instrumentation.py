@@ -0,0 +1,58 @@
+import time
+from typing import Any
+
+
+class QueryStats:
+    """Статистика запросов к БД, выполненных при обработке HTTP-запроса."""
+
+    def __init__(self) -> None:
+        """Инициализация пустой статистики."""
+        self.count = 0
+        self.time = 0.0
+
+    def add(self, duration: float) -> None:
+        """
+        Учесть выполненный запрос.
+
+        :param duration: время выполнения запроса, в секундах
+        """
+        self.count += 1
+        self.time += duration
+
+
+class InstrumentedConnection:
+    """
+    Обертка подключения к БД, учитывающая количество и время выполнения запросов.
+
+    Остальные атрибуты и методы делегируются исходному подключению.
+    """
+
+    def __init__(self, conn, stats: QueryStats) -> None:
+        """
+        Инициализация обертки.
+
+        :param conn: экземпляр подключения к БД
+        :param stats: статистика, в которую записываются выполненные запросы
+        """
+        self._conn = conn
+        self._stats = stats
+
+    async def execute(self, query, *multiparams, **params) -> Any:
+        """Выполнить запрос, учитывая время его выполнения."""
+        started = time.perf_counter()
+        try:
+            return await self._conn.execute(query, *multiparams, **params)
+        finally:
+            self._stats.add(time.perf_counter() - started)
+
+    async def scalar(self, query, *multiparams, **params) -> Any:
+        """Выполнить запрос и вернуть первое значение первой строки, учитывая время выполнения."""
+        started = time.perf_counter()
+        try:
+            return await self._conn.scalar(query, *multiparams, **params)
+        finally:
+            self._stats.add(time.perf_counter() - started)
+
+    def __getattr__(self, name: str) -> Any:
+        """Делегировать остальные атрибуты исходному подключению."""
+        return getattr(self._conn, name)
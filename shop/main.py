@@ -1,15 +1,77 @@
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
 
 from aiohttp import web
 from aiohttp_tokenauth import token_auth_middleware
 
-from dao import SqlAlchemyUserDAO
+from accesslog import JsonAccessLogger, access_logger, close_access_log, init_access_log
+from admission import AdmissionController
+from changefeed import close_changefeed, init_changefeed, shutdown_changefeed
+from dao import DAO_BACKENDS, DEFAULT_DAO_BACKEND
 from db import close_pg, init_pg
-from exceptions import DAOException
-from middlewares import transaction_middleware
+from exceptions import DAOException, InvalidTokenException
+from memory import init_memory
+from middlewares import (admission_middleware, compression_middleware, memory_transaction_middleware,
+                         rate_limit_middleware, slug_index_middleware, transaction_middleware)
+from partitions import close_partitions, init_partitions
+from profiler import SamplingProfiler, profiler_middleware
+from ratelimit import RateLimitController
+from replicas import close_replicas, init_replicas
 from routes import setup_routes
 from settings import config
+from sharding import close_shards, init_shards
+from singleflight import SingleFlight
+from slugindex import SlugIndex, close_slug_index, init_slug_index
+from snapshot import close_catalog_snapshot, init_catalog_snapshot
 from storage import User
+from tokens import close_tokens, init_tokens
+from tracing import SpanExporter, close_tracing, init_tracing, span, tracing_middleware
+from warmup import close_warmup, init_warmup
+
+
+def _get_lifecycle_hooks(in_memory: bool) -> Tuple[List[Callable], List[Callable]]:
+    if in_memory:
+        # Хранилище в памяти не требует пула соединений, реплик, шардов, секций и прогрева, а снимок каталога
+        # не нужен: хранилище принадлежит одному процессу.
+        return ([init_access_log, init_memory, init_tokens, init_changefeed, init_slug_index, init_tracing],
+                [close_tracing, close_slug_index, close_changefeed, close_tokens, close_access_log])
+    return ([init_access_log, init_pg, init_replicas, init_shards, init_partitions, init_tokens, init_warmup,
+             init_changefeed, init_slug_index, init_catalog_snapshot, init_tracing],
+            [close_tracing, close_catalog_snapshot, close_slug_index, close_changefeed, close_warmup, close_tokens,
+             close_partitions, close_shards, close_replicas, close_pg, close_access_log])
+
+
+def _create_slug_index(slug_index_config: dict) -> Optional[SlugIndex]:
+    if not slug_index_config.get('enabled', True):
+        return None
+    return SlugIndex(**{key: value for key, value in slug_index_config.items()
+                        if key in ('error_rate', 'growth_factor', 'min_capacity')})
+
+
+def _get_middlewares(user_loader: Callable,
+                     in_memory: bool,
+                     profiler: SamplingProfiler,
+                     slug_index: Optional[SlugIndex],
+                     span_exporter: SpanExporter) -> List[Callable]:
+    # Токен проверяется и частота запросов ограничивается до контроля допуска и открытия транзакции,
+    # чтобы запросы с недействительными токенами и лишние запросы клиента отклонялись,
+    # не занимая мест в очереди допуска и соединений с БД.
+    middlewares = [
+        profiler_middleware(profiler),
+        token_auth_middleware(
+            user_loader=user_loader,
+            exclude_routes=('/login', '/ready')
+        ),
+        rate_limit_middleware(RateLimitController(config.get('rate_limit', {}))),
+        admission_middleware(AdmissionController(config.get('admission', {}))),
+        compression_middleware(**config.get('compression', {})),
+        memory_transaction_middleware if in_memory else transaction_middleware
+    ]
+    if slug_index is not None:
+        middlewares.insert(-1, slug_index_middleware(slug_index))
+    tracing_config = config.get('tracing', {})
+    if tracing_config.get('enabled', False):
+        middlewares.insert(0, tracing_middleware(span_exporter, sample_rate=tracing_config.get('sample_rate', 0.01)))
+    return middlewares
 
 
 async def init() -> web.Application:
@@ -18,37 +80,71 @@ async def init() -> web.Application:
 
     :return: экземпляр aiohttp-приложения
     """
-    async def user_loader(token: str) -> Optional[User]:
+    async def load_user(token: str) -> Optional[User]:
         """
         Проверить валидность переданного токена.
 
+        Подписанный токен проверяется без обращения к БД: по подписи, сроку
+        действия и списку отозванных токенов. Остальные токены ищутся в БД.
+
         :param token: Токен из HTTP заголовка "Authorization"
-        :return: если токен найден в БД - вернет экземпляр класса `User`,
+        :return: если токен действителен - вернет экземпляр класса `User`,
                  в противном случае - None
         """
-        async with app['db'].acquire() as conn:
-            user_dao = SqlAlchemyUserDAO(conn)
+        signer = app['token_signer']
+        if signer is not None and signer.is_signed(token):
             try:
-                user = await user_dao.get_by_token(token)
-            except DAOException:
-                user = None
-            return user
+                claims = signer.verify(token)
+            except InvalidTokenException:
+                return None
+            return None if claims.id in app['token_deny_list'] else claims.to_user()
 
-    app = web.Application(middlewares=[
-        transaction_middleware,
-        token_auth_middleware(
-            user_loader=user_loader,
-            exclude_routes=('/login',)
-        )
-    ])
+        engine = app['db_router'].choose(token)
+
+        async def get_by_token() -> User:
+            async with engine.acquire() as conn:
+                return await DAO_BACKENDS[app['dao_backend']]['user'](conn).get_by_token(token)
+
+        try:
+            user = await app['single_flight'].do(('user_by_token', engine, token), get_by_token)
+        except DAOException:
+            user = None
+        return user
+
+    async def user_loader(token: str) -> Optional[User]:
+        """
+        Проверить валидность переданного токена в отдельном интервале трассировки.
+
+        :param token: Токен из HTTP заголовка "Authorization"
+        :return: экземпляр класса `User` или None
+        """
+        with span('auth.user_loader'):
+            return await load_user(token)
+
+    dao_backend = config.get('dao', {}).get('backend', DEFAULT_DAO_BACKEND)
+    in_memory = dao_backend == 'memory'
+    tracing_config = config.get('tracing', {})
+    span_exporter = SpanExporter(path=tracing_config.get('path'), endpoint=tracing_config.get('endpoint'))
+    profiler = SamplingProfiler()
+    slug_index = _create_slug_index(config.get('slug_index', {}))
+    middlewares = _get_middlewares(user_loader, in_memory, profiler=profiler, slug_index=slug_index,
+                                   span_exporter=span_exporter)
+    app = web.Application(middlewares=middlewares)
     app['config'] = config
+    app['dao_backend'] = dao_backend
+    app['single_flight'] = SingleFlight()
+    app['span_exporter'] = span_exporter
+    app['profiler'] = profiler
+    app['slug_index'] = slug_index
 
-    app.on_startup.append(init_pg)
-    app.on_cleanup.append(close_pg)
+    startup, cleanup = _get_lifecycle_hooks(in_memory)
+    app.on_startup.extend(startup)
+    app.on_cleanup.extend(cleanup)
+    app.on_shutdown.append(shutdown_changefeed)
 
     setup_routes(app)
     return app
 
 
 if __name__ == '__main__':
-    web.run_app(init())
+    web.run_app(init(), access_log_class=JsonAccessLogger, access_log=access_logger)
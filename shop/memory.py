@@ -0,0 +1,365 @@
+import asyncio
+import copy
+import json
+import os
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from db import Gender
+from replicas import ReplicaRouter
+from settings import BASE_DIR
+from storage import AccessToken, Product, User
+
+
+class MemoryTable:
+    """
+    Таблица хранилища в памяти.
+
+    Строки хранятся в словаре по первичному ключу. Уникальные индексы отображают
+    значение ключа индекса в первичный ключ строки, неуникальные (группы) - в упорядоченное
+    по времени добавления множество первичных ключей.
+    """
+
+    def __init__(self,
+                 unique: Optional[Dict[str, Callable[[Any], Hashable]]] = None,
+                 groups: Optional[Dict[str, Callable[[Any], Hashable]]] = None) -> None:
+        """
+        Инициализация пустой таблицы.
+
+        :param unique: функции получения ключа уникальных индексов из строки, по именам индексов
+        :param groups: функции получения ключа неуникальных индексов из строки, по именам индексов
+        """
+        self.rows: Dict[Hashable, Any] = {}
+        self._unique = {name: (key, {}) for name, key in (unique or {}).items()}
+        self._groups = {name: (key, {}) for name, key in (groups or {}).items()}
+
+    def get(self, pk: Hashable) -> Optional[Any]:
+        """
+        Получить строку по первичному ключу.
+
+        :param pk: первичный ключ
+        :return: копия строки или None
+        """
+        row = self.rows.get(pk)
+        return copy.copy(row) if row is not None else None
+
+    def get_by(self, index: str, value: Hashable) -> Optional[Any]:
+        """
+        Получить строку по уникальному индексу.
+
+        :param index: наименование индекса
+        :param value: значение ключа индекса
+        :return: копия строки или None
+        """
+        pk = self._unique[index][1].get(value)
+        return self.get(pk) if pk is not None else None
+
+    def exists_by(self, index: str, value: Hashable) -> bool:
+        """
+        Проверить наличие строки с данным значением уникального индекса.
+
+        :param index: наименование индекса
+        :param value: значение ключа индекса
+        :return: булево значение в зависимости от результата проверки
+        """
+        return value in self._unique[index][1]
+
+    def group(self, index: str, value: Hashable) -> List[Any]:
+        """
+        Получить строки по неуникальному индексу в порядке их добавления.
+
+        :param index: наименование индекса
+        :param value: значение ключа индекса
+        :return: список копий строк
+        """
+        return [copy.copy(self.rows[pk]) for pk in self._groups[index][1].get(value, ())]
+
+    def scan(self) -> Iterator[Any]:
+        """
+        Перебрать все строки таблицы без копирования.
+
+        :return: итератор строк
+        """
+        return iter(list(self.rows.values()))
+
+    def store(self, pk: Hashable, row: Optional[Any]) -> Optional[Any]:
+        """
+        Записать строку (или удалить ее, если row=None), обновив индексы.
+
+        :param pk: первичный ключ
+        :param row: новая строка или None
+        :return: предыдущая строка или None
+        """
+        old = self.rows.pop(pk, None)
+        if old is not None:
+            for key, index in self._unique.values():
+                del index[key(old)]
+            for key, index in self._groups.values():
+                members = index[key(old)]
+                del members[pk]
+                if not members:
+                    del index[key(old)]
+
+        if row is not None:
+            self.rows[pk] = row
+            for key, index in self._unique.values():
+                index[key(row)] = pk
+            for key, index in self._groups.values():
+                index.setdefault(key(row), {})[pk] = None
+        return old
+
+
+class MemoryStore:
+    """
+    Хранилище данных приложения в памяти процесса (DAO-backend memory).
+
+    Предназначено для тестов и нагрузочного профилирования сервисов и view без БД.
+    Подключения к хранилищу получаются так же, как из engine-а БД - через `acquire`.
+    """
+
+    def __init__(self) -> None:
+        """Инициализация пустого хранилища."""
+        self.users = MemoryTable(unique={'login': lambda row: row.login})
+        self.access_tokens = MemoryTable(unique={'token': lambda row: row.token},
+                                         groups={'user_id': lambda row: row.user_id})
+        self.revoked_tokens = MemoryTable()
+        self.products = MemoryTable(unique={'slug': lambda row: row.slug})
+        self.orders = MemoryTable(unique={'number': lambda row: row.number})
+        self.order_products = MemoryTable(groups={'order_id': lambda row: row.order_id})
+        self.user_orders = MemoryTable(groups={'user_id': lambda row: row.user_id})
+        self.product_sales = MemoryTable()
+        self.product_sales_hourly = MemoryTable()
+        self.order_number = 0
+        self.write_lock = asyncio.Lock()
+        self.listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+    def next_order_number(self) -> int:
+        """
+        Получить следующий номер заказа.
+
+        Как и последовательность БД, счетчик не откатывается вместе с транзакцией.
+
+        :return: номер заказа
+        """
+        self.order_number += 1
+        return self.order_number
+
+    def load(self, users=(), access_tokens=(), products=()) -> None:
+        """
+        Заполнить хранилище начальными данными.
+
+        :param users: коллекция пользователей
+        :param access_tokens: коллекция токенов доступа
+        :param products: коллекция продуктов с установленными id
+        """
+        for user in users:
+            self.users.store(user.id, copy.copy(user))
+        for access_token in access_tokens:
+            self.access_tokens.store(access_token.id, copy.copy(access_token))
+        for product in products:
+            self.products.store(product.id, copy.copy(product))
+
+    def listen(self, channel: str, callback: Callable[[str], None]) -> None:
+        """
+        Подписаться на уведомления канала (аналог LISTEN).
+
+        :param channel: наименование канала
+        :param callback: функция, вызываемая с полезной нагрузкой каждого уведомления
+        """
+        self.listeners.setdefault(channel, []).append(callback)
+
+    def dispatch(self, notifications: List[Tuple[str, str]]) -> None:
+        """
+        Доставить уведомления подписчикам каналов.
+
+        :param notifications: список пар (канал, полезная нагрузка)
+        """
+        for channel, payload in notifications:
+            for callback in self.listeners.get(channel, ()):
+                callback(payload)
+
+    def connect(self) -> 'MemoryConnection':
+        """
+        Открыть подключение к хранилищу.
+
+        :return: экземпляр подключения
+        """
+        return MemoryConnection(self)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator['MemoryConnection']:
+        """
+        Получить подключение к хранилищу (аналог `acquire` engine-а БД).
+
+        :return: экземпляр подключения
+        """
+        yield self.connect()
+
+
+class MemoryTransaction:
+    """
+    Транзакция хранилища в памяти.
+
+    Изменения применяются к таблицам сразу и записываются в журнал отмены,
+    по которому восстанавливаются при откате. Пишущие транзакции выполняются
+    по очереди: первая запись (или явный вызов `lock` перед чтениями, от которых зависит
+    запись) захватывает блокировку хранилища до завершения транзакции. Читающие
+    транзакции не блокируются и видят незафиксированные изменения (уровень изоляции
+    read uncommitted).
+    """
+
+    def __init__(self, store: MemoryStore) -> None:
+        """
+        Начать транзакцию.
+
+        :param store: хранилище
+        """
+        self.store = store
+        self.is_active = True
+        self._undo: List[Tuple[MemoryTable, Hashable, Optional[Any]]] = []
+        self._notifications: List[Tuple[str, str]] = []
+        self._locked = False
+
+    async def lock(self) -> None:
+        """Захватить блокировку записи хранилища, если она еще не захвачена."""
+        if not self._locked:
+            await self.store.write_lock.acquire()
+            self._locked = True
+
+    def store_row(self, table: MemoryTable, pk: Hashable, row: Optional[Any]) -> None:
+        """
+        Записать или удалить строку, запомнив ее предыдущее значение для отката.
+
+        :param table: таблица
+        :param pk: первичный ключ
+        :param row: новая строка или None
+        """
+        self._undo.append((table, pk, table.store(pk, row)))
+
+    def notify(self, channel: str, payload: str) -> None:
+        """
+        Отправить уведомление при фиксации транзакции.
+
+        :param channel: наименование канала
+        :param payload: полезная нагрузка
+        """
+        self._notifications.append((channel, payload))
+
+    async def commit(self) -> None:
+        """Зафиксировать транзакцию и доставить ее уведомления."""
+        notifications, self._notifications = self._notifications, []
+        self._undo.clear()
+        self._close()
+        self.store.dispatch(notifications)
+
+    async def rollback(self) -> None:
+        """Откатить транзакцию."""
+        for table, pk, row in reversed(self._undo):
+            table.store(pk, row)
+        self._undo.clear()
+        self._notifications.clear()
+        self._close()
+
+    def _close(self) -> None:
+        self.is_active = False
+        if self._locked:
+            self._locked = False
+            self.store.write_lock.release()
+
+
+class MemoryConnection:
+    """Подключение к хранилищу в памяти."""
+
+    def __init__(self, store: MemoryStore) -> None:
+        """
+        Инициализация подключения.
+
+        :param store: хранилище
+        """
+        self.store = store
+        self._trans: Optional[MemoryTransaction] = None
+
+    async def begin(self) -> MemoryTransaction:
+        """
+        Начать транзакцию.
+
+        :return: экземпляр транзакции
+        """
+        self._trans = MemoryTransaction(self.store)
+        return self._trans
+
+    async def lock(self) -> None:
+        """
+        Захватить блокировку записи хранилища до конца текущей транзакции.
+
+        Вызывается перед проверками, предшествующими записи, чтобы они
+        не могли быть нарушены одновременной пишущей транзакцией.
+        Вне транзакции ничего не делает.
+        """
+        if self._trans is not None and self._trans.is_active:
+            await self._trans.lock()
+
+    def write(self, table: MemoryTable, pk: Hashable, row: Optional[Any]) -> None:
+        """
+        Записать или удалить строку таблицы.
+
+        Внутри транзакции запись откатывается вместе с транзакцией, вне транзакции - применяется сразу.
+
+        :param table: таблица
+        :param pk: первичный ключ
+        :param row: новая строка или None
+        """
+        row = copy.copy(row)
+        if self._trans is None or not self._trans.is_active:
+            table.store(pk, row)
+        else:
+            self._trans.store_row(table, pk, row)
+
+    def notify(self, channel: str, payload: str) -> None:
+        """
+        Отправить уведомление (аналог pg_notify).
+
+        Внутри транзакции уведомление доставляется при ее фиксации, вне транзакции - сразу.
+
+        :param channel: наименование канала
+        :param payload: полезная нагрузка
+        """
+        if self._trans is None or not self._trans.is_active:
+            self.store.dispatch([(channel, payload)])
+        else:
+            self._trans.notify(channel, payload)
+
+
+def _load_fixture(store: MemoryStore, path: str) -> None:
+    with open(path, encoding='utf-8') as file:
+        fixture = json.load(file)
+
+    store.load(
+        users=[User(**dict(user, id=UUID(user['id']), sex=Gender[user['sex']]))
+               for user in fixture.get('users', [])],
+        access_tokens=[AccessToken(id=UUID(token['id']), token=token['token'], user_id=UUID(token['user_id']))
+                       for token in fixture.get('access_tokens', [])],
+        products=[Product(**dict(product, id=UUID(product['id']), price=Decimal(str(product['price']))))
+                  for product in fixture.get('products', [])]
+    )
+
+
+async def init_memory(app) -> None:
+    """
+    Инициализация хранилища в памяти вместо engine-а БД.
+
+    Если в разделе `dao` настроек задан `fixture`, хранилище заполняется пользователями,
+    токенами и продуктами из указанного json-файла (путь - относительно корня проекта).
+    Прогрев не требуется, поэтому приложение сразу считается готовым.
+    """
+    store = MemoryStore()
+    fixture = app['config'].get('dao', {}).get('fixture')
+    if fixture:
+        _load_fixture(store, os.path.join(BASE_DIR, fixture))
+
+    app['db'] = store
+    app['db_router'] = ReplicaRouter(primary=store, replicas=[])
+    app['ready'] = asyncio.Event()
+    app['ready'].set()
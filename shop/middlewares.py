@@ -1,29 +1,356 @@
-from typing import Callable
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
 
-from aiohttp import web
+import psycopg2.extensions
+from aiohttp import hdrs, web
+
+from admission import AdmissionController
+from compression import CODECS, CompressedBodyCache, negotiate_encoding
+from instrumentation import InstrumentedConnection, QueryStats
+from ratelimit import RateLimitController
+from slugindex import SlugIndex
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+READ_ONLY_METHODS = (hdrs.METH_GET, hdrs.METH_HEAD, hdrs.METH_OPTIONS)
+TIMEOUT_SETTINGS = ('statement_timeout', 'lock_timeout')
+LOCK_NOT_AVAILABLE = '55P03'
+BACKEND_CANCEL_TIMEOUT = 5
+LAST_WRITE_COOKIE = 'last_write'
 
 
 @web.middleware
-async def transaction_middleware(request: web.Request, handler: Callable) -> web.Response:
+async def transaction_middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
     """
     Middleware (посредник), открывающий соединение с БД и создающий транзакцию.
 
-    Проставляет в экземпляр запроса экземпляр соединения с БД и экземпляр текущей транзакции.
+    Проставляет в экземпляр запроса экземпляр соединения с БД, экземпляр текущей транзакции,
+    время ожидания соединения в пуле (в секундах) и статистику выполненных запросов.
+    Запросы на чтение (GET, HEAD, OPTIONS) выполняются на реплике, если она доступна, остальные - на primary БД.
+    После записи клиент (определяемый по заголовку "Authorization") некоторое время читает с primary,
+    чтобы видеть свои изменения. Время записи также передается клиенту в cookie "last_write",
+    чтобы это работало и при обработке следующего запроса другим процессом. Признак недавней записи
+    проставляется в экземпляр запроса (`request['recently_wrote']`).
+
+    В транзакции устанавливаются ограничения времени выполнения запросов и ожидания блокировок
+    из раздела `timeouts` настроек; при их превышении возвращается ответ 503 (Service Unavailable).
+    Если обработчик отменен (например, клиент разорвал соединение) во время выполнения запроса к БД,
+    запрос отменяется и на сервере БД, а соединение не возвращается в пул.
+
+    Для view с атрибутом `uses_db = False` соединение не открывается.
 
     :param request: экземпляр запроса
     :param handler: обработчик запроса (controller)
     :return: экземпляр ответа
     """
-    async with request.app['db'].acquire() as conn:
+    if not getattr(request.match_info.handler, 'uses_db', True):
+        return await handler(request)
+
+    router = request.app['db_router']
+    sticky_key = request.headers.get(hdrs.AUTHORIZATION)
+    read_only = request.method in READ_ONLY_METHODS
+    request['recently_wrote'] = _recently_wrote(request)
+    engine = router.choose() if read_only and not request['recently_wrote'] else request.app['db']
+
+    async with _acquire(engine, request) as conn:
+        backend_pid = await conn.connection.get_backend_pid()
         trans = await conn.begin()
-        request['conn'] = conn
+        request['db_engine'] = engine
+        request['db_stats'] = QueryStats()
+        request['conn'] = InstrumentedConnection(conn, request['db_stats'])
         request['trans'] = trans
         try:
+            await _set_timeouts(conn, _get_timeouts(request))
             response = await handler(request)
+        except asyncio.CancelledError:
+            if conn.closed:
+                # aiopg закрывает соединение при отмене ожидания результата, но запрос продолжает выполняться.
+                asyncio.ensure_future(_cancel_backend(engine, backend_pid))
+                raise
+            # Статус читается до отката: после него транзакция уже не в состоянии ошибки.
+            query_canceled = _is_query_canceled(conn)
+            await trans.rollback()
+            if not query_canceled:
+                raise
+            # aiopg выбрасывает CancelledError и при отмене запроса по statement_timeout.
+            return _timeout_response()
         except Exception as e:
             await trans.rollback()
+            if getattr(e, 'pgcode', None) == LOCK_NOT_AVAILABLE:
+                return _timeout_response()
             raise e
 
         if trans.is_active:
             await trans.commit()
+        if not read_only:
+            _mark_write(router, sticky_key, response)
         return response
+
+
+def _get_last_write(request: web.Request) -> Optional[float]:
+    try:
+        return float(request.cookies[LAST_WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+def _recently_wrote(request: web.Request) -> bool:
+    router = request.app.get('db_router')
+    if router is None:
+        return False
+    return router.recently_wrote(request.headers.get(hdrs.AUTHORIZATION), _get_last_write(request))
+
+
+@web.middleware
+async def memory_transaction_middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+    """
+    Middleware (посредник), создающий транзакцию в хранилище в памяти (DAO-backend memory).
+
+    Используется вместо `transaction_middleware`, когда данные хранятся в памяти процесса.
+    Проставляет в экземпляр запроса подключение к хранилищу и экземпляр текущей транзакции.
+    Запросы на запись захватывают блокировку записи хранилища до первого чтения, поэтому
+    выполняются по очереди и не принимают решений по данным, которые изменит одновременный запрос
+    (например, не списывают остаток, уже списанный другим заказом).
+    Для view с атрибутом `uses_db = False` транзакция не создается.
+
+    :param request: экземпляр запроса
+    :param handler: обработчик запроса (controller)
+    :return: экземпляр ответа
+    """
+    if not getattr(request.match_info.handler, 'uses_db', True):
+        return await handler(request)
+
+    conn = request.app['db'].connect()
+    trans = await conn.begin()
+    request['conn'] = conn
+    request['trans'] = trans
+    try:
+        if request.method not in READ_ONLY_METHODS:
+            await conn.lock()
+        response = await handler(request)
+    except BaseException:
+        # Откат при отмене обработчика в том числе, иначе блокировка записи хранилища не освободится.
+        await trans.rollback()
+        raise
+
+    if trans.is_active:
+        await trans.commit()
+    return response
+
+
+@asynccontextmanager
+async def _acquire(engine, request: web.Request) -> AsyncIterator:
+    started = time.monotonic()
+    with span('db.acquire'):
+        conn = await engine.acquire()
+    request['db_pool_wait'] = time.monotonic() - started
+    try:
+        yield conn
+    finally:
+        await engine.release(conn)
+
+
+def _mark_write(router, sticky_key: Optional[str], response: web.StreamResponse) -> None:
+    router.mark_write(sticky_key)
+    if not response.prepared:
+        response.set_cookie(LAST_WRITE_COOKIE, str(time.time()),
+                            max_age=math.ceil(router.sticky_seconds), httponly=True)
+
+
+def _get_timeouts(request: web.Request) -> Dict[str, int]:
+    config = request.app['config'].get('timeouts', {})
+    timeouts = config.get('default', {})
+    resource = request.match_info.route.resource
+    if resource is not None and resource.canonical in config.get('routes', {}):
+        timeouts = dict(timeouts, **config['routes'][resource.canonical])
+    return timeouts
+
+
+async def _set_timeouts(conn, timeouts: Dict[str, int]) -> None:
+    settings = [(name, str(timeouts[name])) for name in TIMEOUT_SETTINGS if name in timeouts]
+    if not settings:
+        return
+
+    # Параметры устанавливаются только до конца текущей транзакции (как SET LOCAL).
+    query = 'SELECT ' + ', '.join('set_config(%s, %s, true)' for _ in settings)
+    await conn.execute(query, [value for setting in settings for value in setting])
+
+
+def _is_query_canceled(conn) -> bool:
+    status = conn.connection.raw.get_transaction_status()
+    return status == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+
+def _timeout_response() -> web.Response:
+    return web.json_response(status=503, data={'error': 'Database query timed out'})
+
+
+async def _cancel_backend(engine, backend_pid: int) -> None:
+    try:
+        async with engine.acquire() as conn:
+            await asyncio.wait_for(conn.scalar('SELECT pg_cancel_backend(%s)', backend_pid),
+                                   timeout=BACKEND_CANCEL_TIMEOUT)
+    except Exception:
+        logger.exception('Failed to cancel the query of the database backend %s', backend_pid)
+
+
+def admission_middleware(controller: AdmissionController) -> Callable:
+    """
+    Фабрика middleware (посредника) контроля допуска запросов к обработке.
+
+    Ограничивает количество одновременно обрабатываемых запросов каждого класса маршрутов.
+    Запросы сверх лимита ждут в ограниченной очереди, а при ее переполнении или истечении
+    времени ожидания сразу получают ответ 503 (Service Unavailable) с заголовком "Retry-After".
+
+    :param controller: контроллер допуска запросов
+    :return: middleware
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        limiter = controller.get_limiter(request)
+        if limiter is None:
+            return await handler(request)
+
+        if not await limiter.acquire():
+            return web.json_response(status=503,
+                                     data={'error': 'Service is overloaded, try again later'},
+                                     headers={hdrs.RETRY_AFTER: str(controller.retry_after)})
+
+        started = time.monotonic()
+        latency = None
+        try:
+            response = await handler(request)
+            latency = time.monotonic() - started
+            return response
+        finally:
+            limiter.release(latency=latency, pool_wait=request.get('db_pool_wait'))
+
+    return middleware
+
+
+def rate_limit_middleware(controller: RateLimitController) -> Callable:
+    """
+    Фабрика middleware (посредника) ограничения частоты запросов клиентов.
+
+    Должен располагаться после проверки токена: клиент определяется по идентификатору
+    аутентифицированного пользователя (`request['user']`), а не по самому токену,
+    чтобы повторный вход с получением нового токена не обнулял ограничение.
+    Запросы сверх ограничения сразу получают ответ 429 (Too Many Requests) с заголовком
+    "Retry-After", не занимая места при контроле допуска и соединений с БД.
+    Запросы без пользователя (исключенные из проверки токена маршруты) не ограничиваются.
+
+    :param controller: контроллер ограничения частоты запросов
+    :return: middleware
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        user = request.get('user')
+        limiter = controller.get_limiter(request) if user is not None else None
+        if limiter is None:
+            return await handler(request)
+
+        delay = limiter.acquire(user.id)
+        if delay > 0:
+            return web.json_response(status=429,
+                                     data={'error': 'Too many requests, try again later'},
+                                     headers={hdrs.RETRY_AFTER: str(math.ceil(delay))})
+        return await handler(request)
+
+    return middleware
+
+
+def slug_index_middleware(index: SlugIndex) -> Callable:
+    """
+    Фабрика middleware (посредника), отвечающего на запросы несуществующих продуктов без обращения к БД.
+
+    Должен располагаться до открытия транзакции. Для view с атрибутом `product_slug_param`
+    (наименование параметра маршрута со slug-ом продукта) проверяет slug по индексу
+    и, если продукт точно не существует, сразу возвращает ответ 404 (Not Found),
+    не занимая соединения с БД. Запросы клиентов, недавно выполнивших запись, не проверяются:
+    созданный ими в другом процессе продукт может еще не попасть в индекс этого процесса.
+
+    :param index: индекс slug-ов продуктов
+    :return: middleware
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        param = getattr(request.match_info.handler, 'product_slug_param', None)
+        if param is not None and not _recently_wrote(request) and not index.might_contain(request.match_info[param]):
+            return web.json_response(status=404, data={'error': 'Product not found'})
+        return await handler(request)
+
+    return middleware
+
+
+def compression_middleware(min_size: int = 1024,
+                           level: int = 6,
+                           cache_entries: int = 32,
+                           cache_min_size: int = 16384,
+                           executor_min_size: int = 65536) -> Callable:
+    """
+    Фабрика middleware (посредника), сжимающего тела ответов.
+
+    Алгоритм (br, gzip или deflate) выбирается по заголовку "Accept-Encoding".
+    Сжимаются только полностью сформированные ответы (`web.Response`) текстовых
+    типов размером не меньше `min_size`. Тела размером от `executor_min_size` сжимаются
+    в executor-е, чтобы не останавливать обработку остальных запросов процесса.
+    Сжатые тела ответов со строгим ETag размером от `cache_min_size` кэшируются по адресу ресурса
+    и ETag-у, чтобы не сжимать повторно неизменившиеся большие ответы; тело при этом не читается.
+
+    :param min_size: минимальный размер тела ответа для сжатия, в байтах
+    :param level: уровень сжатия
+    :param cache_entries: количество сжатых тел в кэше
+    :param cache_min_size: минимальный размер тела ответа для кэширования, в байтах
+    :param executor_min_size: минимальный размер тела ответа для сжатия в executor-е, в байтах
+    :return: middleware
+    """
+    cache = CompressedBodyCache(max_entries=cache_entries)
+
+    async def compress(coding: str, body: bytes) -> bytes:
+        if len(body) < executor_min_size:
+            return CODECS[coding](body, level)
+        return await asyncio.get_event_loop().run_in_executor(None, CODECS[coding], body, level)
+
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        response = await handler(request)
+        if not _is_compressible(response, min_size):
+            return response
+
+        response.headers.add(hdrs.VARY, hdrs.ACCEPT_ENCODING)
+        coding = negotiate_encoding(request.headers.get(hdrs.ACCEPT_ENCODING, ''))
+        if coding is None:
+            return response
+
+        body = response.body
+        etag = response.headers.get(hdrs.ETAG)
+        if etag is None or etag.startswith('W/') or len(body) < cache_min_size:
+            response.body = await compress(coding, body)
+        else:
+            key = (coding, request.path_qs, etag)
+            compressed = cache.get(key)
+            if compressed is None:
+                compressed = await compress(coding, body)
+                cache.put(key, compressed)
+            response.body = compressed
+        response.headers[hdrs.CONTENT_ENCODING] = coding
+        if etag is not None and etag.endswith('"'):
+            # Сжатое и исходное тела - разные представления ресурса.
+            response.headers[hdrs.ETAG] = '{value}-{coding}"'.format(value=etag[:-1], coding=coding)
+        return response
+
+    return middleware
+
+
+def _is_compressible(response: web.StreamResponse, min_size: int) -> bool:
+    if not isinstance(response, web.Response) or not isinstance(response.body, bytes):
+        return False
+    if len(response.body) < min_size or hdrs.CONTENT_ENCODING in response.headers:
+        return False
+    return response.content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
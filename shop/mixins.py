@@ -1,5 +1,6 @@
 from aiohttp.web import View
 
+from middlewares import READ_ONLY_METHODS
 from services import ServiceFactory
 
 
@@ -11,9 +12,25 @@ class ServiceViewMixin(View):
         Инициализация view.
 
         Создает объект фабрики, для порождения сервисов.
+        Снимок каталога продуктов и группа объединения одновременных запросов передаются
+        только при запросах на чтение, чтобы изменения (например, остатков при заказе)
+        вычислялись по данным, прочитанным в транзакции текущего запроса.
         """
         super().__init__(*args, **kwargs)
-        self.service_factory = ServiceFactory(conn=self.request['conn'])
+        read_only = self.request.method in READ_ONLY_METHODS
+        # Клиент, недавно выполнивший запись, читает продукты из БД, чтобы видеть свои изменения:
+        # снимок каталога и индекс slug-ов других процессов могут их еще не содержать.
+        recently_wrote = self.request.get('recently_wrote', False)
+        use_snapshot = read_only and not recently_wrote
+        self.service_factory = ServiceFactory(
+            conn=self.request['conn'],
+            single_flight=self.request.app.get('single_flight') if read_only else None,
+            token_signer=self.request.app.get('token_signer'),
+            backend=self.request.app['dao_backend'],
+            slug_index=self.request.app.get('slug_index') if not recently_wrote else None,
+            catalog=self.request.app.get('catalog_snapshot') if use_snapshot else None,
+            shards=self.request.app.get('shards'),
+            flight_scope=self.request.get('db_engine'))
 
 
 class ProductServiceViewMixin(ServiceViewMixin):
@@ -66,3 +83,16 @@ class AccessTokenServiceViewMixin(ServiceViewMixin):
         """
         super().__init__(*args, **kwargs)
         self.token_service = self.service_factory.create_access_token_service()
+
+
+class AnalyticsServiceViewMixin(ServiceViewMixin):
+    """Миксин, добавляющий сервис-объект для работы с аналитикой продаж."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Инициализация view.
+
+        Создает объект сервиса для работы с аналитикой продаж.
+        """
+        super().__init__(*args, **kwargs)
+        self.analytics_service = self.service_factory.create_analytics_service()
@@ -0,0 +1,367 @@
+"""
+Секционирование таблиц заказов по диапазонам номеров заказов.
+
+Таблицы orders и orders_products секционируются декларативно (PARTITION BY RANGE)
+по номеру заказа: секции `orders_p<начало>` и `orders_products_p<начало>` содержат
+заказы с номерами из [начало, начало + partition_size). Номера заказов растут со временем,
+поэтому секции упорядочены и по времени создания заказов, а запросы с условием
+на номер заказа (заказ по номеру, страница истории заказов, продукты заказов)
+затрагивают только секции с этими номерами.
+
+Обслуживание создает `premake` секций впрок после секции текущего значения
+последовательности номеров заказов и отсоединяет (DETACH PARTITION) прошедшие
+секции, последний заказ которых старше `retention_days` дней. Отсоединенные секции
+остаются в БД отдельными таблицами для архивации; связи пользователей с их заказами
+переносятся из users_orders в таблицу `users_orders_p<начало>`, поэтому такие заказы
+пропадают из истории заказов, но их владельцы сохраняются в архиве.
+
+Модуль используется приложением (периодическое обслуживание) и init_db.py
+(создание и перевод существующих таблиц на секционирование), поэтому не импортирует
+модули приложения.
+"""
+import asyncio
+import logging
+import re
+from typing import List, Optional, Tuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_PARAMS = ('database', 'user', 'password', 'host', 'port')
+# Ключ advisory-блокировки: секции обслуживает один процесс одновременно.
+MAINTENANCE_LOCK_KEY = 7263110
+PARTITION_NAME_RE = re.compile(r'^orders_p(\d+)$')
+
+# Уникальные ограничения секционированной таблицы должны включать ключ секционирования,
+# поэтому первичный ключ orders - номер заказа, а внешние ключи ссылаются на (id, number).
+CREATE_TABLES_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id uuid NOT NULL,
+        number integer NOT NULL,
+        created_at timestamp with time zone NOT NULL DEFAULT now(),
+        total numeric NOT NULL,
+        CONSTRAINT orders_pkey PRIMARY KEY (number),
+        CONSTRAINT orders_id_number_key UNIQUE (id, number)
+    ) PARTITION BY RANGE (number)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS orders_products (
+        product_id uuid {products_reference},
+        order_id uuid,
+        order_number integer NOT NULL,
+        quantity integer NOT NULL,
+        price numeric NOT NULL,
+        CONSTRAINT orders_products_order_fkey FOREIGN KEY (order_id, order_number) REFERENCES orders (id, number)
+    ) PARTITION BY RANGE (order_number)
+    """,
+    'CREATE INDEX IF NOT EXISTS orders_products_order_id_idx ON orders_products (order_id)',
+    """
+    CREATE TABLE IF NOT EXISTS users_orders (
+        user_id uuid {users_reference},
+        order_id uuid,
+        order_number integer NOT NULL,
+        CONSTRAINT users_orders_order_fkey FOREIGN KEY (order_id, order_number) REFERENCES orders (id, number)
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS users_orders_user_id_order_id_idx ON users_orders (user_id, order_id)',
+    'CREATE INDEX IF NOT EXISTS users_orders_user_id_order_number_idx ON users_orders (user_id, order_number)'
+)
+CREATE_PARTITION_SQL = ('CREATE TABLE IF NOT EXISTS {table}_p{start} PARTITION OF {table} '
+                        'FOR VALUES FROM ({start}) TO ({end})')
+PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'orders'::regclass
+"""
+# Заказы секции создавались по возрастанию номеров, поэтому последний заказ
+# находится по первичному ключу, а не полным просмотром секции.
+LAST_ORDER_EXPIRED_SQL = """
+    SELECT created_at < now() - %s * interval '1 day'
+    FROM orders_p{start}
+    ORDER BY number DESC
+    LIMIT 1
+"""
+DETACH_PARTITION_SQL = (
+    'ALTER TABLE orders_products DETACH PARTITION orders_products_p{start}',
+    'ALTER TABLE orders_products_p{start} DROP CONSTRAINT IF EXISTS orders_products_order_fkey',
+    # Связи пользователей с заказами секции переносятся в архивную таблицу рядом с секцией.
+    'CREATE TABLE IF NOT EXISTS users_orders_p{start} (LIKE users_orders)',
+    'WITH moved AS (DELETE FROM users_orders WHERE order_number >= {start} AND order_number < {end} RETURNING *) '
+    'INSERT INTO users_orders_p{start} SELECT * FROM moved',
+    'ALTER TABLE orders DETACH PARTITION orders_p{start}'
+)
+# Номер заказа в orders_products и users_orders (ключ секционирования) для БД,
+# созданных до его появления.
+ADD_ORDER_NUMBER_SQL = (
+    'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS order_number integer',
+    'UPDATE {table} t SET order_number = o.number FROM orders o WHERE o.id = t.order_id AND t.order_number IS NULL',
+    'ALTER TABLE {table} ALTER COLUMN order_number SET NOT NULL'
+)
+
+
+def create_partitioned_tables(cursor, shard: bool = False) -> None:
+    """
+    Создать секционированные таблицы orders и orders_products и таблицу users_orders.
+
+    Последовательность номеров заказов должна быть создана заранее.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :param shard: БД является шардом заказов - в ней нет users и products,
+                  поэтому внешние ключи на них не создаются
+    """
+    references = {
+        'products_reference': '' if shard else 'REFERENCES products (id)',
+        'users_reference': '' if shard else 'REFERENCES users (id)'
+    }
+    for statement in CREATE_TABLES_SQL:
+        cursor.execute(statement.format(**references))
+
+
+def is_partitioned(cursor) -> bool:
+    """
+    Проверить, секционирована ли таблица orders.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :return: булево значение в зависимости от результата проверки
+    """
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('orders')")
+    row = cursor.fetchone()
+    return row is not None and row[0]
+
+
+def get_partitions(cursor) -> List[int]:
+    """
+    Получить начала диапазонов номеров присоединенных секций.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :return: упорядоченный список начал диапазонов
+    """
+    cursor.execute(PARTITIONS_SQL)
+    matches = (PARTITION_NAME_RE.match(name) for name, in cursor.fetchall())
+    return sorted(int(match.group(1)) for match in matches if match is not None)
+
+
+def create_partitions(cursor, first: int, last: int, size: int) -> List[int]:
+    """
+    Создать отсутствующие секции, покрывающие номера заказов от first до last.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :param first: минимальный номер заказа
+    :param last: максимальный номер заказа
+    :param size: количество номеров заказов в секции
+    :return: начала диапазонов созданных секций
+    """
+    existing = set(get_partitions(cursor))
+    created = []
+    for start in range(first // size * size, last // size * size + 1, size):
+        if start in existing:
+            continue
+        for table in ('orders', 'orders_products'):
+            cursor.execute(CREATE_PARTITION_SQL.format(table=table, start=start, end=start + size))
+        created.append(start)
+    return created
+
+
+def detach_partitions(cursor, before: int, size: int, retention_days: int) -> List[int]:
+    """
+    Отсоединить секции, последний заказ которых старше `retention_days` дней.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :param before: номер заказа, секция которого и последующие не отсоединяются
+    :param size: количество номеров заказов в секции
+    :param retention_days: срок хранения заказов в секционированных таблицах, в днях
+    :return: начала диапазонов отсоединенных секций
+    """
+    detached = []
+    for start in get_partitions(cursor):
+        if start + size > before:
+            break
+        cursor.execute(LAST_ORDER_EXPIRED_SQL.format(start=start), (retention_days,))
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            break
+        for statement in DETACH_PARTITION_SQL:
+            cursor.execute(statement.format(start=start, end=start + size))
+        detached.append(start)
+    return detached
+
+
+def maintain(cursor,
+             partition_size: int = 1000000,
+             premake: int = 2,
+             retention_days: int = 0,
+             lock_timeout: int = 2000) -> Optional[dict]:
+    """
+    Создать секции впрок и отсоединить устаревшие в текущей транзакции.
+
+    Секции создаются и отсоединяются под эксклюзивной блокировкой секционированных таблиц,
+    поэтому ожидание блокировки ограничено `lock_timeout`, чтобы не останавливать
+    создание заказов; при превышении обслуживание завершается ошибкой и повторяется позже.
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :param partition_size: количество номеров заказов в секции (нельзя менять после создания секций)
+    :param premake: количество секций, создаваемых впрок после секции текущего номера заказа
+    :param retention_days: срок хранения заказов, в днях; 0 - секции не отсоединяются
+    :param lock_timeout: максимальное время ожидания блокировки таблицы, в миллисекундах
+    :return: начала диапазонов созданных и отсоединенных секций или None,
+             если секции обслуживает другой процесс
+    """
+    cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (MAINTENANCE_LOCK_KEY,))
+    if not cursor.fetchone()[0]:
+        return None
+
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (str(lock_timeout),))
+    cursor.execute('SELECT last_value FROM order_number_seq')
+    current = cursor.fetchone()[0]
+    created = create_partitions(cursor, current, current + premake * partition_size, partition_size)
+    detached = []
+    if retention_days:
+        detached = detach_partitions(cursor, current, partition_size, retention_days)
+    return {'created': created, 'detached': detached}
+
+
+def _has_column(cursor, table: str, column: str) -> bool:
+    cursor.execute('SELECT 1 FROM information_schema.columns '
+                   'WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s',
+                   (table, column))
+    return cursor.fetchone() is not None
+
+
+def _rename_indexes(cursor, table: str, suffix: str) -> None:
+    # Имена индексов (и ограничений на их основе) уникальны в схеме и нужны новым таблицам.
+    cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', (table,))
+    for name, in cursor.fetchall():
+        cursor.execute('ALTER INDEX {name} RENAME TO {name}{suffix}'.format(name=name, suffix=suffix))
+
+
+def migrate(cursor, shard: bool = False, partition_size: Optional[int] = None, premake: int = 2) -> List[int]:
+    """
+    Перевести существующие таблицы заказов на секционирование в текущей транзакции.
+
+    В orders_products и users_orders добавляется номер заказа. Если задан `partition_size`,
+    а orders еще не секционирована, данные orders и orders_products копируются
+    в секционированные таблицы, а прежние таблицы удаляются. Таблицы заказов
+    на время переноса блокируются, поэтому перевод выполняется при остановленном приложении.
+    Цены строк и суммы заказов должны быть добавлены заранее (init_db.py --migrate
+    добавляет их перед переводом).
+
+    :param cursor: курсор синхронного подключения psycopg2
+    :param shard: БД является шардом заказов (без users и products)
+    :param partition_size: количество номеров заказов в секции; None - только добавить номер заказа
+    :param premake: количество секций, создаваемых впрок
+    :return: начала диапазонов созданных секций
+    :raise RuntimeError: выбрасывается, если в таблицах нет цен строк или сумм заказов
+    """
+    if is_partitioned(cursor):
+        return []
+    for table, column in (('orders', 'total'), ('orders_products', 'price')):
+        if not _has_column(cursor, table, column):
+            raise RuntimeError('Column {table}.{column} is missing, add the order prices first'.format(
+                table=table, column=column))
+
+    for table in ('orders_products', 'users_orders'):
+        for statement in ADD_ORDER_NUMBER_SQL:
+            cursor.execute(statement.format(table=table))
+    cursor.execute('CREATE INDEX IF NOT EXISTS users_orders_user_id_order_number_idx '
+                   'ON users_orders (user_id, order_number)')
+    if partition_size is None:
+        return []
+
+    for table in ('orders', 'orders_products'):
+        cursor.execute('ALTER TABLE {table} RENAME TO {table}_unpartitioned'.format(table=table))
+        _rename_indexes(cursor, table + '_unpartitioned', '_unpartitioned')
+    cursor.execute('ALTER TABLE users_orders DROP CONSTRAINT IF EXISTS users_orders_order_id_fkey')
+    create_partitioned_tables(cursor, shard=shard)
+
+    cursor.execute('SELECT min(number) FROM orders_unpartitioned')
+    first = cursor.fetchone()[0]
+    cursor.execute('SELECT last_value FROM order_number_seq')
+    current = cursor.fetchone()[0]
+    created = create_partitions(cursor, current if first is None else first, current + premake * partition_size,
+                                partition_size)
+    cursor.execute('INSERT INTO orders (id, number, created_at, total) '
+                   'SELECT id, number, created_at, total FROM orders_unpartitioned')
+    cursor.execute('INSERT INTO orders_products (product_id, order_id, order_number, quantity, price) '
+                   'SELECT product_id, order_id, order_number, quantity, price FROM orders_products_unpartitioned')
+    cursor.execute('ALTER TABLE users_orders ADD CONSTRAINT users_orders_order_fkey '
+                   'FOREIGN KEY (order_id, order_number) REFERENCES orders (id, number)')
+    cursor.execute('DROP TABLE orders_products_unpartitioned, orders_unpartitioned')
+    return created
+
+
+def get_order_databases(config: dict) -> List[Tuple[dict, bool]]:
+    """
+    Получить параметры подключения к БД, в которых хранятся заказы.
+
+    :param config: словарь настроек приложения
+    :return: список кортежей вида (параметры подключения psycopg2, признак шарда заказов)
+    """
+    postgres = config['postgres']
+    sharding = config.get('sharding', {})
+    if sharding.get('enabled', False):
+        databases = [(dict(postgres, **shard), True) for shard in sharding.get('shards', [])]
+    else:
+        databases = [(postgres, False)]
+    return [({key: value for key, value in params.items() if key in CONNECTION_PARAMS}, shard)
+            for params, shard in databases]
+
+
+def maintain_database(params: dict, config: dict) -> Optional[dict]:
+    """
+    Обслужить секции одной БД заказов в отдельной транзакции.
+
+    :param params: параметры подключения psycopg2
+    :param config: раздел `partitioning` настроек приложения
+    :return: результат `maintain`
+    """
+    conn = psycopg2.connect(**params)
+    try:
+        with conn.cursor() as cursor:
+            result = maintain(cursor,
+                              partition_size=config.get('partition_size', 1000000),
+                              premake=config.get('premake', 2),
+                              retention_days=config.get('retention_days', 0),
+                              lock_timeout=config.get('lock_timeout', 2000))
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+async def _maintain_periodically(databases: List[Tuple[dict, bool]], config: dict) -> None:
+    loop = asyncio.get_event_loop()
+    while True:
+        for params, _ in databases:
+            try:
+                result = await loop.run_in_executor(None, maintain_database, params, config)
+            except Exception:
+                logger.exception('Order partition maintenance failed on %s:%s', params['host'], params['port'])
+                continue
+            if result is not None and (result['created'] or result['detached']):
+                logger.info('Order partitions on %s:%s: %s', params['host'], params['port'], result)
+        await asyncio.sleep(config.get('check_interval', 3600))
+
+
+async def init_partitions(app) -> None:
+    """
+    Запуск периодического обслуживания секций таблиц заказов (основной БД или шардов заказов).
+
+    Обслуживание запускается всеми процессами, но выполняется одним из них
+    за счет advisory-блокировки; секции впрок создаются сразу при запуске.
+    """
+    config = app['config'].get('partitioning', {})
+    if not config.get('enabled', False):
+        return
+
+    databases = get_order_databases(app['config'])
+    app['partitions_task'] = asyncio.ensure_future(_maintain_periodically(databases, config))
+
+
+async def close_partitions(app) -> None:
+    """Остановка обслуживания секций таблиц заказов."""
+    task = app.get('partitions_task')
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,35 @@
+from functools import wraps
+from typing import Callable
+
+from aiohttp.web import Response, View, json_response
+
+
+def is_admin(request) -> bool:
+    """
+    Проверить, является ли текущий пользователь администратором.
+
+    Список логинов администраторов задается в разделе `admin` конфигурационного файла.
+
+    :param request: экземпляр запроса
+    :return: булево значение в зависимости от результата проверки
+    """
+    user = request.get('user')
+    if user is None:
+        return False
+    return user.login in request.app['config'].get('admin', {}).get('logins', [])
+
+
+def admin_required(func: Callable) -> Callable:
+    """
+    Декоратор метода view, разрешающий доступ только администраторам.
+
+    :param func: декорируемый метод view
+    :return: обертка, возвращающая ответ 403 (Forbidden) для остальных пользователей
+    """
+    @wraps(func)
+    async def wrapped(view: View, *args, **kwargs) -> Response:
+        if not is_admin(view.request):
+            return json_response(status=403, data={'error': 'Admin permissions required'})
+        return await func(view, *args, **kwargs)
+
+    return wrapped
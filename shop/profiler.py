@@ -0,0 +1,173 @@
+import asyncio
+import marshal
+import os
+import signal
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+MAX_STACK_DEPTH = 128
+
+FuncKey = Tuple[str, int, str]
+
+
+def _label(code: CodeType) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return '{module}:{name}'.format(module=module, name=getattr(code, 'co_qualname', code.co_name))
+
+
+def _func_key(code: CodeType) -> FuncKey:
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class Profile:
+    """Результат выборочного профилирования: количество выборок по стекам вызовов."""
+
+    def __init__(self, samples: Counter, interval: float) -> None:
+        """
+        Инициализация результата.
+
+        :param samples: количество выборок по стекам (кортежам code-объектов от корня к листу)
+        :param interval: интервал между выборками, в секундах
+        """
+        self.samples = samples
+        self.interval = interval
+
+    def to_collapsed(self) -> str:
+        """
+        Вернуть стеки в свернутом формате (collapsed stacks) для построения flame graph.
+
+        Каждая строка - кадры стека от корня к листу через ";" и количество выборок.
+
+        :return: текст профиля
+        """
+        lines = ['{stack} {count}'.format(stack=';'.join(_label(code) for code in stack), count=count)
+                 for stack, count in self.samples.most_common()]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def to_pstats(self) -> bytes:
+        """
+        Вернуть профиль в формате модуля pstats (как у cProfile).
+
+        Время функции оценивается как количество выборок, умноженное на интервал;
+        вместо количества вызовов указывается количество выборок.
+
+        :return: содержимое файла профиля для `pstats.Stats`
+        """
+        stats: Dict[FuncKey, list] = {}
+        for stack, count in self.samples.items():
+            duration = count * self.interval
+            keys = [_func_key(code) for code in stack]
+            for key in set(keys):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                entry[0] += count
+                entry[1] += count
+                entry[3] += duration
+            stats[keys[-1]][2] += duration
+            for caller, callee in zip(keys, keys[1:]):
+                callers = stats[callee][4]
+                calls, primitive_calls, own_time, total_time = callers.get(caller, (0, 0, 0.0, 0.0))
+                own = duration if callee == keys[-1] else 0.0
+                callers[caller] = (calls + count, primitive_calls + count, own_time + own, total_time + duration)
+        return marshal.dumps({key: tuple(entry) for key, entry in stats.items()})
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик потока event loop-а работающего процесса.
+
+    Таймер ITIMER_PROF с заданным интервалом процессорного времени процесса посылает
+    сигнал SIGPROF, обработчик которого запоминает стек вызовов прерванного кода.
+    В отличие от выборки из отдельного потока, стек снимается в произвольный момент
+    выполнения, а не только когда event loop отпускает GIL при вводе-выводе, поэтому
+    профиль отражает действительно затратный код. Сигналы обрабатываются в главном
+    потоке, поэтому event loop должен выполняться в нем (как при `web.run_app`).
+
+    Если задан маршрут, учитываются только выборки, снятые во время выполнения задачи,
+    обрабатывающей запрос к этому маршруту (такие задачи отмечает `profiler_middleware`).
+    Одновременно выполняется не более одного профилирования.
+    """
+
+    def __init__(self) -> None:
+        """Инициализация неактивного профилировщика."""
+        self.running = False
+        self.route: Optional[str] = None
+        self.tasks: Set[asyncio.Task] = set()
+        self._interval = 0.0
+        self._samples: Counter = Counter()
+        self._previous_handler = None
+
+    def start(self, interval: float, route: Optional[str] = None) -> bool:
+        """
+        Начать профилирование.
+
+        :param interval: интервал между выборками (процессорного времени), в секундах
+        :param route: шаблон пути маршрута, запросы к которому профилируются; None - все
+        :return: True, если профилирование начато; False, если оно уже выполняется
+        """
+        if self.running:
+            return False
+
+        self.running = True
+        self.route = route
+        self._interval = interval
+        self._samples = Counter()
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        return True
+
+    def stop(self) -> Profile:
+        """
+        Остановить профилирование.
+
+        :return: результат профилирования
+        """
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+        self.running = False
+        self.route = None
+        self.tasks.clear()
+        return Profile(self._samples, self._interval)
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        if frame is None:
+            return
+        if self.route is not None and asyncio.current_task() not in self.tasks:
+            return
+
+        stack: List[CodeType] = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        self._samples[tuple(stack)] += 1
+
+
+def profiler_middleware(profiler: SamplingProfiler) -> Callable:
+    """
+    Фабрика middleware (посредника), отмечающего задачи запросов к профилируемому маршруту.
+
+    Пока профилирование не выполняется или не ограничено маршрутом, ничего не делает.
+
+    :param profiler: выборочный профилировщик
+    :return: middleware
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        if profiler.route is None:
+            return await handler(request)
+
+        resource = request.match_info.route.resource
+        if resource is None or resource.canonical != profiler.route:
+            return await handler(request)
+
+        task = asyncio.current_task()
+        profiler.tasks.add(task)
+        try:
+            return await handler(request)
+        finally:
+            profiler.tasks.discard(task)
+
+    return middleware
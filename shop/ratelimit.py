@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from aiohttp import web
+
+from admission import classify_route
+
+
+class TokenBucketLimiter:
+    """
+    Ограничитель частоты запросов клиентов одного класса маршрутов (token bucket).
+
+    У каждого клиента есть корзина емкостью `burst` токенов, пополняемая со скоростью
+    `rate` токенов в секунду; каждый запрос расходует один токен. Корзины хранятся
+    в порядке последнего обращения, поэтому простаивающие клиенты вытесняются с начала
+    за O(1): корзина, не использовавшаяся дольше времени полного пополнения, уже полна
+    и ничем не отличается от новой.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100000) -> None:
+        """
+        Инициализация ограничителя.
+
+        :param rate: скорость пополнения корзины, запросов в секунду
+        :param burst: емкость корзины - допустимое количество запросов подряд
+        :param max_clients: максимальное количество хранимых корзин; при превышении
+                            вытесняются корзины клиентов, обращавшихся давнее всех
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.idle_timeout = burst / rate
+        # Ключ клиента -> [количество токенов, время последнего обращения].
+        self._buckets: Dict[Hashable, List[float]] = OrderedDict()
+
+    def acquire(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Израсходовать токен клиента.
+
+        :param key: ключ клиента
+        :param now: текущее время (time.monotonic)
+        :return: 0, если запрос разрешен; иначе - время в секундах до появления токена
+        """
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        """Вернуть количество хранимых корзин."""
+        return len(self._buckets)
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_timeout and len(self._buckets) < self.max_clients:
+                return
+            del self._buckets[key]
+
+
+class RateLimitController:
+    """
+    Ограничение частоты запросов аутентифицированных клиентов по классам маршрутов.
+
+    Класс маршрута определяется так же, как при контроле допуска (`classify_route`),
+    но по разделу `routes` настроек `rate_limit`. Класс, отсутствующий в `classes`, не ограничивается.
+    """
+
+    def __init__(self, config: dict) -> None:
+        """
+        Инициализация контроллера по разделу `rate_limit` конфигурационного файла.
+
+        :param config: словарь настроек ограничения частоты запросов
+        """
+        self.routes: Dict[str, str] = config.get('routes', {})
+        self.limiters: Dict[str, TokenBucketLimiter] = {
+            name: TokenBucketLimiter(max_clients=config.get('max_clients', 100000), **options)
+            for name, options in config.get('classes', {}).items()
+        }
+
+    def get_limiter(self, request: web.Request) -> Optional[TokenBucketLimiter]:
+        """
+        Вернуть ограничитель для класса маршрута запроса.
+
+        :param request: экземпляр запроса
+        :return: ограничитель или None, если класс маршрута не ограничен
+        """
+        return self.limiters.get(classify_route(request, self.routes))
@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from aiopg.sa import create_engine
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики в секундах. Если все полученные изменения уже применены,
+# реплика считается синхронной, даже если на primary давно не было записей.
+REPLICATION_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class Replica:
+    """Реплика БД и результат последней проверки ее состояния."""
+
+    def __init__(self, name: str, engine) -> None:
+        """
+        Инициализация реплики.
+
+        До первой успешной проверки реплика считается недоступной.
+
+        :param name: наименование реплики (хост:порт)
+        :param engine: engine БД реплики
+        """
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag: Optional[float] = None
+
+
+class ReplicaRouter:
+    """
+    Маршрутизатор запросов между primary и репликами БД.
+
+    Запросы на чтение распределяются по кругу между исправными репликами, отставание
+    которых не превышает `max_lag`. Если исправных реплик нет, используется primary.
+    Клиент, выполнивший запись, в течение `sticky_seconds` читает с primary,
+    чтобы видеть собственные изменения (read-your-writes).
+
+    Записи по ключу клиента помнит только текущий процесс. Чтобы read-your-writes работал
+    и при обработке следующего запроса другим процессом, время последней записи
+    передается клиенту (см. `transaction_middleware`) и учитывается через `last_write`;
+    клиенты, не возвращающие его, после записи могут прочитать устаревшие данные с реплики.
+    """
+
+    def __init__(self,
+                 primary,
+                 replicas: List[Replica],
+                 max_lag: float = 5,
+                 sticky_seconds: float = 10,
+                 check_timeout: float = 1) -> None:
+        """
+        Инициализация маршрутизатора.
+
+        :param primary: engine primary БД
+        :param replicas: список реплик
+        :param max_lag: максимально допустимое отставание реплики, в секундах
+        :param sticky_seconds: время, в течение которого клиент читает с primary после записи
+        :param check_timeout: таймаут проверки состояния реплики, в секундах
+        """
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.check_timeout = check_timeout
+        self._healthy = itertools.cycle([])
+        self._recent_writes: Dict[str, float] = OrderedDict()
+
+    def recently_wrote(self, sticky_key: Optional[str] = None, last_write: Optional[float] = None) -> bool:
+        """
+        Проверить, выполнял ли клиент запись в течение последних `sticky_seconds`.
+
+        :param sticky_key: ключ клиента (например, токен доступа)
+        :param last_write: время последней записи клиента (Unix time), переданное самим клиентом
+        :return: True, если клиент должен читать с primary
+        """
+        if last_write is not None and last_write + self.sticky_seconds > time.time():
+            return True
+        return sticky_key is not None and self._recent_writes.get(sticky_key, 0) > time.monotonic()
+
+    def choose(self, sticky_key: Optional[str] = None, last_write: Optional[float] = None):
+        """
+        Выбрать engine для запроса на чтение.
+
+        :param sticky_key: ключ клиента (например, токен доступа) для read-your-writes
+        :param last_write: время последней записи клиента (Unix time), переданное самим клиентом
+        :return: engine реплики или primary
+        """
+        if self.recently_wrote(sticky_key, last_write):
+            return self.primary
+
+        replica = next(self._healthy, None)
+        return replica.engine if replica is not None else self.primary
+
+    def mark_write(self, sticky_key: Optional[str]) -> None:
+        """
+        Зафиксировать запись, выполненную клиентом.
+
+        Запись фиксируется и без реплик: недавно писавший клиент не читает
+        и из снимка каталога, который тоже может отставать от primary.
+
+        :param sticky_key: ключ клиента (например, токен доступа)
+        """
+        if sticky_key is None:
+            return
+
+        now = time.monotonic()
+        self._recent_writes.pop(sticky_key, None)
+        self._recent_writes[sticky_key] = now + self.sticky_seconds
+        # Записи упорядочены по времени истечения, поэтому устаревшие находятся в начале.
+        while self._recent_writes:
+            key, expires_at = next(iter(self._recent_writes.items()))
+            if expires_at > now:
+                break
+            del self._recent_writes[key]
+
+    async def check(self) -> None:
+        """Проверить доступность и отставание всех реплик."""
+        await asyncio.gather(*(self._check_replica(replica) for replica in self.replicas))
+        self._healthy = itertools.cycle([replica for replica in self.replicas if replica.healthy])
+
+    async def _check_replica(self, replica: Replica) -> None:
+        try:
+            replica.lag = await asyncio.wait_for(self._get_lag(replica.engine), timeout=self.check_timeout)
+        except Exception as e:
+            replica.lag = None
+            logger.warning('Replica %s is unavailable: %r', replica.name, e)
+
+        was_healthy = replica.healthy
+        replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+        if was_healthy and not replica.healthy:
+            logger.warning('Replica %s is excluded from routing, lag: %s', replica.name, replica.lag)
+
+    @staticmethod
+    async def _get_lag(engine) -> Optional[float]:
+        async with engine.acquire() as conn:
+            lag = await conn.scalar(REPLICATION_LAG_QUERY)
+        return float(lag) if lag is not None else None
+
+    async def run_checks(self, interval: float) -> None:
+        """
+        Периодически проверять состояние реплик.
+
+        :param interval: интервал между проверками, в секундах
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.check()
+
+
+async def init_replicas(app) -> None:
+    """
+    Инициализация engine-ов реплик и маршрутизатора запросов на чтение.
+
+    Реплики задаются в разделе `replicas` конфигурационного файла, незаданные
+    параметры подключения берутся из раздела `postgres`. Пулы реплик создаются
+    без заранее открытых соединений, чтобы недоступная реплика не мешала запуску.
+    """
+    config = app['config'].get('replicas', {})
+    replicas = []
+    for replica_config in config.get('engines', []):
+        replica_config = dict(app['config']['postgres'], minsize=0, **replica_config)
+        name = '{host}:{port}'.format(**replica_config)
+        replicas.append(Replica(name=name, engine=await create_engine(**replica_config)))
+
+    router = ReplicaRouter(
+        primary=app['db'],
+        replicas=replicas,
+        max_lag=config.get('max_lag', 5),
+        sticky_seconds=config.get('sticky_seconds', 10),
+        check_timeout=config.get('check_timeout', 1))
+    app['db_router'] = router
+    if replicas:
+        await router.check()
+        app['db_replicas_task'] = asyncio.ensure_future(router.run_checks(config.get('check_interval', 2)))
+
+
+async def close_replicas(app) -> None:
+    """Остановка проверок реплик и завершение всех соединений с ними."""
+    task = app.get('db_replicas_task')
+    if task is not None:
+        task.cancel()
+
+    engines = [replica.engine for replica in app['db_router'].replicas]
+    for engine in engines:
+        engine.close()
+    for engine in engines:
+        await engine.wait_closed()
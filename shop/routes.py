@@ -10,9 +10,18 @@ def setup_routes(app: web.Application) -> None:
     :param app: экземпляр aiohttp-приложения
     """
     app.router.add_routes([
+        web.view(r'/ready', views.ReadinessView),
         web.post(r'/login', views.LoginView),
+        web.view(r'/logout', views.LogoutView),
         web.view(r'/products', views.ProductListCreateView),
+        web.view(r'/products/search', views.ProductSearchView),
+        web.view(r'/products/stream', views.ProductStreamView),
         web.view(r'/products/{slug}', views.ProductRetrieveUpdateDeleteView),
         web.view(r'/orders', views.OrderListCreateView),
-        web.view(r'/orders/{number:\d+}', views.OrderRetrieveUpdateDeleteView)
+        web.view(r'/orders/{number:\d+}', views.OrderRetrieveUpdateDeleteView),
+        web.view(r'/admin/products/import', views.ProductImportView),
+        web.view(r'/admin/products/export', views.ProductExportView),
+        web.view(r'/admin/profile', views.ProfileView),
+        web.view(r'/admin/slug-index', views.SlugIndexView),
+        web.view(r'/analytics/products', views.AnalyticsProductsView)
     ])
@@ -1,3 +1,5 @@
+MAX_ORDER_ITEMS = 100
+
 AUTH_SCHEMA = {
     'type': 'object',
     'properties': {
@@ -20,16 +22,37 @@ PRODUCT_SCHEMA = {
     'additionalProperties': False
 }
 
+PRODUCT_PATCH_SCHEMA = {
+    'type': 'object',
+    'properties': PRODUCT_SCHEMA['properties'],
+    'minProperties': 1,
+    'additionalProperties': False
+}
+
 ORDER_PRODUCT_SCHEMA = {
     'type': 'array',
     'items': {
         'type': 'object',
         'properties': {
-            'product': {'type': 'string'},
+            'product': {'type': 'string', 'maxLength': 255},
             'quantity': {'type': 'integer', 'minimum': 1}
         },
         'required': ['product', 'quantity'],
         'additionalProperties': False
     },
-    'minItems': 1
+    'minItems': 1,
+    'maxItems': MAX_ORDER_ITEMS
+}
+
+PRODUCT_IMPORT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string', 'minLength': 1, 'maxLength': 255},
+        'description': {'type': 'string', 'minLength': 5},
+        'slug': {'type': 'string', 'minLength': 1, 'maxLength': 255},
+        'price': {'type': 'number', 'minimum': 0.1},
+        'left_in_stock': {'type': 'integer', 'minimum': 0}
+    },
+    'required': ['name', 'description', 'price', 'left_in_stock'],
+    'additionalProperties': False
 }
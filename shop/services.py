@@ -1,15 +1,27 @@
-from typing import Iterable, Tuple
+import copy
+from contextlib import asynccontextmanager
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from uuid import UUID
 
 from passlib.hash import sha256_crypt
 
-from dao import (AccessTokenDAO, OrderDAO, OrderProductDAO, ProductDAO, SqlAlchemyOrderDAO, SqlAlchemyOrderProductDAO,
-                 SqlAlchemyProductDAO, SqlAlchemyTokenDAO, SqlAlchemyUserDAO, SqlAlchemyUserOrderDAO, UserDAO,
-                 UserOrderDAO)
-from exceptions import (OrderNotFoundException, ProductNotEnoughException, ProductNotFoundException,
+from dao import (AccessTokenDAO, DAO_BACKENDS, DEFAULT_DAO_BACKEND, OrderDAO, OrderProductDAO, ProductDAO,
+                 ProductSalesDAO, RevokedTokenDAO, UserDAO, UserOrderDAO)
+from exceptions import (InvalidTokenException, OrderNotFoundException, ProductNotFoundException,
                         UserNotFoundException)
-from storage import Order, OrderProduct, Product, User, UserOrder
+from sharding import Shard, ShardMap
+from singleflight import SingleFlight
+from slugindex import SlugIndex
+from snapshot import CatalogSnapshot, SharedCatalog
+from storage import Order, OrderProduct, Product, ProductSales, ProductSearch, TokenClaims, User, UserOrder
+from tokens import TokenSigner
+from tracing import traced_methods
 
 
+@traced_methods
 class AuthService:
     """Сервис, инкапсулирующий логику аутентификации."""
 
@@ -36,63 +48,113 @@ class AuthService:
         return sha256_crypt.verify(password, user.password)
 
 
+@traced_methods
 class AccessTokenService:
     """Сервис, инкапсулирующий логику работы с токенами."""
 
-    def __init__(self, dao: AccessTokenDAO) -> None:
+    def __init__(self,
+                 dao: AccessTokenDAO,
+                 revoked_token_dao: RevokedTokenDAO,
+                 signer: Optional[TokenSigner] = None) -> None:
         """
         Инициализация экземпляра класса сервиса.
 
         :param dao: DAO-объект для работы с сущностью Токен (AccessToken)
+        :param revoked_token_dao: DAO-объект для работы со списком отозванных токенов
+        :param signer: объект подписи токенов; если передан, выдаются подписанные токены
         """
         self.dao = dao
+        self.revoked_token_dao = revoked_token_dao
+        self.signer = signer
 
     async def get_by_login(self, login: str) -> str:
         """
         Вернуть токен пользователя.
 
+        Если настроена подпись токенов, вместо хранимого в БД токена выдается
+        новый подписанный токен, который проверяется без обращения к БД.
+        Выдача подписанного токена по-прежнему требует наличия у пользователя токена в БД.
+
         :param login: логин пользователя
         :return: токен пользователя
         :raise TokenNotFoundException: выбрасывается, если токен не был найден
         """
         access_token = await self.dao.get_by_login(login=login)
-        return access_token.token
+        if self.signer is None:
+            return access_token.token
+        return self.signer.issue(user_id=access_token.user_id, login=login)
+
+    async def revoke(self, token: str) -> TokenClaims:
+        """
+        Отозвать подписанный токен.
+
+        :param token: подписанный токен
+        :return: утверждения отозванного токена
+        :raise InvalidTokenException: выбрасывается, если подпись токенов не настроена,
+            либо токен поврежден, подделан или просрочен
+        """
+        if self.signer is None:
+            raise InvalidTokenException
+        claims = self.signer.verify(token)
+        await self.revoked_token_dao.create(claims)
+        return claims
 
 
+@traced_methods
 class ProductService:
     """Сервис, инкапсулирующий бизнес-логику продуктов."""
 
-    def __init__(self, dao: ProductDAO) -> None:
+    def __init__(self,
+                 dao: ProductDAO,
+                 single_flight: Optional[SingleFlight] = None,
+                 slug_index: Optional[SlugIndex] = None,
+                 catalog: Optional[SharedCatalog] = None,
+                 flight_scope: Optional[Hashable] = None) -> None:
         """
         Инициализация экземпляра класса сервиса.
 
         :param dao: продуктовый DAO-объект
+        :param single_flight: группа объединения одновременных одинаковых запросов на чтение
+                              (только для чтения: результат мог быть прочитан вне транзакции
+                              текущего запроса); если не передана, каждый вызов выполняет собственный запрос
+        :param slug_index: индекс slug-ов продуктов, по которому несуществующие продукты
+                           не ищутся в БД; если не передан, каждый поиск обращается к БД
+        :param catalog: общий для процессов снимок каталога, из которого читаются продукты
+                        (только для чтения: данные снимка могут незначительно отставать от БД)
+        :param flight_scope: источник данных (engine БД), на котором выполняются запросы;
+                             объединяются только запросы к одному источнику, чтобы чтение с primary
+                             не получило результат запроса к отстающей реплике
         """
         self.dao = dao
+        self.single_flight = single_flight
+        self.slug_index = slug_index
+        self.catalog = catalog
+        self.flight_scope = flight_scope
 
     async def get_by_slug(self, slug: str) -> Product:
         """
         Поиск продукта по короткому имени slug.
 
+        Продукт ищется в снимке каталога, если он доступен; продукт, отсутствующий
+        в снимке (например, только что созданный), ищется в БД.
+        Одновременные поиски одного и того же продукта на одном источнике данных выполняются одним запросом к БД.
+        Каждый вызывающий получает собственную копию продукта, которую может изменять.
+
         :param slug: короткое наименование продукта
         :return: найденый экземпляр продукта
         :raise ProductNotFoundException: выбрасывается, если продукт не был найден
         """
-        return await self.dao.get_by_slug(slug)
+        snapshot = self._get_snapshot()
+        product = snapshot.get_by_slug(slug) if snapshot is not None else None
+        if product is not None:
+            return product
 
-    async def exists_by_slug(self, slug: str) -> bool:
-        """
-        Проверка на существование продукта в БД по его короткому имени slug.
+        if self.single_flight is None:
+            return await self._by_slug(slug, partial(self.dao.get_by_slug, slug))
 
-        :param slug: короткое наименование продукта
-        :return: булево значение, обозначающее существование или отстутствие продукта
-        """
-        try:
-            await self.get_by_slug(slug)
-        except ProductNotFoundException:
-            return False
-        else:
-            return True
+        product = await self._by_slug(slug, partial(
+            self.single_flight.do, ('product', self.flight_scope, slug), partial(self.dao.get_by_slug, slug)))
+        return copy.copy(product)
 
     async def get_all(self) -> Iterable[Product]:
         """
@@ -100,7 +162,36 @@ class ProductService:
 
         :return: коллекция экземпляров класса `Product`
         """
-        return await self.dao.get_all()
+        products, _ = await self.get_catalog()
+        return products
+
+    async def get_catalog(self) -> Tuple[Iterable[Product], Optional[str]]:
+        """
+        Вернуть коллекцию всех продуктов и версию каталога, из которой она прочитана.
+
+        Каталог читается из снимка, если он доступен; версия известна только в этом случае.
+        Одновременные запросы всего каталога к одному источнику данных выполняются одним запросом к БД.
+
+        :return: кортеж вида (коллекция экземпляров класса `Product`, версия каталога или None)
+        """
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            return snapshot.get_all(), snapshot.tag
+
+        if self.single_flight is None:
+            return await self.dao.get_all(), None
+
+        products = await self.single_flight.do(('products', self.flight_scope), self.dao.get_all)
+        return [copy.copy(product) for product in products], None
+
+    async def search(self, search: ProductSearch) -> Iterable[Product]:
+        """
+        Найти продукты, упорядоченные по релевантности.
+
+        :param search: параметры поиска
+        :return: страница коллекции экземпляров класса `Product`
+        """
+        return await self.dao.search(search)
 
     async def create(self, product: Product) -> Product:
         """
@@ -108,36 +199,70 @@ class ProductService:
 
         :param product: экземпляр продукта, который необходимо создать
         :return: созданный экземпляр продукта
+        :raise ProductAlreadyExistsException: выбрасывается, если продукт с таким slug уже существует
         """
-        return await self.dao.create(product=product)
+        created = await self.dao.create(product=product)
+        if self.slug_index is not None:
+            self.slug_index.add(created.slug)
+        return created
 
-    async def update(self, product: Product) -> Product:
+    async def update(self, slug: str, values: Dict[str, Any]) -> Product:
         """
-        Обновить продукт.
+        Обновить продукт по его короткому имени slug.
 
-        :param product: экземпляр продукта с данными, которые необходимо обновить
+        Обновляются только переданные поля.
+
+        :param slug: короткое наименование продукта
+        :param values: новые значения изменяемых полей продукта
         :return: обновленный экземпляр продукта
+        :raise ProductNotFoundException: выбрасывается, если продукт не был найден
         """
-        return await self.dao.update(product=product)
+        return await self._by_slug(slug, partial(self.dao.update_by_slug, slug=slug, values=values))
 
-    async def delete(self, product: Product) -> Product:
+    async def delete(self, slug: str) -> Product:
         """
-        Удалить продукт.
+        Удалить продукт по его короткому имени slug.
 
-        :param product: экземпляр продукта, который необходимо удалить
+        :param slug: короткое наименование продукта
         :return: удаленный экземпляр продукта
+        :raise ProductNotFoundException: выбрасывается, если продукт не был найден
         """
-        return await self.dao.delete(product=product)
+        return await self._by_slug(slug, partial(self.dao.delete_by_slug, slug=slug))
 
+    def _get_snapshot(self) -> Optional[CatalogSnapshot]:
+        return self.catalog.get() if self.catalog is not None else None
 
+    async def _by_slug(self, slug: str, query: Callable[[], Awaitable[Product]]) -> Product:
+        if self.slug_index is None:
+            return await query()
+        if not self.slug_index.might_contain(slug):
+            raise ProductNotFoundException
+
+        try:
+            return await query()
+        except ProductNotFoundException:
+            self.slug_index.record_false_positive()
+            raise
+
+
+@traced_methods
 class OrderService:
-    """Сервис, инкапсулирующий бизнес-логику заказов."""
+    """
+    Сервис, инкапсулирующий бизнес-логику заказов.
+
+    Если заданы шарды заказов, заказы, их продукты и связи с пользователями читаются
+    и записываются на шарде пользователя (при поиске по номеру - на шарде из номера заказа),
+    а продукты и агрегаты продаж остаются в основной БД.
+    """
 
     def __init__(self,
                  order_dao: OrderDAO,
                  product_dao: ProductDAO,
                  order_product_dao: OrderProductDAO,
-                 user_order_dao: UserOrderDAO) -> None:
+                 user_order_dao: UserOrderDAO,
+                 product_sales_dao: ProductSalesDAO,
+                 shards: Optional[ShardMap] = None,
+                 daos: Optional[dict] = None) -> None:
         """
         Инициализация экземпляра класса сервиса.
 
@@ -145,11 +270,36 @@ class OrderService:
         :param product_dao:
         :param order_product_dao:
         :param user_order_dao:
+        :param product_sales_dao: DAO-объект агрегатов продаж продуктов
+        :param shards: отображение пользователей и номеров заказов на шарды
+        :param daos: классы DAO backend-а хранения данных для соединений с шардами
         """
         self.order_dao = order_dao
         self.product_dao = product_dao
         self.order_product_dao = order_product_dao
         self.user_order_dao = user_order_dao
+        self.product_sales_dao = product_sales_dao
+        self.shards = shards
+        self.daos = daos
+
+    @asynccontextmanager
+    async def _order_daos(self,
+                          shard: Optional[Shard]) -> AsyncIterator[Tuple[OrderDAO, OrderProductDAO, UserOrderDAO]]:
+        if shard is None:
+            yield self.order_dao, self.order_product_dao, self.user_order_dao
+            return
+
+        async with shard.engine.acquire() as conn:
+            trans = await conn.begin()
+            try:
+                yield self.daos['order'](conn), self.daos['order_product'](conn), self.daos['user_order'](conn)
+            except BaseException:
+                await trans.rollback()
+                raise
+            await trans.commit()
+
+    def _get_user_shard(self, user: User) -> Optional[Shard]:
+        return self.shards.for_user(user.id) if self.shards is not None else None
 
     async def get_by_number(self, user: User, number: int) -> Tuple[Order, Iterable[OrderProduct]]:
         """
@@ -161,55 +311,153 @@ class OrderService:
         :raise OrderNotFoundException: выбрасывается в случае, если заказ не был найден,
             либо он принадлежит другому пользователю
         """
-        order = await self.order_dao.get_by_number(number)
-        user_order = UserOrder(user_id=user.id, order_id=order.id)
-        if not await self.user_order_dao.exists(user_order):
-            raise OrderNotFoundException
-        order_products = await self.order_product_dao.get_all(order_id=order.id)
+        shard = None
+        if self.shards is not None:
+            shard = self.shards.for_order(number)
+            if shard is None:
+                raise OrderNotFoundException
+
+        async with self._order_daos(shard) as (order_dao, order_product_dao, user_order_dao):
+            order = await order_dao.get_by_number(number)
+            user_order = UserOrder(user_id=user.id, order_id=order.id)
+            if not await user_order_dao.exists(user_order):
+                raise OrderNotFoundException
+            order_products = await order_product_dao.get_all(order=order)
         return order, order_products
 
+    async def get_all(self,
+                      user: User,
+                      before: Optional[int] = None,
+                      limit: int = 20) -> List[Tuple[Order, List[OrderProduct]]]:
+        """
+        Получить страницу истории заказов пользователя.
+
+        Продукты всех заказов страницы загружаются одним запросом.
+
+        :param user: экземпляр пользователя, чьи заказы необходимо получить
+        :param before: номер заказа, после которого (по убыванию) начинается страница
+        :param limit: максимальное количество заказов на странице
+        :return: список кортежей вида (заказ, список продуктов для заказа)
+        """
+        async with self._order_daos(self._get_user_shard(user)) as (order_dao, order_product_dao, _):
+            orders = await order_dao.get_all_by_user(user_id=user.id, before=before, limit=limit)
+            order_products = {order.id: [] for order in orders}
+            for order_product in await order_product_dao.get_all_by_orders(orders=orders):
+                order_products[order_product.order_id].append(order_product)
+        return [(order, order_products[order.id]) for order in orders]
+
     async def create(self,
                      user: User,
                      products: Iterable[Tuple[Product, int]]) -> Tuple[Order, Iterable[OrderProduct]]:
         """
         Создать заказ.
 
+        Цены продуктов на момент создания заказа сохраняются в его строках, а сумма - в самом заказе.
+        Агрегаты продаж продуктов обновляются в той же транзакции.
+        Остатки списываются атомарно на стороне хранилища, а не записываются вычисленными
+        по прочитанному ранее значению, поэтому одновременные заказы не теряют списаний.
+
+        На шарде заказ записывается в отдельной транзакции после изменений основной БД
+        и фиксируется раньше нее: ошибка на шарде откатывает и изменения основной БД,
+        но если после этого не удастся зафиксировать транзакцию основной БД,
+        на шарде останется заказ без списания остатков.
+
         :param user: экземпляр пользователя, которому необходимо привязать созданный заказ
         :param products: коллекция кортежей вида (продукт, количество)
         :return: кортеж вида (заказ, список продуктов для заказа)
         :raise ProductNotEnoughException: выбрасывается в случае, если количество товара на складе недостаточно
         """
-        order = await self.order_dao.create()
-
-        order_products = []
+        # Цены берутся из строк, возвращенных списанием, а не из прочитанных ранее продуктов:
+        # цена могла измениться между чтением и списанием.
+        products = [(await self.product_dao.take_from_stock(product, quantity), quantity)
+                    for product, quantity in products]
+        sales: Dict[UUID, ProductSales] = {}
         for product, quantity in products:
-            if not product.is_enough_in_stock(quantity):
-                raise ProductNotEnoughException(product=product)
-
-            product.left_in_stock -= quantity
-            order_product = OrderProduct(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=quantity)
-            await self.product_dao.update(product)
-            await self.order_product_dao.create(order_product)
-            order_products.append(order_product)
-
-        user_order = UserOrder(user_id=user.id, order_id=order.id)
-        await self.user_order_dao.create(user_order)
+            product_sales = sales.setdefault(
+                product.id, ProductSales(product_id=product.id, units_sold=0, revenue=Decimal(0)))
+            product_sales.units_sold += quantity
+            product_sales.revenue += product.price * quantity
+        await self.product_sales_dao.add(sales.values())
+
+        async with self._order_daos(self._get_user_shard(user)) as (order_dao, order_product_dao, user_order_dao):
+            order = await order_dao.create(total=sum((item.revenue for item in sales.values()), Decimal(0)))
+
+            order_products = []
+            for product, quantity in products:
+                order_product = OrderProduct(
+                    order_id=order.id,
+                    product_id=product.id,
+                    quantity=quantity,
+                    price=product.price)
+                await order_product_dao.create(order_product, order_number=order.number)
+                order_products.append(order_product)
+
+            user_order = UserOrder(user_id=user.id, order_id=order.id)
+            await user_order_dao.create(user_order, order_number=order.number)
         return order, order_products
 
 
+@traced_methods
+class AnalyticsService:
+    """Сервис, инкапсулирующий логику аналитики продаж."""
+
+    def __init__(self, product_sales_dao: ProductSalesDAO) -> None:
+        """
+        Инициализация экземпляра класса сервиса.
+
+        :param product_sales_dao: DAO-объект агрегатов продаж продуктов
+        """
+        self.product_sales_dao = product_sales_dao
+
+    async def get_top_products(self,
+                               since: Optional[datetime] = None,
+                               until: Optional[datetime] = None,
+                               order_by: str = 'units_sold',
+                               limit: int = 10) -> Iterable[ProductSales]:
+        """
+        Получить самые продаваемые продукты за период.
+
+        :param since: начало периода (включительно), None - без ограничения
+        :param until: конец периода (не включительно), None - без ограничения
+        :param order_by: поле сортировки по убыванию ('units_sold' или 'revenue')
+        :param limit: максимальное количество продуктов
+        :return: коллекция продаж продуктов
+        """
+        return await self.product_sales_dao.get_top(since=since, until=until, order_by=order_by, limit=limit)
+
+
 class ServiceFactory:
     """Фабрика создания объектов-сервисов."""
 
-    def __init__(self, conn) -> None:
+    def __init__(self,
+                 conn,
+                 single_flight: Optional[SingleFlight] = None,
+                 token_signer: Optional[TokenSigner] = None,
+                 backend: str = DEFAULT_DAO_BACKEND,
+                 slug_index: Optional[SlugIndex] = None,
+                 catalog: Optional[SharedCatalog] = None,
+                 shards: Optional[ShardMap] = None,
+                 flight_scope: Optional[Hashable] = None) -> None:
         """
         Инициализация фабрики.
 
-        :param conn: объект подключения к БД
+        :param conn: объект подключения к БД (или к хранилищу в памяти для backend-а memory)
+        :param single_flight: группа объединения одновременных одинаковых запросов на чтение
+        :param token_signer: объект подписи токенов доступа
+        :param backend: наименование backend-а хранения данных из `DAO_BACKENDS`
+        :param slug_index: индекс slug-ов продуктов
+        :param catalog: общий для процессов снимок каталога продуктов
+        :param shards: отображение пользователей и номеров заказов на шарды
+        :param flight_scope: источник данных (engine БД) подключения для ключей объединения запросов
         """
         self.conn = conn
+        self.single_flight = single_flight
+        self.token_signer = token_signer
+        self.daos = DAO_BACKENDS[backend]
+        self.slug_index = slug_index
+        self.catalog = catalog
+        self.shards = shards
+        self.flight_scope = flight_scope
 
     def create_auth_service(self) -> AuthService:
         """
@@ -217,7 +465,7 @@ class ServiceFactory:
 
         :return: объект-сервис для работы с аутентификацией
         """
-        return AuthService(dao=SqlAlchemyUserDAO(self.conn))
+        return AuthService(dao=self.daos['user'](self.conn))
 
     def create_access_token_service(self) -> AccessTokenService:
         """
@@ -225,7 +473,10 @@ class ServiceFactory:
 
         :return: объект-сервис для работы с токенами
         """
-        return AccessTokenService(dao=SqlAlchemyTokenDAO(self.conn))
+        return AccessTokenService(
+            dao=self.daos['access_token'](self.conn),
+            revoked_token_dao=self.daos['revoked_token'](self.conn),
+            signer=self.token_signer)
 
     def create_product_service(self) -> ProductService:
         """
@@ -233,7 +484,11 @@ class ServiceFactory:
 
         :return: объект-сервис для работы с продуктами
         """
-        return ProductService(dao=SqlAlchemyProductDAO(self.conn))
+        return ProductService(dao=self.daos['product'](self.conn),
+                              single_flight=self.single_flight,
+                              slug_index=self.slug_index,
+                              catalog=self.catalog,
+                              flight_scope=self.flight_scope)
 
     def create_order_service(self) -> OrderService:
         """
@@ -242,8 +497,19 @@ class ServiceFactory:
         :return: объект-сервис для работы с заказами
         """
         return OrderService(
-            order_dao=SqlAlchemyOrderDAO(self.conn),
-            product_dao=SqlAlchemyProductDAO(self.conn),
-            order_product_dao=SqlAlchemyOrderProductDAO(self.conn),
-            user_order_dao=SqlAlchemyUserOrderDAO(self.conn)
+            order_dao=self.daos['order'](self.conn),
+            product_dao=self.daos['product'](self.conn),
+            order_product_dao=self.daos['order_product'](self.conn),
+            user_order_dao=self.daos['user_order'](self.conn),
+            product_sales_dao=self.daos['product_sales'](self.conn),
+            shards=self.shards,
+            daos=self.daos
         )
+
+    def create_analytics_service(self) -> AnalyticsService:
+        """
+        Создать объект-сервис для работы с аналитикой продаж.
+
+        :return: объект-сервис для работы с аналитикой продаж
+        """
+        return AnalyticsService(product_sales_dao=self.daos['product_sales'](self.conn))
@@ -4,6 +4,7 @@ import yaml
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 config_path = os.path.join(BASE_DIR, 'config/shop.yaml')
+override_path = os.environ.get('SHOP_CONFIG_OVERRIDE')
 
 
 def get_config(path) -> dict:
@@ -18,4 +19,25 @@ def get_config(path) -> dict:
     return cfg
 
 
+def override_config(cfg: dict, path: str) -> dict:
+    """
+    Дополнить настройки значениями из переопределяющего yaml-файла.
+
+    Разделы переопределяющего файла объединяются с одноименными разделами
+    основных настроек, значения переопределяющего файла имеют приоритет.
+
+    :param cfg: словарь основных настроек
+    :param path: путь до переопределяющего конфигурационного файла
+    :return: словарь итоговых настроек
+    """
+    for section, values in get_config(path).items():
+        if isinstance(values, dict) and isinstance(cfg.get(section), dict):
+            cfg[section] = dict(cfg[section], **values)
+        else:
+            cfg[section] = values
+    return cfg
+
+
 config = get_config(config_path)
+if override_path:
+    config = override_config(config, override_path)
@@ -0,0 +1,122 @@
+import logging
+from typing import List, Optional
+from uuid import UUID
+
+from aiopg.sa import create_engine
+
+from db import ORDER_NUMBER_INCREMENT
+
+logger = logging.getLogger(__name__)
+
+
+class Shard:
+    """Шард заказов - отдельная БД с таблицами заказов, их продуктов и связей с пользователями."""
+
+    def __init__(self, id: int, name: str, engine) -> None:
+        """
+        Инициализация шарда.
+
+        :param id: идентификатор шарда (от 0 до ORDER_NUMBER_INCREMENT - 1)
+        :param name: наименование шарда (хост:порт/БД)
+        :param engine: engine БД шарда
+        """
+        self.id = id
+        self.name = name
+        self.engine = engine
+
+
+def validate_shard_ids(ids: List[int]) -> None:
+    """
+    Проверить идентификаторы шардов.
+
+    :param ids: список идентификаторов шардов
+    :raise ValueError: выбрасывается, если шардов нет, идентификаторы повторяются
+        или не помещаются в шаг последовательности номеров заказов
+    """
+    if not ids:
+        raise ValueError('At least one order shard is required')
+    if len(set(ids)) != len(ids):
+        raise ValueError('Order shard ids must be unique')
+    if not all(0 <= shard_id < ORDER_NUMBER_INCREMENT for shard_id in ids):
+        raise ValueError('Order shard ids must be in range [0, {max})'.format(max=ORDER_NUMBER_INCREMENT))
+
+
+class ShardMap:
+    """
+    Отображение пользователей и номеров заказов на шарды.
+
+    Пользователь закреплен за шардом с порядковым номером `user_id mod количество шардов`,
+    его заказы создаются и читаются на этом шарде. Последовательность номеров заказов шарда
+    начинается с ORDER_NUMBER_START + идентификатор шарда с шагом ORDER_NUMBER_INCREMENT,
+    поэтому номера глобально уникальны, а остаток от деления номера на шаг - идентификатор
+    шарда: заказ по номеру находится без опроса всех шардов.
+
+    Количество шардов нельзя менять после появления заказов: пользователи
+    отобразятся на другие шарды и перестанут видеть свою историю заказов.
+    """
+
+    def __init__(self, shards: List[Shard]) -> None:
+        """
+        Инициализация отображения.
+
+        :param shards: список шардов
+        :raise ValueError: выбрасывается, если идентификаторы шардов некорректны
+        """
+        validate_shard_ids([shard.id for shard in shards])
+        self.shards = sorted(shards, key=lambda shard: shard.id)
+        self._by_id = {shard.id: shard for shard in self.shards}
+
+    def for_user(self, user_id: UUID) -> Shard:
+        """
+        Вернуть шард заказов пользователя.
+
+        :param user_id: идентификатор пользователя
+        :return: шард
+        """
+        return self.shards[user_id.int % len(self.shards)]
+
+    def for_order(self, number: int) -> Optional[Shard]:
+        """
+        Вернуть шард заказа по его номеру.
+
+        :param number: номер заказа
+        :return: шард или None, если шарда с идентификатором из номера нет (заказ не существует)
+        """
+        return self._by_id.get(number % ORDER_NUMBER_INCREMENT)
+
+
+async def init_shards(app) -> None:
+    """
+    Инициализация engine-ов шардов заказов.
+
+    Шарды задаются в разделе `sharding` конфигурационного файла, незаданные параметры
+    подключения берутся из раздела `postgres`. Если шардирование выключено,
+    заказы хранятся в основной БД (`app['shards']` равен None).
+    """
+    config = app['config'].get('sharding', {})
+    app['shards'] = None
+    if not config.get('enabled', False):
+        return
+
+    shard_configs = [dict(app['config']['postgres'], **shard_config) for shard_config in config.get('shards', [])]
+    validate_shard_ids([shard_config['id'] for shard_config in shard_configs])
+    shards = []
+    for shard_config in shard_configs:
+        shard_id = shard_config.pop('id')
+        name = '{host}:{port}/{database}'.format(**shard_config)
+        shards.append(Shard(id=shard_id, name=name, engine=await create_engine(**shard_config)))
+        logger.info('Order shard %d: %s', shard_id, name)
+    app['shards'] = ShardMap(shards)
+
+
+async def close_shards(app) -> None:
+    """Завершение всех соединений с шардами заказов."""
+    shard_map: Optional[ShardMap] = app.get('shards')
+    if shard_map is None:
+        return
+
+    engines = [shard.engine for shard in shard_map.shards]
+    for engine in engines:
+        engine.close()
+    for engine in engines:
+        await engine.wait_closed()
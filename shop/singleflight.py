@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вызовов (single-flight).
+
+    Первый вызов с данным ключом (лидер) выполняет операцию в своей задаче,
+    остальные одновременные вызовы с тем же ключом дожидаются ее результата,
+    не выполняя операцию повторно.
+
+    Исключение, выброшенное операцией, получают все ожидающие. Отмена задачи
+    ожидающего вызова не влияет на остальных. Если же отменяется задача лидера,
+    ожидающие не получают CancelledError, а повторяют вызов, выбирая нового лидера.
+    """
+
+    def __init__(self) -> None:
+        """Инициализация пустой группы вызовов."""
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить операцию, либо дождаться результата уже выполняющейся операции с тем же ключом.
+
+        :param key: ключ операции, одинаковый для взаимозаменяемых вызовов
+        :param func: функция без аргументов, возвращающая awaitable-объект операции
+        :return: результат операции
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self._lead(key, func)
+
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+    async def _lead(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = asyncio.get_event_loop().create_future()
+        # Исключение могут не забрать, если ожидающих не было.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
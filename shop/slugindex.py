@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from typing import Iterable, List, Optional
+
+from changefeed import ProductChangeSubscriber
+from dao import DAO_BACKENDS
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума над строками.
+
+    Отвечает, что строка точно отсутствует во множестве или, возможно, присутствует:
+    ложноположительные ответы возможны, ложноотрицательные - нет. Позиции битов
+    вычисляются двойным хешированием по одному дайджесту blake2b.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """
+        Инициализация пустого фильтра.
+
+        :param capacity: ожидаемое количество элементов
+        :param error_rate: допустимая доля ложноположительных ответов при `capacity` элементах
+        """
+        self.capacity = max(capacity, 1)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: str) -> None:
+        """
+        Добавить строку в фильтр.
+
+        :param key: строка
+        """
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Проверить, может ли строка присутствовать в фильтре.
+
+        :param key: строка
+        :return: False, если строка точно отсутствует; True - если, возможно, присутствует
+        """
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def expected_error_rate(self) -> float:
+        """Вернуть ожидаемую долю ложноположительных ответов при текущем количестве элементов."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def _positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+
+class SlugIndex:
+    """
+    Вероятностный индекс slug-ов продуктов процесса.
+
+    Позволяет отвечать на запросы несуществующих продуктов (устаревшие ссылки, обход
+    сайта роботами) без обращения к БД. Фильтр строится из всех slug-ов продуктов
+    и пополняется созданными продуктами; удаленные продукты остаются в фильтре
+    до следующей перестройки. Пока фильтр не построен или сброшен (часть изменений
+    могла быть пропущена), любой slug считается возможно существующим.
+
+    Доля ложноположительных ответов оценивается как отношение количества продуктов,
+    не найденных в БД после положительного ответа фильтра, ко всем запросам несуществующих продуктов.
+    """
+
+    def __init__(self, error_rate: float = 0.01, growth_factor: float = 2.0, min_capacity: int = 1024) -> None:
+        """
+        Инициализация индекса без фильтра.
+
+        :param error_rate: допустимая доля ложноположительных ответов фильтра
+        :param growth_factor: во сколько раз емкость фильтра превышает количество продуктов при построении
+        :param min_capacity: минимальная емкость фильтра
+        """
+        self.error_rate = error_rate
+        self.growth_factor = growth_factor
+        self.min_capacity = min_capacity
+        self.filter: Optional[BloomFilter] = None
+        self.built_at: Optional[float] = None
+        self.definite_misses = 0
+        self.false_positives = 0
+
+    def might_contain(self, slug: str) -> bool:
+        """
+        Проверить, может ли существовать продукт с данным slug.
+
+        :param slug: короткое наименование продукта
+        :return: False, если продукт точно не существует; True - если, возможно, существует
+        """
+        if self.filter is None or slug in self.filter:
+            return True
+
+        self.definite_misses += 1
+        return False
+
+    def add(self, slug: str) -> None:
+        """
+        Добавить slug созданного продукта.
+
+        :param slug: короткое наименование продукта
+        """
+        if self.filter is not None:
+            self.filter.add(slug)
+
+    def record_false_positive(self) -> None:
+        """Учесть продукт, не найденный в БД после положительного ответа фильтра."""
+        if self.filter is not None:
+            self.false_positives += 1
+
+    def invalidate(self) -> None:
+        """Сбросить фильтр до перестройки, если часть изменений продуктов могла быть пропущена."""
+        self.filter = None
+
+    def build(self, slugs: Iterable[str]) -> BloomFilter:
+        """
+        Построить фильтр из slug-ов продуктов.
+
+        :param slugs: коллекция slug-ов всех продуктов
+        :return: фильтр
+        """
+        slugs = list(slugs)
+        bloom = BloomFilter(capacity=max(math.ceil(len(slugs) * self.growth_factor), self.min_capacity),
+                            error_rate=self.error_rate)
+        for slug in slugs:
+            bloom.add(slug)
+        return bloom
+
+    def replace(self, bloom: BloomFilter) -> None:
+        """
+        Заменить фильтр построенным и обнулить счетчики.
+
+        :param bloom: фильтр
+        """
+        self.filter = bloom
+        self.built_at = time.time()
+        self.definite_misses = 0
+        self.false_positives = 0
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """Проверить, заполнен ли фильтр сверх емкости (доля ложноположительных ответов растет)."""
+        return self.filter is not None and self.filter.count > self.filter.capacity
+
+    def get_stats(self) -> dict:
+        """
+        Вернуть показатели индекса с момента последнего построения фильтра.
+
+        :return: словарь показателей
+        """
+        stats = {
+            'ready': self.filter is not None,
+            'built_at': self.built_at,
+            'definite_misses': self.definite_misses,
+            'false_positives': self.false_positives,
+            'false_positive_rate': None
+        }
+        misses = self.definite_misses + self.false_positives
+        if misses:
+            stats['false_positive_rate'] = self.false_positives / misses
+        if self.filter is not None:
+            stats.update(size=self.filter.count, capacity=self.filter.capacity, bits=self.filter.size,
+                         hashes=self.filter.hashes, expected_false_positive_rate=self.filter.expected_error_rate)
+        return stats
+
+
+async def _rebuild(app, index: SlugIndex) -> bool:
+    try:
+        # Только primary: на отстающей реплике может не быть недавно созданных продуктов.
+        async with app['db'].acquire() as conn:
+            slugs = await DAO_BACKENDS[app['dao_backend']]['product'](conn).get_all_slugs()
+    except Exception:
+        logger.exception('Slug index rebuild failed')
+        return False
+
+    if index.filter is not None:
+        logger.info('Rebuilding slug index: %s', index.get_stats())
+    bloom = await asyncio.get_event_loop().run_in_executor(None, index.build, slugs)
+    index.replace(bloom)
+    return True
+
+
+async def _maintain(app, index: SlugIndex, subscriber: ProductChangeSubscriber,
+                    rebuild_interval: float, retry_interval: float) -> None:
+    loop = asyncio.get_event_loop()
+    rebuild_at = loop.time()
+    while not subscriber.closed:
+        timeout = rebuild_at - loop.time()
+        if timeout <= 0 or index.needs_rebuild:
+            # Изменения, произошедшие во время перестройки, накапливаются в буфере подписчика
+            # и применяются к новому фильтру.
+            rebuilt = await _rebuild(app, index)
+            rebuild_at = loop.time() + (rebuild_interval if rebuilt else retry_interval)
+            continue
+        if not await subscriber.wait(timeout):
+            continue
+
+        reset, changes = subscriber.drain()
+        if reset:
+            index.invalidate()
+            rebuild_at = loop.time()
+            continue
+        for change in changes:
+            if change['op'] == 'insert':
+                index.add(change['slug'])
+
+
+async def init_slug_index(app) -> None:
+    """
+    Запуск построения и поддержки индекса slug-ов продуктов.
+
+    Индекс пополняется из потока изменений продуктов, поэтому видит продукты, созданные
+    любым процессом (в том числе импортом каталога), и периодически перестраивается,
+    чтобы освободиться от удаленных продуктов и увеличить емкость.
+    """
+    index: Optional[SlugIndex] = app['slug_index']
+    if index is None:
+        return
+
+    config = app['config'].get('slug_index', {})
+    subscriber = app['product_changes'].subscribe()
+    app['slug_index_task'] = asyncio.ensure_future(_maintain(
+        app, index, subscriber,
+        rebuild_interval=config.get('rebuild_interval', 3600),
+        retry_interval=config.get('retry_interval', 5)))
+
+
+async def close_slug_index(app) -> None:
+    """Остановка поддержки индекса slug-ов продуктов."""
+    task = app.get('slug_index_task')
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,274 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from decimal import Decimal
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from dao import DAO_BACKENDS
+from storage import Product
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'SHOPCAT1'
+# Заголовок: сигнатура, версия, время построения (unix time), количество продуктов.
+HEADER = struct.Struct('<8sQdI4x')
+# Запись продукта: id, остаток на складе и пары (смещение, длина) строк slug, name, description и price.
+RECORD = struct.Struct('<16sq8I')
+
+
+def write_snapshot(path: str, products: Iterable[Product]) -> int:
+    """
+    Записать снимок каталога продуктов в файл.
+
+    Формат файла: заголовок, массив записей фиксированного размера, упорядоченный по slug
+    (для двоичного поиска), и область строк в utf-8; цена хранится строкой без потери точности.
+    Снимок записывается во временный файл и атомарно заменяет предыдущий, поэтому читатели
+    никогда не видят частично записанный снимок и продолжают читать старый, пока не переоткроют файл.
+
+    :param path: путь до файла снимка
+    :param products: коллекция всех продуктов
+    :return: версия записанного снимка (на единицу больше предыдущей)
+    """
+    products = sorted(products, key=lambda product: product.slug.encode('utf-8'))
+    heap = bytearray()
+    heap_offset = HEADER.size + RECORD.size * len(products)
+
+    def put(text: str) -> Tuple[int, int]:
+        data = text.encode('utf-8')
+        offset = heap_offset + len(heap)
+        heap.extend(data)
+        return offset, len(data)
+
+    records = bytearray()
+    for product in products:
+        records.extend(RECORD.pack(product.id.bytes, product.left_in_stock,
+                                   *put(product.slug), *put(product.name),
+                                   *put(product.description), *put(str(product.price))))
+
+    version = _read_version(path) + 1
+    tmp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(SNAPSHOT_MAGIC, version, time.time(), len(products)))
+        file.write(records)
+        file.write(heap)
+    os.replace(tmp_path, path)
+    return version
+
+
+def _read_version(path: str) -> int:
+    try:
+        with open(path, 'rb') as file:
+            magic, version, _, _ = HEADER.unpack(file.read(HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return version if magic == SNAPSHOT_MAGIC else 0
+
+
+class CatalogSnapshot:
+    """
+    Снимок каталога продуктов, отображенный в память только для чтения.
+
+    Страницы файла разделяются всеми процессами хоста, поэтому каталог занимает
+    память один раз; продукты создаются из записей снимка только при чтении.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Открыть снимок.
+
+        :param path: путь до файла снимка
+        :raise ValueError: выбрасывается, если файл не является снимком каталога
+        """
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        magic, self.version, self.built_at, self.count = HEADER.unpack_from(self._mm)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('{path} is not a catalog snapshot'.format(path=path))
+
+    @property
+    def tag(self) -> str:
+        """Вернуть строку, однозначно определяющую содержимое снимка (версия и время построения)."""
+        return '{version}-{built_at:.6f}'.format(version=self.version, built_at=self.built_at)
+
+    def get_by_slug(self, slug: str) -> Optional[Product]:
+        """
+        Найти продукт по slug двоичным поиском.
+
+        :param slug: короткое наименование продукта
+        :return: экземпляр продукта или None, если его нет в снимке
+        """
+        key = slug.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record = RECORD.unpack_from(self._mm, HEADER.size + middle * RECORD.size)
+            current = self._mm[record[2]:record[2] + record[3]]
+            if current == key:
+                return self._to_product(record)
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get_all(self) -> List[Product]:
+        """
+        Вернуть все продукты снимка в порядке slug.
+
+        :return: список экземпляров продуктов
+        """
+        return [self._to_product(RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size))
+                for i in range(self.count)]
+
+    def close(self) -> None:
+        """Закрыть отображение файла в память."""
+        self._mm.close()
+
+    def _to_product(self, record: tuple) -> Product:
+        product_id, left_in_stock, *strings = record
+        mm = self._mm
+        slug, name, description, price = (mm[offset:offset + length].decode('utf-8')
+                                          for offset, length in zip(strings[::2], strings[1::2]))
+        return Product(name, description, Decimal(price), left_in_stock, id=UUID(bytes=product_id), slug=slug)
+
+
+class SharedCatalog:
+    """
+    Доступ процесса к актуальному снимку каталога продуктов.
+
+    Не чаще раза в `check_interval` секунд проверяет, не заменен ли файл снимка,
+    и переоткрывает его. Снимок старше `max_age` секунд (например, если процесс,
+    строящий снимки, не может обратиться к БД) не используется.
+    """
+
+    def __init__(self, path: str, check_interval: float = 0.1, max_age: float = 120) -> None:
+        """
+        Инициализация доступа к снимку.
+
+        :param path: путь до файла снимка
+        :param check_interval: интервал проверки замены файла, в секундах
+        :param max_age: максимальный возраст используемого снимка, в секундах
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = float('-inf')
+
+    def get(self) -> Optional[CatalogSnapshot]:
+        """
+        Вернуть актуальный снимок каталога.
+
+        :return: снимок или None, если снимка нет или он устарел
+        """
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._reopen()
+
+        if self.snapshot is None or time.time() - self.snapshot.built_at > self.max_age:
+            return None
+        return self.snapshot
+
+    def close(self) -> None:
+        """Закрыть текущий снимок."""
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def _reopen(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return
+        if self.snapshot is not None and self.snapshot.file_id == (stat.st_dev, stat.st_ino):
+            return
+
+        try:
+            snapshot = CatalogSnapshot(self.path)
+        except (OSError, ValueError, struct.error):
+            logger.exception('Failed to open catalog snapshot %s', self.path)
+            return
+        # Продукты создаются из снимка синхронно, поэтому предыдущий снимок больше никем не читается.
+        self.close()
+        self.snapshot = snapshot
+
+
+async def _build(app, path: str) -> bool:
+    try:
+        # Только primary: снимок не должен отставать вместе с репликой.
+        async with app['db'].acquire() as conn:
+            products = await DAO_BACKENDS[app['dao_backend']]['product'](conn).get_all()
+        version = await asyncio.get_event_loop().run_in_executor(None, write_snapshot, path, products)
+    except Exception:
+        logger.exception('Catalog snapshot build failed')
+        return False
+
+    logger.debug('Catalog snapshot %s built: version %d, %d products', path, version, len(products))
+    return True
+
+
+async def _lead(app, lock_file, path: str, config: dict) -> None:
+    # Снимки строит один процесс хоста - тот, кому удалось захватить блокировку файла;
+    # при его завершении блокировку снимает ОС, и строить снимки начинает другой процесс.
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            await asyncio.sleep(config.get('leader_retry_interval', 5))
+
+    loop = asyncio.get_event_loop()
+    subscriber = app['product_changes'].subscribe()
+    built_at = float('-inf')
+    while True:
+        # Изменения, произошедшие за min_interval секунд после предыдущего построения, объединяются.
+        delay = built_at + config.get('min_interval', 0.5) - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if subscriber.closed:
+            return
+
+        subscriber.drain()
+        built_at = loop.time()
+        if await _build(app, path):
+            await subscriber.wait(config.get('refresh_interval', 30))
+
+
+async def init_catalog_snapshot(app) -> None:
+    """
+    Запуск общего для процессов хоста снимка каталога продуктов.
+
+    Каждый процесс читает снимок (`app['catalog_snapshot']`), а один из них перестраивает
+    его после изменений продуктов и периодически.
+    """
+    config = app['config'].get('catalog_snapshot', {})
+    if not config.get('enabled', False):
+        return
+
+    path = config.get('path') or os.path.join(tempfile.gettempdir(), 'shop-catalog.snapshot')
+    app['catalog_snapshot'] = SharedCatalog(path,
+                                            check_interval=config.get('check_interval', 0.1),
+                                            max_age=config.get('max_age', 120))
+    app['catalog_snapshot_lock'] = open(path + '.lock', 'a')
+    app['catalog_snapshot_task'] = asyncio.ensure_future(_lead(app, app['catalog_snapshot_lock'], path, config))
+
+
+async def close_catalog_snapshot(app) -> None:
+    """Остановка построения снимков каталога и закрытие текущего снимка."""
+    task = app.get('catalog_snapshot_task')
+    if task is None:
+        return
+
+    task.cancel()
+    app['catalog_snapshot_lock'].close()
+    app['catalog_snapshot'].close()
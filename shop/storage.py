@@ -1,3 +1,5 @@
+from datetime import datetime
+from decimal import Decimal
 from enum import Enum
 from typing import Generator, Optional
 from uuid import UUID
@@ -119,31 +121,41 @@ class Product(Entity):
 class Order(Entity):
     """Класс заказов."""
 
-    def __init__(self, id: UUID, number: int) -> None:
+    def __init__(self,
+                 id: UUID,
+                 number: int,
+                 total: Decimal,
+                 created_at: Optional[datetime] = None) -> None:
         """
         Конструктор инициализации заказа.
 
         :param id: идентификатор заказа
         :param number: номер заказа
+        :param total: сумма заказа по ценам на момент его создания
+        :param created_at: дата и время создания заказа
         """
         self.id = id
         self.number = number
+        self.total = total
+        self.created_at = created_at
 
 
 class OrderProduct(Entity):
     """Класс связности заказов и продуктов."""
 
-    def __init__(self, order_id: UUID, product_id: UUID, quantity: int) -> None:
+    def __init__(self, order_id: UUID, product_id: UUID, quantity: int, price: Decimal) -> None:
         """
         Конструктор иницилизации объекта.
 
         :param order_id: идентификатор заказа
         :param product_id: идентификатор продукта
         :param quantity: количество продукта
+        :param price: цена единицы продукта на момент создания заказа
         """
         self.order_id = order_id
         self.product_id = product_id
         self.quantity = quantity
+        self.price = price
 
 
 class UserOrder(Entity):
@@ -158,3 +170,93 @@ class UserOrder(Entity):
         """
         self.user_id = user_id
         self.order_id = order_id
+
+
+class ProductSearch(Entity):
+    """Класс параметров поиска продуктов."""
+
+    MODES = ('prefix', 'substring', 'fulltext')
+
+    def __init__(self,
+                 text: str,
+                 mode: str = 'fulltext',
+                 *,
+                 min_price: Optional[float] = None,
+                 max_price: Optional[float] = None,
+                 in_stock: bool = False,
+                 limit: int = 20,
+                 offset: int = 0) -> None:
+        """
+        Конструктор инициализации параметров поиска.
+
+        :param text: искомая строка
+        :param mode: режим поиска: по префиксу наименования (prefix), по подстроке
+                     в наименовании или описании (substring), полнотекстовый (fulltext)
+        :param min_price: минимальная цена продукта
+        :param max_price: максимальная цена продукта
+        :param in_stock: искать только продукты, имеющиеся на складе
+        :param limit: максимальное количество продуктов в выдаче
+        :param offset: количество пропускаемых продуктов с начала выдачи
+        """
+        self.text = text
+        self.mode = mode
+        self.min_price = min_price
+        self.max_price = max_price
+        self.in_stock = in_stock
+        self.limit = limit
+        self.offset = offset
+
+
+class ProductSales(Entity):
+    """Класс агрегированных продаж продукта за период."""
+
+    def __init__(self,
+                 product_id: UUID,
+                 units_sold: int,
+                 revenue: Decimal,
+                 slug: Optional[str] = None,
+                 name: Optional[str] = None) -> None:
+        """
+        Конструктор инициализации продаж продукта.
+
+        :param product_id: идентификатор продукта
+        :param units_sold: количество проданных единиц продукта
+        :param revenue: выручка по продукту
+        :param slug: короткое наименование продукта
+        :param name: наименование продукта
+        """
+        self.product_id = product_id
+        self.units_sold = units_sold
+        self.revenue = revenue
+        self.slug = slug
+        self.name = name
+
+
+class TokenClaims(Entity):
+    """Класс утверждений (claims) подписанного токена доступа."""
+
+    def __init__(self, id: str, user_id: UUID, login: str, issued_at: int, expires_at: int) -> None:
+        """
+        Конструктор инициализации утверждений токена.
+
+        :param id: уникальный идентификатор токена, используемый для отзыва
+        :param user_id: идентификатор пользователя
+        :param login: логин пользователя
+        :param issued_at: время выдачи токена (unix timestamp)
+        :param expires_at: время истечения срока действия токена (unix timestamp)
+        """
+        self.id = id
+        self.user_id = user_id
+        self.login = login
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    def to_user(self) -> User:
+        """
+        Вернуть пользователя, которому выдан токен.
+
+        Подписанный токен содержит только идентификатор и логин пользователя,
+        остальные атрибуты экземпляра не заполняются.
+        """
+        return User(id=self.user_id, login=self.login, password=None, first_name=None,
+                    surname=None, middle_name=None, sex=None, age=None)
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Iterable, Optional
+from uuid import UUID
+
+from dao import DAO_BACKENDS, DEFAULT_DAO_BACKEND
+from exceptions import InvalidTokenException
+from storage import TokenClaims
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SECRET_ENV = 'SHOP_TOKEN_SECRET'
+PLACEHOLDER_SECRET = 'change-me'
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class TokenSigner:
+    """
+    Выпуск и проверка подписанных (HMAC-SHA256) токенов доступа.
+
+    Токен имеет вид `v1.<полезная нагрузка>.<подпись>`, где полезная нагрузка -
+    json с идентификатором и логином пользователя, временем выдачи и истечения
+    срока действия. Проверка токена не требует обращения к БД.
+    """
+
+    PREFIX = 'v1'
+
+    def __init__(self, secret: str, ttl: int) -> None:
+        """
+        Инициализация экземпляра класса.
+
+        :param secret: секретный ключ подписи
+        :param ttl: время жизни токена, в секундах
+        """
+        self.key = secret.encode('utf-8')
+        self.ttl = ttl
+
+    @classmethod
+    def is_signed(cls, token: str) -> bool:
+        """
+        Проверить, является ли токен подписанным (а не хранимым в БД).
+
+        :param token: токен доступа
+        :return: булево значение в зависимости от результата проверки
+        """
+        return token.startswith(cls.PREFIX + '.')
+
+    def _sign(self, message: str) -> str:
+        return _b64encode(hmac.new(self.key, message.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, user_id: UUID, login: str) -> str:
+        """
+        Выпустить подписанный токен.
+
+        :param user_id: идентификатор пользователя
+        :param login: логин пользователя
+        :return: токен доступа
+        """
+        issued_at = int(time.time())
+        payload = {
+            'jti': secrets.token_hex(8),
+            'sub': user_id.hex,
+            'login': login,
+            'iat': issued_at,
+            'exp': issued_at + self.ttl
+        }
+        message = '{prefix}.{payload}'.format(
+            prefix=self.PREFIX, payload=_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')))
+        return '{message}.{signature}'.format(message=message, signature=self._sign(message))
+
+    def verify(self, token: str) -> TokenClaims:
+        """
+        Проверить подпись и срок действия токена.
+
+        :param token: токен доступа
+        :return: утверждения токена
+        :raise InvalidTokenException: выбрасывается, если токен поврежден, подделан или просрочен
+        """
+        message, _, signature = token.rpartition('.')
+        if not self.is_signed(message) or not hmac.compare_digest(self._sign(message), signature):
+            raise InvalidTokenException
+
+        try:
+            payload = json.loads(_b64decode(message[len(self.PREFIX) + 1:]))
+            claims = TokenClaims(id=payload['jti'], user_id=UUID(hex=payload['sub']), login=payload['login'],
+                                 issued_at=payload['iat'], expires_at=payload['exp'])
+        except (ValueError, KeyError, TypeError):
+            raise InvalidTokenException
+
+        if claims.expires_at <= time.time():
+            raise InvalidTokenException
+        return claims
+
+
+class TokenDenyList:
+    """
+    Список отозванных подписанных токенов.
+
+    Каждый процесс хранит в памяти множество идентификаторов отозванных токенов,
+    срок действия которых еще не истек, и периодически перечитывает его из БД.
+    """
+
+    def __init__(self) -> None:
+        """Инициализация пустого списка."""
+        self._ids = frozenset()
+
+    def __contains__(self, token_id: str) -> bool:
+        """Проверить, отозван ли токен с данным идентификатором."""
+        return token_id in self._ids
+
+    def replace(self, token_ids: Iterable[str]) -> None:
+        """
+        Заменить содержимое списка.
+
+        :param token_ids: идентификаторы отозванных токенов
+        """
+        self._ids = frozenset(token_ids)
+
+    def add(self, token_id: str) -> None:
+        """
+        Добавить токен в список до следующего обновления из БД.
+
+        :param token_id: идентификатор токена
+        """
+        self._ids = self._ids | {token_id}
+
+    async def refresh(self, engine, backend: str = DEFAULT_DAO_BACKEND) -> None:
+        """
+        Перечитать список из БД.
+
+        :param engine: engine БД
+        :param backend: наименование backend-а хранения данных из `DAO_BACKENDS`
+        """
+        async with engine.acquire() as conn:
+            self.replace(await DAO_BACKENDS[backend]['revoked_token'](conn).get_active_ids())
+
+
+async def _refresh_deny_list(app, interval: float) -> None:
+    while True:
+        try:
+            await app['token_deny_list'].refresh(app['db'], app['dao_backend'])
+        except Exception:
+            logger.exception('Failed to refresh the token deny list')
+        await asyncio.sleep(interval)
+
+
+def get_token_secret() -> str:
+    """
+    Получить секретный ключ подписи токенов из переменной окружения.
+
+    Ключ не хранится в конфигурационном файле, чтобы его значение из репозитория не попало в рабочее окружение.
+
+    :return: секретный ключ подписи
+    :raise ValueError: выбрасывается, если переменная окружения не задана или содержит значение-заглушку
+    """
+    secret = os.environ.get(TOKEN_SECRET_ENV, '')
+    if not secret or secret == PLACEHOLDER_SECRET:
+        raise ValueError('Signed tokens require a secret in the {env} environment variable'.format(
+            env=TOKEN_SECRET_ENV))
+    return secret
+
+
+async def init_tokens(app) -> None:
+    """
+    Инициализация подписи токенов и фонового обновления списка отозванных токенов.
+
+    :raise ValueError: выбрасывается, если для подписанных токенов не задан секретный ключ
+    """
+    config = app['config'].get('tokens', {})
+    app['token_signer'] = None
+    app['token_deny_list'] = TokenDenyList()
+    if config.get('format', 'opaque') != 'signed':
+        return
+
+    app['token_signer'] = TokenSigner(secret=get_token_secret(), ttl=config.get('ttl', 3600))
+    app['token_deny_list_task'] = asyncio.ensure_future(
+        _refresh_deny_list(app, config.get('deny_list_refresh_interval', 30)))
+
+
+async def close_tokens(app) -> None:
+    """Остановка фонового обновления списка отозванных токенов."""
+    task: Optional[asyncio.Task] = app.get('token_deny_list_task')
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'shop'
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """Интервал (span) трассировки - именованная операция со временем начала и окончания."""
+
+    def __init__(self,
+                 name: str,
+                 trace_id: str,
+                 parent_id: Optional[str] = None,
+                 kind: int = SPAN_KIND_INTERNAL,
+                 trace: Optional[List['Span']] = None,
+                 attributes: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Начать интервал.
+
+        :param name: наименование операции
+        :param trace_id: идентификатор трассировки (32 hex-символа)
+        :param parent_id: идентификатор родительского интервала
+        :param kind: вид интервала (SPAN_KIND_*)
+        :param trace: список завершенных интервалов трассировки (общий для всех ее интервалов)
+        :param attributes: атрибуты интервала
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.trace = trace if trace is not None else []
+        self.attributes = attributes or {}
+        self.status = STATUS_CODE_OK
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+
+    def child(self, name: str, **attributes) -> 'Span':
+        """
+        Начать дочерний интервал.
+
+        :param name: наименование операции
+        :param attributes: атрибуты интервала
+        :return: дочерний интервал
+        """
+        return Span(name, trace_id=self.trace_id, parent_id=self.span_id, trace=self.trace, attributes=attributes)
+
+    def end(self, error: bool = False) -> None:
+        """
+        Завершить интервал.
+
+        :param error: завершилась ли операция ошибкой
+        """
+        self.end_time = time.time_ns()
+        if error:
+            self.status = STATUS_CODE_ERROR
+        self.trace.append(self)
+
+    def to_otlp(self) -> dict:
+        """
+        Вернуть представление интервала в формате OTLP/JSON.
+
+        :return: словарь интервала
+        """
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_time),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status}
+        }
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Контекстный менеджер дочернего интервала текущей трассировки.
+
+    Если запрос не попал в выборку трассировки, ничего не делает.
+
+    :param name: наименование операции
+    :param attributes: атрибуты интервала
+    :return: интервал или None
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = parent.child(name, **attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException:
+        child.end(error=True)
+        raise
+    else:
+        child.end()
+    finally:
+        current_span.reset(token)
+
+
+def traced_methods(cls: type) -> type:
+    """
+    Декоратор класса, оборачивающий открытые асинхронные методы в интервалы трассировки.
+
+    Интервал называется `<класс>.<метод>`.
+
+    :param cls: декорируемый класс
+    :return: тот же класс
+    """
+    for name, method in list(vars(cls).items()):
+        if not name.startswith('_') and asyncio.iscoroutinefunction(method):
+            setattr(cls, name, _traced(cls.__name__ + '.' + name, method))
+    return cls
+
+
+def _traced(name: str, method: Callable) -> Callable:
+    @wraps(method)
+    async def wrapped(*args, **kwargs) -> Any:
+        if current_span.get() is None:
+            return await method(*args, **kwargs)
+        with span(name):
+            return await method(*args, **kwargs)
+
+    return wrapped
+
+
+class SpanExporter:
+    """
+    Экспорт завершенных трассировок в формате OTLP/JSON.
+
+    Трассировки накапливаются в памяти и периодически выгружаются пачкой:
+    в файл (одна OTLP-посылка на строку, запись в отдельном потоке)
+    или в коллектор по протоколу OTLP/HTTP.
+    """
+
+    def __init__(self, path: Optional[str] = None, endpoint: Optional[str] = None, max_spans: int = 10000) -> None:
+        """
+        Инициализация экспортера.
+
+        :param path: путь до файла трассировок
+        :param endpoint: адрес коллектора OTLP/HTTP (например, http://collector:4318/v1/traces)
+        :param max_spans: максимальное количество накопленных интервалов; лишние отбрасываются
+        """
+        self.path = path
+        self.endpoint = endpoint
+        self.max_spans = max_spans
+        self._spans: List[Span] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def add(self, spans: List[Span]) -> None:
+        """
+        Добавить интервалы завершенной трассировки к выгрузке.
+
+        :param spans: интервалы трассировки
+        """
+        if len(self._spans) + len(spans) <= self.max_spans:
+            self._spans.extend(spans)
+
+    def _build_request(self, spans: List[Span]) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': [item.to_otlp() for item in spans]}]
+        }]}
+
+    def _write(self, spans: List[Span]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(self._build_request(spans), separators=(',', ':')) + '\n')
+
+    async def flush(self) -> None:
+        """Выгрузить накопленные интервалы."""
+        spans, self._spans = self._spans, []
+        if not spans:
+            return
+
+        if self.path is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, spans)
+        if self.endpoint is not None:
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            async with self._session.post(self.endpoint, json=self._build_request(spans)) as response:
+                response.raise_for_status()
+
+    async def run(self, interval: float) -> None:
+        """
+        Периодически выгружать накопленные интервалы.
+
+        :param interval: интервал между выгрузками, в секундах
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to export traces')
+
+    async def close(self) -> None:
+        """Выгрузить оставшиеся интервалы и закрыть соединения с коллектором."""
+        try:
+            await self.flush()
+        finally:
+            if self._session is not None:
+                await self._session.close()
+
+
+def _parse_traceparent(header: Optional[str]):
+    match = TRACEPARENT_RE.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def tracing_middleware(exporter: SpanExporter, sample_rate: float) -> Callable:
+    """
+    Фабрика middleware (посредника), начинающего трассировку запроса.
+
+    Решение о записи трассировки принимается в начале запроса (head-based sampling):
+    если в заголовке "traceparent" (W3C Trace Context) вызывающая сторона уже приняла решение,
+    оно соблюдается, а трассировка продолжается с переданным идентификатором;
+    иначе запрос попадает в выборку с вероятностью `sample_rate`.
+    Идентификатор трассировки проставляется в запрос (`trace_id`) и в заголовок ответа "traceparent".
+
+    :param exporter: экспортер завершенных трассировок
+    :param sample_rate: доля трассируемых запросов
+    :return: middleware
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler: Callable) -> web.StreamResponse:
+        parent = _parse_traceparent(request.headers.get('traceparent'))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = secrets.token_hex(16), None, random.random() < sample_rate
+        if not sampled:
+            return await handler(request)
+
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else request.path
+        root = Span('{method} {route}'.format(method=request.method, route=route), trace_id=trace_id,
+                    parent_id=parent_id, kind=SPAN_KIND_SERVER,
+                    attributes={'http.method': request.method, 'http.route': route})
+        request['trace_id'] = trace_id
+        token = current_span.set(root)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            current_span.reset(token)
+            root.attributes['http.status_code'] = status
+            root.end(error=status >= 500)
+            exporter.add(root.trace)
+
+        if not response.prepared:
+            response.headers['traceparent'] = '00-{trace_id}-{span_id}-01'.format(
+                trace_id=trace_id, span_id=root.span_id)
+        return response
+
+    return middleware
+
+
+async def init_tracing(app) -> None:
+    """Запуск периодической выгрузки трассировок."""
+    config = app['config'].get('tracing', {})
+    exporter = app['span_exporter']
+    if config.get('enabled', False):
+        app['span_exporter_task'] = asyncio.ensure_future(exporter.run(config.get('export_interval', 5)))
+
+
+async def close_tracing(app) -> None:
+    """Остановка периодической выгрузки и выгрузка оставшихся трассировок."""
+    task = app.get('span_exporter_task')
+    if task is not None:
+        task.cancel()
+    await app['span_exporter'].close()
@@ -1,8 +1,11 @@
 import json
+from datetime import datetime
 from decimal import Decimal
 from typing import Any
 from uuid import UUID
 
+from tracing import span
+
 
 class UUIDEncoderMixin(json.JSONEncoder):
     """Миксин, реализующий поведение сериализации объектов класса `UUID`."""
@@ -34,7 +37,33 @@ class DecimalEncoderMixin(json.JSONEncoder):
         return super().default(obj)
 
 
-class JsonEncoder(UUIDEncoderMixin, DecimalEncoderMixin, json.JSONEncoder):
+class DateTimeEncoderMixin(json.JSONEncoder):
+    """Миксин, реализующий поведение сериализации объектов класса `datetime` (в формате ISO 8601)."""
+
+    def default(self, obj: Any) -> Any:
+        """
+        Сериализация объекта класса `datetime`.
+
+        :param obj: сериализуемый объект
+        :return: сериализованное представление объекта
+        """
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        return super().default(obj)
+
+
+class JsonEncoder(UUIDEncoderMixin, DecimalEncoderMixin, DateTimeEncoderMixin, json.JSONEncoder):
     """Json-сериализатор, используемый для сериализации сущностей бизнес-логики."""
 
     pass
+
+
+def encode_json(obj: Any) -> str:
+    """
+    Сериализовать сущности бизнес-логики в json.
+
+    :param obj: сериализуемый объект
+    :return: json-строка
+    """
+    with span('json.encode'):
+        return json.dumps(obj, cls=JsonEncoder)
@@ -0,0 +1,105 @@
+import json
+from functools import wraps
+from typing import Any, Callable, Optional
+
+from aiohttp.web import Request, Response, View, json_response
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+try:
+    import fastjsonschema
+except ImportError:  # pragma: no cover - fastjsonschema является необязательной зависимостью
+    fastjsonschema = None
+
+DEFAULT_MAX_BODY_SIZE = 64 * 1024
+
+
+def compile_schema(schema: dict) -> Callable[[Any], Optional[str]]:
+    """
+    Скомпилировать json-схему в функцию валидации.
+
+    Если установлен fastjsonschema, схема компилируется в python-код,
+    в противном случае один раз создается и проверяется валидатор jsonschema.
+
+    :param schema: json-схема
+    :return: функция, принимающая данные и возвращающая описание ошибки,
+             либо None, если данные корректны
+    """
+    if fastjsonschema is not None:
+        compiled = fastjsonschema.compile(schema)
+
+        def validate_data(data: Any) -> Optional[str]:
+            try:
+                compiled(data)
+            except fastjsonschema.JsonSchemaException as e:
+                return e.message
+            return None
+
+        return validate_data
+
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    validator = validator_class(schema)
+
+    def validate_data(data: Any) -> Optional[str]:
+        error = best_match(validator.iter_errors(data))
+        return error.message if error is not None else None
+
+    return validate_data
+
+
+async def read_body(request: Request, max_size: int) -> Optional[bytes]:
+    """
+    Прочитать тело запроса, не превышая допустимый размер.
+
+    :param request: экземпляр запроса
+    :param max_size: максимальный размер тела, в байтах
+    :return: тело запроса или None, если оно превышает допустимый размер
+    """
+    if request.content_length is not None and request.content_length > max_size:
+        return None
+
+    body = bytearray()
+    async for chunk in request.content.iter_any():
+        body.extend(chunk)
+        if len(body) > max_size:
+            return None
+    return bytes(body)
+
+
+def validate(request_schema: dict, max_body_size: int = DEFAULT_MAX_BODY_SIZE) -> Callable:
+    """
+    Декоратор метода view, валидирующий json-тело запроса.
+
+    Схема компилируется один раз при декорировании. Тело запроса читается
+    и разбирается однократно, а результат передается в метод view
+    первым позиционным аргументом.
+
+    :param request_schema: json-схема тела запроса
+    :param max_body_size: максимальный размер тела запроса, в байтах
+    :return: декоратор
+    """
+    validate_data = compile_schema(request_schema)
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapped(view: View, *args) -> Response:
+            body = await read_body(view.request, max_body_size)
+            if body is None:
+                error_message = 'Request body is larger than {size} bytes'.format(size=max_body_size)
+                return json_response(status=413, data={'error': error_message})
+
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return json_response(status=400, data={'error': 'Request body is not a valid JSON'})
+
+            error_message = validate_data(data)
+            if error_message is not None:
+                return json_response(status=400, data={'error': error_message})
+
+            return await func(view, data, *args)
+
+        return wrapped
+
+    return decorator
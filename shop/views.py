@@ -1,21 +1,149 @@
-import json
+import asyncio
+import tempfile
+from datetime import datetime, timezone
+
+from aiohttp import hdrs
+from aiohttp.web import Response, StreamResponse, View, json_response
+
+import catalog
+from changefeed import ProductChangeSubscriber
+from exceptions import (InvalidTokenException, OrderNotFoundException, ProductAlreadyExistsException,
+                        ProductNotEnoughException, ProductNotFoundException, TooManySubscribersException)
+from mixins import (AccessTokenServiceViewMixin, AnalyticsServiceViewMixin, AuthServiceViewMixin,
+                    OrderServiceViewMixin, ProductServiceViewMixin)
+from permissions import admin_required
+from schemas import AUTH_SCHEMA, ORDER_PRODUCT_SCHEMA, PRODUCT_PATCH_SCHEMA, PRODUCT_SCHEMA
+from storage import Product, ProductSearch
+from utils import encode_json
+from validation import validate
+
+ORDERS_PAGE_DEFAULT_LIMIT = 20
+ORDERS_PAGE_MAX_LIMIT = 100
+CATALOG_CHUNK_SIZE = 64 * 1024
+SEARCH_PAGE_DEFAULT_LIMIT = 20
+SEARCH_PAGE_MAX_LIMIT = 100
+ANALYTICS_DEFAULT_LIMIT = 10
+ANALYTICS_MAX_LIMIT = 100
+ANALYTICS_ORDER_FIELDS = ('units_sold', 'revenue')
+STREAM_RETRY_MS = 3000
+PROFILE_DEFAULT_DURATION = 10
+PROFILE_DEFAULT_INTERVAL = 0.005
+PROFILE_MIN_INTERVAL = 0.001
+PROFILE_FORMATS = ('collapsed', 'pstats')
+
+
+def _get_number(query, name: str, cast: type, default=None):
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError('Parameter "{name}" must be a number'.format(name=name))
+
+
+def _get_datetime(query, name: str):
+    value = query.get(name)
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('Parameter "{name}" must be a date and time in ISO 8601 format'.format(name=name))
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def _get_profile_params(query, max_duration: float):
+    duration = _get_number(query, 'duration', float, default=PROFILE_DEFAULT_DURATION)
+    interval = _get_number(query, 'interval', float, default=PROFILE_DEFAULT_INTERVAL)
+    fmt = query.get('format', 'collapsed')
+    if not 0 < duration <= max_duration:
+        raise ValueError('Duration must be between 0 and {max} seconds'.format(max=max_duration))
+    if not PROFILE_MIN_INTERVAL <= interval < duration:
+        raise ValueError('Interval must be between {min} seconds and duration'.format(min=PROFILE_MIN_INTERVAL))
+    if fmt not in PROFILE_FORMATS:
+        raise ValueError('Unknown format "{fmt}"'.format(fmt=fmt))
+    return duration, interval, query.get('route'), fmt
+
+
+def _format_event(event: str, data) -> bytes:
+    return 'event: {event}\ndata: {data}\n\n'.format(event=event, data=encode_json(data)).encode('utf-8')
+
+
+async def _stream_product_changes(response: StreamResponse,
+                                  subscriber: ProductChangeSubscriber,
+                                  heartbeat_interval: float,
+                                  coalesce_interval: float) -> None:
+    while True:
+        if not await subscriber.wait(heartbeat_interval):
+            # Комментарий SSE не дает прокси закрыть простаивающее соединение.
+            await response.write(b': ping\n\n')
+            continue
+        if subscriber.closed:
+            return
+
+        await asyncio.sleep(coalesce_interval)
+        reset, changes = subscriber.drain()
+        if reset:
+            await response.write(_format_event('reset', {}))
+        if changes:
+            await response.write(_format_event('products', changes))
+
+
+def _parse_product_search(query) -> ProductSearch:
+    """
+    Разобрать query-параметры поиска продуктов.
+
+    :param query: query-параметры запроса
+    :return: параметры поиска
+    :raise ValueError: выбрасывается, если переданы некорректные параметры
+    """
+    text = query.get('q', '').strip()
+    if not text:
+        raise ValueError('Parameter "q" is required')
+
+    mode = query.get('mode', 'fulltext')
+    if mode not in ProductSearch.MODES:
+        raise ValueError('Parameter "mode" must be one of: {modes}'.format(modes=', '.join(ProductSearch.MODES)))
+
+    limit = _get_number(query, 'limit', int, default=SEARCH_PAGE_DEFAULT_LIMIT)
+    offset = _get_number(query, 'offset', int, default=0)
+    if not 1 <= limit <= SEARCH_PAGE_MAX_LIMIT or offset < 0:
+        raise ValueError('Limit must be between 1 and {max}, offset must not be negative'.format(
+            max=SEARCH_PAGE_MAX_LIMIT))
+
+    return ProductSearch(
+        text=text,
+        mode=mode,
+        min_price=_get_number(query, 'min_price', float),
+        max_price=_get_number(query, 'max_price', float),
+        in_stock=query.get('in_stock', '').lower() in ('1', 'true'),
+        limit=limit,
+        offset=offset)
+
+
+class ReadinessView(View):
+    """View проверки готовности приложения к приему запросов."""
+
+    uses_db = False
 
-from aiohttp.web import Response, View, json_response
-from aiohttp_validate import validate
+    async def get(self) -> Response:
+        """
+        Endpoint проверки готовности (для балансировщика нагрузки).
 
-from exceptions import OrderNotFoundException, ProductNotEnoughException, ProductNotFoundException
-from mixins import (AccessTokenServiceViewMixin, AuthServiceViewMixin,
-                    OrderServiceViewMixin, ProductServiceViewMixin)
-from schemas import AUTH_SCHEMA, ORDER_PRODUCT_SCHEMA, PRODUCT_SCHEMA
-from storage import Product
-from utils import JsonEncoder
+        :return: ответ 200 (OK), если прогрев пула соединений с БД завершен;
+                 ответ 503 (Service Unavailable) - в противном случае
+        """
+        if not self.request.app['ready'].is_set():
+            return json_response(status=503, data={'status': 'warming up'})
+        return json_response(data={'status': 'ready'})
 
 
 class LoginView(AuthServiceViewMixin, AccessTokenServiceViewMixin, View):
     """View аутентификации."""
 
     @validate(request_schema=AUTH_SCHEMA)
-    async def post(self, *args) -> Response:
+    async def post(self, data) -> Response:
         """
         Аутентификация пользователя.
 
@@ -25,17 +153,37 @@ class LoginView(AuthServiceViewMixin, AccessTokenServiceViewMixin, View):
             "password": "user_password"
         }
 
+        :param data: провалидированное тело запроса
         :return: ответ 200 (OK), содержащий тело токена в случае успешной аутентификации;
                  ответ 400 (Bad Request), если были переданы некорректные аутентификационные данные
         """
-        credentials = await self.request.json()
-        if await self.auth_service.check_credentials(**credentials):
-            token = await self.token_service.get_by_login(login=credentials['login'])
+        if await self.auth_service.check_credentials(**data):
+            token = await self.token_service.get_by_login(login=data['login'])
             return json_response(status=200, data={'token': token})
 
         return json_response(status=400, data={'error': 'Bad credentials'})
 
 
+class LogoutView(AccessTokenServiceViewMixin, View):
+    """View отзыва токена."""
+
+    async def post(self) -> Response:
+        """
+        Отзыв текущего подписанного токена доступа.
+
+        :return: ответ 204 (No Content) в случае успешного отзыва токена;
+                 ответ 400 (Bad Request), если токен не является подписанным
+        """
+        token = self.request.headers['Authorization'].strip().split(' ')[-1]
+        try:
+            claims = await self.token_service.revoke(token)
+        except InvalidTokenException:
+            return json_response(status=400, data={'error': 'Only signed tokens can be revoked'})
+
+        self.request.app['token_deny_list'].add(claims.id)
+        return Response(status=204)
+
+
 class ProductListCreateView(ProductServiceViewMixin, View):
     """View создания и получения списка продуктов."""
 
@@ -43,14 +191,19 @@ class ProductListCreateView(ProductServiceViewMixin, View):
         """
         Endpoint вывода всех продуктов.
 
+        Ответ, сформированный из снимка каталога, содержит ETag версии снимка.
+
         :return: ответ 200 (OK), содержащий коллекцию json-представлений продуктов
         """
-        products = await self.product_service.get_all()
-        body = json.dumps([dict(product) for product in products], cls=JsonEncoder)
-        return Response(status=200, text=body, content_type='application/json')
+        products, version = await self.product_service.get_catalog()
+        body = encode_json([dict(product) for product in products])
+        response = Response(status=200, text=body, content_type='application/json')
+        if version is not None:
+            response.headers[hdrs.ETAG] = '"catalog-{version}"'.format(version=version)
+        return response
 
     @validate(request_schema=PRODUCT_SCHEMA)
-    async def post(self, *args) -> Response:
+    async def post(self, data) -> Response:
         """
         Endpoint создания продуктов.
 
@@ -62,23 +215,99 @@ class ProductListCreateView(ProductServiceViewMixin, View):
             "left_in_stock": 7
         }
 
+        :param data: провалидированное тело запроса
         :return: ответ 201 (Created), содержащий json-представление созданного продукта в случае успеха;
                  ответ 400 (Bad Request), если данный продукт уже существует или были переданы некорректные данные
         """
-        data = await self.request.json()
-        product = Product(**data)
-        if await self.product_service.exists_by_slug(slug=product.slug):
+        try:
+            created = await self.product_service.create(product=Product(**data))
+        except ProductAlreadyExistsException:
             return json_response(status=400,
                                  data={'error': 'Product with this slug is already exists'})
 
-        created = await self.product_service.create(product=product)
-        body = json.dumps(dict(created), cls=JsonEncoder)
+        body = encode_json(dict(created))
         return Response(status=201, text=body, content_type='application/json')
 
 
+class ProductSearchView(ProductServiceViewMixin, View):
+    """View поиска продуктов."""
+
+    async def get(self) -> Response:
+        """
+        Endpoint поиска продуктов.
+
+        Поддерживаются query-параметры:
+            - q: искомая строка (обязательный);
+            - mode: prefix - по началу наименования, substring - по подстроке в наименовании
+              или описании, fulltext - полнотекстовый поиск (по умолчанию);
+            - min_price, max_price: диапазон цен;
+            - in_stock: 1/true - только продукты, имеющиеся на складе;
+            - limit, offset: пагинация (по умолчанию 20 продуктов, максимум 100).
+
+        :return: ответ 200 (OK), содержащий продукты, упорядоченные по релевантности,
+                 и смещение следующей страницы;
+                 ответ 400 (Bad Request), если были переданы некорректные параметры
+        """
+        try:
+            search = _parse_product_search(self.request.query)
+        except ValueError as e:
+            return json_response(status=400, data={'error': str(e)})
+
+        products = await self.product_service.search(search)
+        next_offset = search.offset + search.limit if len(products) == search.limit else None
+        body = encode_json({'products': [dict(product) for product in products], 'next': next_offset})
+        return Response(status=200, text=body, content_type='application/json')
+
+
+class ProductStreamView(View):
+    """View потока изменений цены и остатка продуктов (server-sent events)."""
+
+    uses_db = False
+
+    async def get(self) -> StreamResponse:
+        """
+        Endpoint потока изменений продуктов вместо периодического опроса `GET /products`.
+
+        Отправляет события (text/event-stream):
+            - products: json-массив изменений вида {"op": "insert"|"update"|"delete", "slug": ...,
+              "price": ..., "left_in_stock": ...}; изменения одного продукта, накопленные
+              за `coalesce_interval` секунд, объединяются в последнее;
+            - reset: часть изменений не была доставлена, каталог нужно перечитать целиком.
+        Клиенту следует сначала подписаться на поток, а затем прочитать каталог.
+
+        :return: поток событий;
+                 ответ 503 (Service Unavailable), если достигнуто максимальное количество подписчиков
+        """
+        config = self.request.app['config'].get('product_stream', {})
+        hub = self.request.app['product_changes']
+        try:
+            subscriber = hub.subscribe()
+        except TooManySubscribersException:
+            return json_response(status=503, data={'error': 'Too many product stream subscribers'})
+
+        response = StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        try:
+            await response.prepare(self.request)
+            await response.write('retry: {retry}\n\n'.format(retry=STREAM_RETRY_MS).encode('utf-8'))
+            await _stream_product_changes(response, subscriber,
+                                          heartbeat_interval=config.get('heartbeat_interval', 15),
+                                          coalesce_interval=config.get('coalesce_interval', 0.5))
+        except ConnectionResetError:
+            pass
+        finally:
+            hub.unsubscribe(subscriber)
+        return response
+
+
 class ProductRetrieveUpdateDeleteView(ProductServiceViewMixin, View):
     """View получения/обновления/удаления конкретного продукта."""
 
+    product_slug_param = 'slug'
+
     async def get(self) -> Response:
         """
         Endpoint, возвращающий представление конкретного продукта по slug.
@@ -92,11 +321,11 @@ class ProductRetrieveUpdateDeleteView(ProductServiceViewMixin, View):
         except ProductNotFoundException:
             return json_response(status=404, data={'error': 'Product not found'})
 
-        body = json.dumps(dict(product), cls=JsonEncoder)
+        body = encode_json(dict(product))
         return Response(status=200, text=body, content_type='application/json')
 
     @validate(request_schema=PRODUCT_SCHEMA)
-    async def put(self, *args) -> Response:
+    async def put(self, data) -> Response:
         """
         Endpoint, возвращающий обновленное представление продукта по slug.
 
@@ -109,21 +338,36 @@ class ProductRetrieveUpdateDeleteView(ProductServiceViewMixin, View):
             "left_in_stock": 7
         }
 
+        :param data: провалидированное тело запроса
+        :return: ответ 200 (OK), содержащий json-представление обновленного продукта;
+                 ответ 404 (Not Found), если продукт не был найден
+        """
+        return await self._update(data)
+
+    @validate(request_schema=PRODUCT_PATCH_SCHEMA)
+    async def patch(self, data) -> Response:
+        """
+        Endpoint частичного обновления продукта по slug.
+
+        Обновляются только переданные поля.
+        Пример тела запроса:
+        {
+            "price": 99.9
+        }
+
+        :param data: провалидированное тело запроса
         :return: ответ 200 (OK), содержащий json-представление обновленного продукта;
                  ответ 404 (Not Found), если продукт не был найден
         """
-        data = await self.request.json()
+        return await self._update(data)
+
+    async def _update(self, data: dict) -> Response:
         try:
-            product = await self.product_service.get_by_slug(
-                slug=self.request.match_info['slug'])
+            product = await self.product_service.update(slug=self.request.match_info['slug'], values=data)
         except ProductNotFoundException:
             return json_response(status=404, data={'error': 'Product not found'})
 
-        for prop, value in data.items():
-            setattr(product, prop, value)
-
-        product = await self.product_service.update(product)
-        body = json.dumps(dict(product), cls=JsonEncoder)
+        body = encode_json(dict(product))
         return Response(status=200, text=body, content_type='application/json')
 
     async def delete(self) -> Response:
@@ -134,20 +378,54 @@ class ProductRetrieveUpdateDeleteView(ProductServiceViewMixin, View):
                  ответ 404 (Not Found) если продукт не был найден
         """
         try:
-            product = await self.product_service.get_by_slug(
-                slug=self.request.match_info['slug'])
+            await self.product_service.delete(slug=self.request.match_info['slug'])
         except ProductNotFoundException:
             return json_response(status=404, data={'error': 'Product not found'})
 
-        await self.product_service.delete(product)
         return Response(status=204)
 
 
 class OrderListCreateView(ProductServiceViewMixin, OrderServiceViewMixin, View):
     """View создания и получения списка заказов."""
 
+    async def get(self) -> Response:
+        """
+        Endpoint вывода истории заказов текущего пользователя.
+
+        Заказы возвращаются по убыванию номера. Поддерживаются query-параметры:
+            - before: номер заказа, после которого начинается страница;
+            - limit: размер страницы (по умолчанию 20, максимум 100).
+
+        Для получения следующей страницы необходимо передать в параметре `before`
+        значение поля `next` из предыдущего ответа.
+
+        :return: ответ 200 (OK), содержащий страницу заказов и курсор следующей страницы;
+                 ответ 400 (Bad Request), если были переданы некорректные параметры пагинации
+        """
+        try:
+            before = self.request.query.get('before')
+            before = int(before) if before is not None else None
+            limit = int(self.request.query.get('limit', ORDERS_PAGE_DEFAULT_LIMIT))
+        except ValueError:
+            return json_response(status=400, data={'error': 'Pagination parameters must be integers'})
+
+        if not 1 <= limit <= ORDERS_PAGE_MAX_LIMIT:
+            error_message = 'Limit must be between 1 and {max}'.format(max=ORDERS_PAGE_MAX_LIMIT)
+            return json_response(status=400, data={'error': error_message})
+
+        page = await self.order_service.get_all(user=self.request['user'], before=before, limit=limit)
+        orders = []
+        for order, order_products in page:
+            order_dict = dict(order)
+            order_dict['products'] = [dict(product) for product in order_products]
+            orders.append(order_dict)
+
+        next_before = page[-1][0].number if len(page) == limit else None
+        body = encode_json({'orders': orders, 'next': next_before})
+        return Response(status=200, text=body, content_type='application/json')
+
     @validate(request_schema=ORDER_PRODUCT_SCHEMA)
-    async def post(self, *args) -> Response:
+    async def post(self, data) -> Response:
         """
         Endpoint создания заказа.
 
@@ -164,12 +442,12 @@ class OrderListCreateView(ProductServiceViewMixin, OrderServiceViewMixin, View):
             ...
         ]
 
+        :param data: провалидированное тело запроса
         :return: ответ 201 (Created), в случае успешного создания заказа;
                  ответ 404 (Not Found), в случае, если запрашиваемый продукт не был найден;
                  ответ 400 (Bad Request), в случае, если клиент пытается заказать товара больше, чем есть на складе
         """
         products = []
-        data = await self.request.json()
         for item in data:
             try:
                 product = await self.product_service.get_by_slug(slug=item['product'])
@@ -188,7 +466,7 @@ class OrderListCreateView(ProductServiceViewMixin, OrderServiceViewMixin, View):
 
         order_dict = dict(order)
         order_dict['products'] = [dict(product) for product in order_products]
-        body = json.dumps(order_dict, cls=JsonEncoder)
+        body = encode_json(order_dict)
         return Response(status=201, text=body, content_type='application/json')
 
 
@@ -199,6 +477,8 @@ class OrderRetrieveUpdateDeleteView(OrderServiceViewMixin, View):
         """
         Endpoint получения конкретного заказа.
 
+        Сумма заказа и цены продуктов берутся из самого заказа (на момент его создания).
+
         :return: ответ 200 (OK), содержащий json-представление заказа и его продуктов;
                  ответ 404 (Not Found), в случае, если заказ не был найден, либо принадлежит другому пользователю
         """
@@ -211,5 +491,184 @@ class OrderRetrieveUpdateDeleteView(OrderServiceViewMixin, View):
 
         order_dict = dict(order)
         order_dict['products'] = [dict(product) for product in order_products]
-        body = json.dumps(order_dict, cls=JsonEncoder)
+        body = encode_json(order_dict)
+        return Response(status=200, text=body, content_type='application/json')
+
+
+class ProductImportView(View):
+    """View массового импорта каталога продуктов."""
+
+    uses_db = False
+
+    @admin_required
+    async def post(self) -> Response:
+        """
+        Endpoint массового импорта (upsert по slug) продуктов.
+
+        Формат тела запроса задается query-параметром `format`: csv (с заголовком
+        name,description,price,left_in_stock[,slug]) или ndjson (по умолчанию).
+        Тело запроса читается потоково во временный файл (запись в него выполняется
+        в executor-е) и загружается в БД через COPY.
+
+        :return: ответ 200 (OK), содержащий количество добавленных и обновленных продуктов,
+                 а также ошибки по строкам файла;
+                 ответ 400 (Bad Request), если передан неизвестный формат
+        """
+        fmt = self.request.query.get('format', 'ndjson')
+        if fmt not in catalog.FORMATS:
+            return json_response(status=400, data={'error': 'Unknown format "{fmt}"'.format(fmt=fmt)})
+
+        loop = asyncio.get_event_loop()
+        with tempfile.SpooledTemporaryFile(max_size=catalog.SPOOL_MAX_SIZE) as file:
+            async for chunk in self.request.content.iter_chunked(CATALOG_CHUNK_SIZE):
+                await loop.run_in_executor(None, file.write, chunk)
+            await loop.run_in_executor(None, file.seek, 0)
+            report = await loop.run_in_executor(None, catalog.import_file, file, fmt)
+
+        return json_response(status=200, data=dict(report))
+
+
+class ProductExportView(View):
+    """View массового экспорта каталога продуктов."""
+
+    uses_db = False
+
+    @admin_required
+    async def get(self) -> StreamResponse:
+        """
+        Endpoint выгрузки всего каталога продуктов.
+
+        Формат выгрузки задается query-параметром `format`: csv или ndjson (по умолчанию).
+        Каталог передается клиенту по мере чтения из БД, без промежуточного файла.
+
+        :return: ответ 200 (OK), потоково передающий каталог;
+                 ответ 400 (Bad Request), если передан неизвестный формат
+        """
+        fmt = self.request.query.get('format', 'ndjson')
+        if fmt not in catalog.FORMATS:
+            return json_response(status=400, data={'error': 'Unknown format "{fmt}"'.format(fmt=fmt)})
+
+        chunks = catalog.iter_export(fmt, CATALOG_CHUNK_SIZE)
+        try:
+            # первая часть читается до отправки заголовков, чтобы ошибка БД вернула ответ 500
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = b''
+
+        try:
+            response = StreamResponse(status=200)
+            response.content_type = catalog.CONTENT_TYPES[fmt]
+            await response.prepare(self.request)
+            if first_chunk:
+                await response.write(first_chunk)
+            async for chunk in chunks:
+                await response.write(chunk)
+            await response.write_eof()
+        finally:
+            await chunks.aclose()
+        return response
+
+
+class AnalyticsProductsView(AnalyticsServiceViewMixin, View):
+    """View аналитики продаж продуктов."""
+
+    @admin_required
+    async def get(self) -> Response:
+        """
+        Endpoint самых продаваемых продуктов.
+
+        Данные берутся из инкрементально обновляемых агрегатов продаж. Поддерживаются query-параметры:
+            - since, until: период в формате ISO 8601 (по умолчанию UTC), с точностью до часа;
+              без них используются итоги за все время;
+            - order_by: units_sold - по количеству проданных единиц (по умолчанию) или revenue - по выручке;
+            - limit: количество продуктов (по умолчанию 10, максимум 100).
+
+        :return: ответ 200 (OK), содержащий продукты с количеством проданных единиц и выручкой;
+                 ответ 400 (Bad Request), если были переданы некорректные параметры
+        """
+        query = self.request.query
+        order_by = query.get('order_by', 'units_sold')
+        try:
+            since = _get_datetime(query, 'since')
+            until = _get_datetime(query, 'until')
+            limit = _get_number(query, 'limit', int, default=ANALYTICS_DEFAULT_LIMIT)
+            if order_by not in ANALYTICS_ORDER_FIELDS:
+                raise ValueError('Parameter "order_by" must be one of: {fields}'.format(
+                    fields=', '.join(ANALYTICS_ORDER_FIELDS)))
+            if not 1 <= limit <= ANALYTICS_MAX_LIMIT:
+                raise ValueError('Limit must be between 1 and {max}'.format(max=ANALYTICS_MAX_LIMIT))
+        except ValueError as e:
+            return json_response(status=400, data={'error': str(e)})
+
+        products = await self.analytics_service.get_top_products(
+            since=since, until=until, order_by=order_by, limit=limit)
+        body = encode_json({'products': [dict(product) for product in products]})
         return Response(status=200, text=body, content_type='application/json')
+
+
+class ProfileView(View):
+    """View выборочного профилирования event loop-а работающего процесса."""
+
+    uses_db = False
+
+    @admin_required
+    async def post(self) -> Response:
+        """
+        Endpoint профилирования event loop-а процесса, обработавшего запрос.
+
+        В течение `duration` секунд снимает стек вызовов потока event loop-а каждые `interval`
+        секунд процессорного времени и возвращает агрегированный профиль. Профилируется только
+        процесс, обработавший этот запрос. Поддерживаются query-параметры:
+            - duration: длительность профилирования (по умолчанию 10, не больше `profiler.max_duration`);
+            - interval: интервал между выборками (по умолчанию 0.005, минимум 0.001);
+            - route: шаблон пути маршрута (например, /products/{slug}) - учитывать только
+              выборки, снятые во время обработки запросов к нему;
+            - format: collapsed - свернутые стеки для flame graph (по умолчанию)
+              или pstats - файл профиля для модуля pstats.
+
+        :return: ответ 200 (OK), содержащий профиль;
+                 ответ 400 (Bad Request), если были переданы некорректные параметры;
+                 ответ 409 (Conflict), если профилирование уже выполняется
+        """
+        config = self.request.app['config'].get('profiler', {})
+        try:
+            duration, interval, route, fmt = _get_profile_params(self.request.query,
+                                                                 config.get('max_duration', 60))
+        except ValueError as e:
+            return json_response(status=400, data={'error': str(e)})
+
+        profiler = self.request.app['profiler']
+        if not profiler.start(interval=interval, route=route):
+            return json_response(status=409, data={'error': 'Profiling is already in progress'})
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profile = profiler.stop()
+
+        loop = asyncio.get_event_loop()
+        if fmt == 'pstats':
+            body = await loop.run_in_executor(None, profile.to_pstats)
+            return Response(status=200, body=body, content_type='application/octet-stream',
+                            headers={'Content-Disposition': 'attachment; filename="profile.pstats"'})
+        text = await loop.run_in_executor(None, profile.to_collapsed)
+        return Response(status=200, text=text, content_type='text/plain')
+
+
+class SlugIndexView(View):
+    """View показателей индекса slug-ов продуктов."""
+
+    uses_db = False
+
+    @admin_required
+    async def get(self) -> Response:
+        """
+        Endpoint показателей индекса slug-ов продуктов процесса, обработавшего запрос.
+
+        :return: ответ 200 (OK), содержащий размер фильтра, количество запросов несуществующих
+                 продуктов, отвеченных без обращения к БД, и долю ложноположительных ответов;
+                 ответ 404 (Not Found), если индекс отключен
+        """
+        index = self.request.app['slug_index']
+        if index is None:
+            return json_response(status=404, data={'error': 'Slug index is disabled'})
+        return json_response(data=index.get_stats())
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+from dao import (SqlAlchemyOrderDAO, SqlAlchemyOrderProductDAO, SqlAlchemyProductDAO, SqlAlchemyUserDAO,
+                 SqlAlchemyUserOrderDAO)
+from exceptions import DAOException
+from storage import Order, ProductSearch, UserOrder
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ID = UUID(int=0)
+WARMUP_ORDER = Order(id=WARMUP_ID, number=0, total=Decimal(0))
+
+
+async def warm_up_connection(conn, catalog: bool = True, orders: bool = True) -> None:
+    """
+    Прогреть соединение с БД, выполнив на нем наиболее частые запросы DAO.
+
+    Запросы выполняются с заведомо несуществующими значениями в откатываемой транзакции.
+    При этом строятся и компилируются выражения SQLAlchemy, а backend-процесс БД
+    заполняет кэши системного каталога для используемых таблиц и индексов.
+
+    :param conn: экземпляр подключения к БД
+    :param catalog: выполнять запросы пользователей и продуктов (в БД есть эти таблицы)
+    :param orders: выполнять запросы заказов (в БД есть таблицы заказов)
+    """
+    trans = await conn.begin()
+    try:
+        queries = []
+        if catalog:
+            queries += [SqlAlchemyUserDAO(conn).get_by_token(''), SqlAlchemyProductDAO(conn).get_by_slug('')]
+        if orders:
+            queries.append(SqlAlchemyOrderDAO(conn).get_by_number(0))
+        for query in queries:
+            try:
+                await query
+            except DAOException:
+                pass
+
+        if orders:
+            await SqlAlchemyOrderDAO(conn).get_all_by_user(WARMUP_ID, before=None, limit=1)
+            await SqlAlchemyOrderProductDAO(conn).get_all_by_orders([WARMUP_ORDER])
+            await SqlAlchemyUserOrderDAO(conn).exists(UserOrder(user_id=WARMUP_ID, order_id=WARMUP_ID))
+        if catalog:
+            for mode in ProductSearch.MODES:
+                await SqlAlchemyProductDAO(conn).search(ProductSearch(text='warmup', mode=mode, limit=1))
+    finally:
+        await trans.rollback()
+
+
+async def warm_up_engine(engine,
+                         connections: Optional[int] = None,
+                         preload_catalog: bool = False,
+                         catalog: bool = True,
+                         orders: bool = True) -> None:
+    """
+    Прогреть пул соединений engine-а.
+
+    Одновременно занимаются `connections` соединений (по умолчанию - минимальный размер пула,
+    но не меньше одного), чтобы каждое из них было открыто и прогрето.
+
+    :param engine: engine БД
+    :param connections: количество прогреваемых соединений
+    :param preload_catalog: однократно прочитать каталог продуктов целиком, чтобы он оказался в кэше БД
+    :param catalog: в БД есть таблицы пользователей и продуктов
+    :param orders: в БД есть таблицы заказов
+    """
+    conns = []
+    try:
+        for _ in range(connections or engine.minsize or 1):
+            conns.append(await engine.acquire())
+        await asyncio.gather(*(warm_up_connection(conn, catalog=catalog, orders=orders) for conn in conns))
+        if preload_catalog and catalog:
+            await SqlAlchemyProductDAO(conns[0]).get_all()
+    finally:
+        for conn in conns:
+            await engine.release(conn)
+
+
+async def warm_up(app) -> None:
+    """
+    Прогреть пулы соединений с БД и отметить приложение готовым к приему запросов.
+
+    Прогреваются пулы primary, исправных реплик и шардов заказов (в БД шардов - только
+    запросы заказов). Если `preload_catalog` включен, каталог продуктов однократно читается
+    целиком на primary и репликах. Если не удалось прогреть primary или шард, приложение
+    остается неготовым (ответ 503 на `/ready`), а прогрев повторяется через `retry_interval` секунд;
+    ошибка прогрева реплики только записывается в журнал: маршрутизатор исключает недоступные реплики.
+    """
+    config = app['config'].get('warmup', {})
+    options = {'connections': config.get('connections'), 'preload_catalog': config.get('preload_catalog', False)}
+    retry_interval = config.get('retry_interval', 5)
+    while not await _warm_up_all(app, options):
+        logger.error('The application is not ready, retrying the warm-up in %s seconds', retry_interval)
+        await asyncio.sleep(retry_interval)
+
+    app['ready'].set()
+
+
+async def _warm_up_all(app, options: dict) -> bool:
+    shards = app.get('shards')
+    # (наименование, engine, параметры прогрева, без прогрева приложение не готово)
+    targets = [('primary', app['db'], {'orders': shards is None}, True)]
+    targets += [('replica ' + replica.name, replica.engine, {'orders': shards is None}, False)
+                for replica in app['db_router'].replicas if replica.healthy]
+    if shards is not None:
+        targets += [('order shard ' + shard.name, shard.engine, {'catalog': False}, True) for shard in shards.shards]
+
+    warmings = [warm_up_engine(engine, **dict(options, **kwargs)) for _, engine, kwargs, _ in targets]
+    results = await asyncio.gather(*warmings, return_exceptions=True)
+    ready = True
+    for (name, _, _, required), result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.error('Failed to warm up the connection pool of the %s', name, exc_info=result)
+            ready = ready and not required
+    return ready
+
+
+async def init_warmup(app) -> None:
+    """Запуск фонового прогрева; до его окончания приложение считается неготовым."""
+    app['ready'] = asyncio.Event()
+    app['warmup_task'] = asyncio.ensure_future(warm_up(app))
+
+
+async def close_warmup(app) -> None:
+    """Остановка фонового прогрева, если он еще выполняется."""
+    app['warmup_task'].cancel()
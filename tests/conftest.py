@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули приложения импортируются так же, как при запуске shop/main.py - из каталога shop,
+# init_db.py - из корня проекта.
+sys.path.insert(0, os.path.join(ROOT_DIR, 'shop'))
+sys.path.insert(0, ROOT_DIR)
@@ -0,0 +1,65 @@
+import uuid
+from unittest import SkipTest, TestCase
+
+import psycopg2
+from sqlalchemy import create_engine
+
+from settings import config
+
+CONNECTION_PARAMS = ('database', 'user', 'password', 'host', 'port')
+CONNECT_TIMEOUT = 2
+
+
+def connect(**kwargs):
+    """
+    Открыть синхронное подключение к БД из конфигурационного файла.
+
+    :param kwargs: параметры подключения psycopg2, заменяющие параметры из конфигурационного файла
+    :return: подключение psycopg2
+    :raise SkipTest: выбрасывается, если сервер БД недоступен
+    """
+    params = {key: value for key, value in config['postgres'].items() if key in CONNECTION_PARAMS}
+    try:
+        return psycopg2.connect(connect_timeout=CONNECT_TIMEOUT, **dict(params, **kwargs))
+    except psycopg2.OperationalError as e:
+        raise SkipTest('PostgreSQL is not available: {error}'.format(error=e))
+
+
+def _execute_autocommit(statement: str) -> None:
+    conn = connect()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(statement)
+    finally:
+        conn.close()
+
+
+class PostgresTestCase(TestCase):
+    """
+    Базовый класс тестов на PostgreSQL.
+
+    Каждый тест выполняется в отдельной временной БД на сервере из конфигурационного файла
+    (`self.engine` и `self.connect()` подключаются к ней); без доступного сервера тест пропускается.
+    """
+
+    def setUp(self) -> None:
+        """Создать временную БД."""
+        self.database = 'test_{id}'.format(id=uuid.uuid4().hex)
+        _execute_autocommit('CREATE DATABASE {database}'.format(database=self.database))
+        self.engine = create_engine('postgresql://', creator=self.connect)
+        # Триграммные индексы продуктов требуют расширения pg_trgm.
+        self.engine.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    def tearDown(self) -> None:
+        """Удалить временную БД."""
+        self.engine.dispose()
+        _execute_autocommit('DROP DATABASE {database}'.format(database=self.database))
+
+    def connect(self):
+        """
+        Открыть синхронное подключение к временной БД.
+
+        :return: подключение psycopg2
+        """
+        return connect(database=self.database)
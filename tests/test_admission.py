@@ -0,0 +1,99 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from admission import AdmissionController, AdmissionLimiter, classify_route
+from middlewares import admission_middleware
+
+
+def make_request(method: str, path: str, canonical: str) -> web.Request:
+    """Создать запрос, сопоставленный маршруту с шаблоном пути `canonical`."""
+    request = make_mocked_request(method, path)
+    request.match_info.route.resource.canonical = canonical
+    return request
+
+
+class ClassifyRouteTest(TestCase):
+    """Тесты определения класса маршрута."""
+
+    def test_classify(self) -> None:
+        """Класс ищется по методу и шаблону пути, затем по шаблону пути, затем по методу."""
+        routes = {'GET /products/search': 'search', '/admin/products/export': 'export'}
+
+        self.assertEqual(classify_route(make_request(hdrs.METH_GET, '/products/search', '/products/search'), routes),
+                         'search')
+        self.assertEqual(classify_route(make_request(hdrs.METH_GET, '/admin/products/export',
+                                                     '/admin/products/export'), routes), 'export')
+        self.assertEqual(classify_route(make_request(hdrs.METH_GET, '/products', '/products'), routes), 'read')
+        self.assertEqual(classify_route(make_request(hdrs.METH_POST, '/orders', '/orders'), routes), 'write')
+
+
+class AdmissionLimiterTest(IsolatedAsyncioTestCase):
+    """Тесты ограничителя одновременно обрабатываемых запросов."""
+
+    async def test_queue(self) -> None:
+        """Запрос сверх лимита ждет освобождения места, при заполненной очереди - отклоняется."""
+        limiter = AdmissionLimiter(limit=1, queue_size=1, queue_timeout=1)
+        self.assertTrue(await limiter.acquire())
+
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(await limiter.acquire())
+
+        limiter.release()
+        self.assertTrue(await waiting)
+        self.assertEqual(limiter.in_flight, 1)
+
+    async def test_queue_timeout(self) -> None:
+        """Запрос, не дождавшийся места за `queue_timeout`, отклоняется и не занимает место в очереди."""
+        limiter = AdmissionLimiter(limit=1, queue_size=1, queue_timeout=0.01)
+        await limiter.acquire()
+
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertTrue(await limiter.acquire())
+
+    async def test_adaptive_limit(self) -> None:
+        """Лимит уменьшается при превышении целевой задержки и растет, если он был исчерпан."""
+        limiter = AdmissionLimiter(limit=10, queue_size=0, queue_timeout=1, adaptive=True, target_latency=0.1,
+                                   window=2)
+        for _ in range(2):
+            await limiter.acquire()
+            limiter.release(latency=1)
+        self.assertEqual(limiter.limit, 9)
+
+        limiter = AdmissionLimiter(limit=1, queue_size=0, queue_timeout=1, adaptive=True, max_limit=2, window=2)
+        for _ in range(4):
+            await limiter.acquire()
+            limiter.release(latency=0.01, pool_wait=0)
+        self.assertEqual(limiter.limit, 2)
+
+
+class AdmissionMiddlewareTest(IsolatedAsyncioTestCase):
+    """Тесты middleware контроля допуска запросов."""
+
+    async def test_overloaded(self) -> None:
+        """Запрос сверх лимита и очереди получает ответ 503 с Retry-After, запрос без лимита обрабатывается."""
+        controller = AdmissionController({'retry_after': 2, 'classes': {'write': {
+            'limit': 1, 'queue_size': 0, 'queue_timeout': 1}}})
+        middleware = admission_middleware(controller)
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def handler(request: web.Request) -> web.Response:
+            started.set()
+            await finish.wait()
+            return web.Response()
+
+        processing = asyncio.ensure_future(middleware(make_request(hdrs.METH_POST, '/orders', '/orders'), handler))
+        await started.wait()
+        response = await middleware(make_request(hdrs.METH_POST, '/orders', '/orders'), handler)
+        self.assertEqual((response.status, response.headers[hdrs.RETRY_AFTER]), (503, '2'))
+
+        finish.set()
+        self.assertEqual((await processing).status, 200)
+        response = await middleware(make_request(hdrs.METH_GET, '/products', '/products'), handler)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(controller.limiters['write'].in_flight, 0)
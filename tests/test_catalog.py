@@ -0,0 +1,160 @@
+import asyncio
+import csv
+import io
+import json
+import threading
+from typing import Tuple
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+import catalog
+from db import product_table
+from dbtest import PostgresTestCase
+from exceptions import CatalogExportCancelledException
+from middlewares import transaction_middleware
+from views import ProductExportView, ProductImportView
+
+CSV_HEADER = 'name,description,price,left_in_stock,slug\n'
+
+
+def prepare(data: str, fmt: str) -> Tuple[list, catalog.ImportReport]:
+    """Подготовить импорт и вернуть строки для COPY (без идентификаторов) и отчет."""
+    report = catalog.ImportReport()
+    with catalog.prepare_import(io.StringIO(data), fmt, report) as rows:
+        return [row[1:] for row in csv.reader(rows)], report
+
+
+class PrepareImportTest(TestCase):
+    """Тесты разбора импортируемого каталога."""
+
+    def test_csv(self) -> None:
+        """Корректные строки CSV готовятся для COPY, некорректные и повторы slug-а попадают в отчет."""
+        data = CSV_HEADER + (
+            'Green tea,Loose leaf tea,3.50,10,\n'
+            'Black tea,Loose leaf tea,abc,10,\n'
+            'Tea,Tiny,1,1,\n'
+            'Green tea,Another green tea,4,1,green-tea\n')
+        rows, report = prepare(data, 'csv')
+
+        self.assertEqual(rows, [['Green tea', 'Loose leaf tea', 'green-tea', '3.50', '10']])
+        self.assertEqual([error['line'] for error in report.errors], [3, 4, 5])
+        self.assertEqual(report.errors[0]['error'], 'Invalid number')
+        self.assertEqual(report.errors[2]['error'], 'Duplicate slug "green-tea"')
+
+    def test_ndjson(self) -> None:
+        """Пустые строки NDJSON пропускаются, поврежденный json и нечисловые цены попадают в отчет."""
+        rows, report = prepare('{"name": "Juice", "description": "Fruit juice", "price": 1.3, "left_in_stock": 5}\n'
+                               '\n'
+                               '{"name": "Milk"\n'
+                               '{"name": "Milk", "description": "Cow milk", "price": NaN, "left_in_stock": 1}\n',
+                               'ndjson')
+
+        self.assertEqual(rows, [['Juice', 'Fruit juice', 'juice', '1.3', '5']])
+        self.assertEqual([(error['line'], error['error']) for error in report.errors],
+                         [(3, 'Invalid JSON'), (4, 'Invalid number NaN')])
+
+    def test_reported_errors_limit(self) -> None:
+        """В отчете сохраняются только первые ошибки, но учитываются все."""
+        with patch.object(catalog, 'MAX_REPORTED_ERRORS', 2):
+            _, report = prepare('{}\n' * 3, 'ndjson')
+        self.assertEqual((report.errors_count, len(report.errors)), (3, 2))
+
+
+class ExportTest(IsolatedAsyncioTestCase):
+    """Тесты потоковой выгрузки каталога."""
+
+    def setUp(self) -> None:
+        """Заменить выгрузку из БД записью тысячи строк по 1000 байт."""
+        self.exported = []
+        self.done = threading.Event()
+
+        def export_file(file, fmt: str) -> None:
+            try:
+                for i in range(1000):
+                    if fmt == 'broken' and i == 10:
+                        raise RuntimeError('COPY failed')
+                    file.write(b'x' * 1000)
+            except Exception as e:
+                self.exported.append(type(e))
+                raise
+            else:
+                self.exported.append(fmt)
+            finally:
+                self.done.set()
+        patcher = patch.object(catalog, 'export_file', export_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_chunks(self) -> None:
+        """Выгрузка передается частями не меньше заданного размера."""
+        chunks = [chunk async for chunk in catalog.iter_export('csv', 4096)]
+
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 1000 * 1000)
+        self.assertTrue(all(len(chunk) >= 4096 for chunk in chunks[:-1]))
+        self.assertEqual(self.exported, ['csv'])
+
+    async def test_error(self) -> None:
+        """Ошибка выгрузки выбрасывается при итерировании."""
+        with self.assertRaisesRegex(RuntimeError, 'COPY failed'):
+            async for _ in catalog.iter_export('broken', 4096):
+                pass
+
+    async def test_cancel(self) -> None:
+        """Прерванное итерирование останавливает выгрузку, ожидающую места в очереди."""
+        chunks = catalog.iter_export('csv', 4096)
+        await chunks.__anext__()
+        await chunks.aclose()
+
+        await asyncio.get_event_loop().run_in_executor(None, self.done.wait, 1)
+        self.assertEqual(self.exported, [CatalogExportCancelledException])
+
+    def test_ndjson_writer(self) -> None:
+        """Вывод COPY в текстовом формате преобразуется в NDJSON."""
+        target = io.BytesIO()
+        catalog._NdjsonCopyWriter(target).write(b'{"description" : "a\\\\\\\\b"}\n')
+        self.assertEqual(json.loads(target.getvalue()), {'description': 'a\\b'})
+
+
+class CatalogViewsTest(IsolatedAsyncioTestCase):
+    """Тесты view импорта и экспорта каталога."""
+
+    async def test_no_transaction(self) -> None:
+        """Для импорта и экспорта соединение из пула не открывается: они используют свое подключение."""
+        async def handler(request: web.Request) -> web.Response:
+            self.assertNotIn('conn', request)
+            return web.Response()
+
+        for view in (ProductImportView, ProductExportView):
+            request = make_mocked_request(hdrs.METH_POST, '/products/import', app=web.Application())
+            request.match_info.route.handler = view
+            response = await transaction_middleware(request, handler)
+            self.assertEqual(response.status, 200)
+
+
+class CatalogDatabaseTest(PostgresTestCase):
+    """Тесты импорта и экспорта каталога через COPY."""
+
+    def setUp(self) -> None:
+        """Создать таблицу продуктов."""
+        super().setUp()
+        product_table.create(bind=self.engine)
+        self.conn = self.connect()
+        self.addCleanup(self.conn.close)
+
+    def test_round_trip(self) -> None:
+        """Импорт добавляет и обновляет продукты по slug, экспорт выгружает их в том же виде."""
+        data = CSV_HEADER + 'Green tea,Loose leaf tea,3.50,10,\n'
+        report = catalog.import_catalog(self.conn, io.StringIO(data), 'csv')
+        self.assertEqual((report.inserted, report.updated), (1, 0))
+
+        data = '{"name": "Green tea", "description": "Tea with a \\\\ backslash", "price": 4, "left_in_stock": 1}\n'
+        report = catalog.import_catalog(self.conn, io.StringIO(data), 'ndjson')
+        self.assertEqual((report.inserted, report.updated), (0, 1))
+
+        target = io.BytesIO()
+        catalog.export_catalog(self.conn, target, 'ndjson')
+        self.assertEqual(json.loads(target.getvalue()), {'name': 'Green tea', 'description': 'Tea with a \\ backslash',
+                                                         'slug': 'green-tea', 'price': 4, 'left_in_stock': 1})
@@ -0,0 +1,154 @@
+import json
+import select
+import time
+from decimal import Decimal
+from unittest import IsolatedAsyncioTestCase, TestCase
+from uuid import uuid4
+
+from changefeed import ProductChangeHub
+from dao import MemoryProductDAO
+from db import (PRODUCT_CHANGES_CHANNEL, PRODUCT_CHANGES_MAX_ROWS, PRODUCT_CHANGES_RESET, PRODUCT_CHANGES_SETTING,
+                product_table)
+from dbtest import PostgresTestCase
+from memory import MemoryStore
+from storage import Product
+
+NOTIFICATION_TIMEOUT = 1
+
+
+class ProductChangeHubTest(TestCase):
+    """Тесты раздачи изменений продуктов подписчикам."""
+
+    def setUp(self) -> None:
+        """Создать раздачу с двумя подписчиками."""
+        self.hub = ProductChangeHub(buffer_size=2)
+        self.subscribers = [self.hub.subscribe(), self.hub.subscribe()]
+
+    def test_publish(self) -> None:
+        """Все изменения уведомления доставляются каждому подписчику."""
+        changes = [{'op': 'update', 'slug': 'tea', 'price': 3, 'left_in_stock': 1},
+                   {'op': 'delete', 'slug': 'juice'}]
+        self.hub.publish(json.dumps(changes))
+
+        for subscriber in self.subscribers:
+            self.assertEqual(subscriber.drain(), (False, changes))
+
+    def test_coalesce(self) -> None:
+        """Неотправленные изменения одного продукта объединяются в последнее."""
+        self.hub.publish(json.dumps([{'op': 'update', 'slug': 'tea', 'price': 3, 'left_in_stock': 2}]))
+        self.hub.publish(json.dumps([{'op': 'update', 'slug': 'tea', 'price': 3, 'left_in_stock': 1}]))
+
+        self.assertEqual(self.subscribers[0].drain(),
+                         (False, [{'op': 'update', 'slug': 'tea', 'price': 3, 'left_in_stock': 1}]))
+
+    def test_reset_notification(self) -> None:
+        """Уведомление о сбросе сбрасывает буферы подписчиков."""
+        self.hub.publish(json.dumps([{'op': 'delete', 'slug': 'tea'}]))
+        self.hub.publish(PRODUCT_CHANGES_RESET)
+
+        for subscriber in self.subscribers:
+            self.assertEqual(subscriber.drain(), (True, []))
+
+    def test_overflow(self) -> None:
+        """Подписчик с переполненным буфером получает сброс."""
+        self.hub.publish(json.dumps([{'op': 'delete', 'slug': slug} for slug in ('tea', 'juice', 'coffee')]))
+
+        self.assertEqual(self.subscribers[0].drain(), (True, []))
+
+    def test_malformed(self) -> None:
+        """Поврежденное уведомление пропускается."""
+        self.hub.publish('not json')
+
+        self.assertEqual(self.subscribers[0].drain(), (False, []))
+
+
+class MemoryProductChangesTest(IsolatedAsyncioTestCase):
+    """Тесты уведомлений об изменениях продуктов хранилища в памяти."""
+
+    async def test_notify_on_commit(self) -> None:
+        """Изменение продукта доставляется подписчикам в том же формате, что и уведомление триггера."""
+        store = MemoryStore()
+        hub = ProductChangeHub()
+        subscriber = hub.subscribe()
+        store.listen(PRODUCT_CHANGES_CHANNEL, hub.publish)
+
+        conn = store.connect()
+        trans = await conn.begin()
+        await MemoryProductDAO(conn).create(Product('Green tea', 'Loose leaf tea', Decimal(3), 10, id=uuid4()))
+        self.assertEqual(subscriber.drain(), (False, []))
+        await trans.commit()
+
+        self.assertEqual(subscriber.drain(),
+                         (False, [{'op': 'insert', 'slug': 'green-tea', 'price': 3.0, 'left_in_stock': 10}]))
+
+
+class ProductChangesTriggerTest(PostgresTestCase):
+    """Тесты триггеров уведомлений об изменениях продуктов."""
+
+    def setUp(self) -> None:
+        """Создать таблицу продуктов и подписаться на уведомления."""
+        super().setUp()
+        product_table.create(bind=self.engine)
+        self.listener = self.connect()
+        self.listener.autocommit = True
+        with self.listener.cursor() as cursor:
+            cursor.execute('LISTEN {channel}'.format(channel=PRODUCT_CHANGES_CHANNEL))
+
+    def tearDown(self) -> None:
+        """Закрыть подписку."""
+        self.listener.close()
+        super().tearDown()
+
+    def execute(self, *statements: str) -> None:
+        """Выполнить запросы в одной транзакции."""
+        with self.engine.begin() as conn:
+            for statement in statements:
+                conn.execute(statement)
+
+    def insert(self, count: int, prefix: str = 'product') -> str:
+        """Вернуть запрос, добавляющий `count` продуктов."""
+        return ('INSERT INTO products (id, name, description, slug, price, left_in_stock) '
+                "SELECT md5(random()::text)::uuid, 'Product', 'Product', '{prefix}-' || n, 1, n "
+                'FROM generate_series(1, {count}) n').format(prefix=prefix, count=count)
+
+    def get_notifications(self) -> list:
+        """Дождаться и вернуть полезные нагрузки уведомлений, отправленных при последней фиксации."""
+        deadline = time.monotonic() + NOTIFICATION_TIMEOUT
+        while time.monotonic() < deadline:
+            select.select([self.listener], [], [], deadline - time.monotonic())
+            self.listener.poll()
+            if self.listener.notifies:
+                break
+        payloads = [notify.payload for notify in self.listener.notifies]
+        self.listener.notifies.clear()
+        return payloads
+
+    def test_one_notification_per_statement(self) -> None:
+        """Запрос, изменивший несколько продуктов, отправляет одно уведомление со всеми изменениями."""
+        self.execute(self.insert(3))
+        changes = json.loads(*self.get_notifications())
+        self.assertEqual(sorted(change['slug'] for change in changes), ['product-1', 'product-2', 'product-3'])
+        self.assertTrue(all(change['op'] == 'insert' for change in changes))
+
+        self.execute("UPDATE products SET left_in_stock = 0 WHERE slug IN ('product-1', 'product-2')",
+                     "UPDATE products SET name = 'Renamed' WHERE slug = 'product-3'")
+        changes = json.loads(*self.get_notifications())
+        self.assertEqual(sorted((change['op'], change['slug'], change['left_in_stock']) for change in changes),
+                         [('update', 'product-1', 0), ('update', 'product-2', 0)])
+
+        self.execute('DELETE FROM products')
+        self.assertEqual(len(json.loads(*self.get_notifications())), 3)
+
+    def test_reset_above_threshold(self) -> None:
+        """Запрос, изменивший больше PRODUCT_CHANGES_MAX_ROWS продуктов, отправляет сброс."""
+        self.execute(self.insert(PRODUCT_CHANGES_MAX_ROWS + 1))
+        self.assertEqual(self.get_notifications(), [PRODUCT_CHANGES_RESET])
+
+    def test_suppressed(self) -> None:
+        """Параметр сеанса отключает уведомления до конца транзакции."""
+        self.execute("SELECT set_config('{setting}', 'off', true)".format(setting=PRODUCT_CHANGES_SETTING),
+                     self.insert(3))
+        self.assertEqual(self.get_notifications(), [])
+
+        self.execute(self.insert(1, prefix='other'))
+        self.assertEqual(len(self.get_notifications()), 1)
@@ -0,0 +1,102 @@
+import gzip
+import threading
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from compression import CODECS, CompressedBodyCache, negotiate_encoding
+from middlewares import compression_middleware
+
+
+class NegotiateEncodingTest(TestCase):
+    """Тесты выбора алгоритма сжатия."""
+
+    def test_weights(self) -> None:
+        """Выбирается приемлемый алгоритм с наибольшим весом."""
+        self.assertEqual(negotiate_encoding('deflate;q=0.5, gzip;q=0.8'), 'gzip')
+
+    def test_server_preference(self) -> None:
+        """При равных весах алгоритм выбирается в порядке предпочтения сервера."""
+        self.assertEqual(negotiate_encoding('deflate, gzip'), next(coding for coding in CODECS if coding != 'br'))
+
+    def test_not_acceptable(self) -> None:
+        """Без приемлемых алгоритмов ответ не сжимается."""
+        self.assertIsNone(negotiate_encoding(''))
+        self.assertIsNone(negotiate_encoding('identity, *;q=0'))
+
+
+class CompressedBodyCacheTest(TestCase):
+    """Тесты кэша сжатых тел ответов."""
+
+    def test_lru(self) -> None:
+        """При переполнении вытесняется давно не использованное тело."""
+        cache = CompressedBodyCache(max_entries=2)
+        cache.put('first', b'1')
+        cache.put('second', b'2')
+        self.assertEqual(cache.get('first'), b'1')
+        cache.put('third', b'3')
+
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual((cache.get('first'), cache.get('third')), (b'1', b'3'))
+
+
+class CompressionMiddlewareTest(IsolatedAsyncioTestCase):
+    """Тесты сжатия тел ответов."""
+
+    def setUp(self) -> None:
+        """Создать middleware, кэширующий тела от 100 байт и сжимающий в executor-е тела от 1000 байт."""
+        self.middleware = compression_middleware(min_size=10, cache_min_size=100, executor_min_size=1000)
+        self.threads = []
+
+        def compress(body: bytes, level: int) -> bytes:
+            self.threads.append(threading.current_thread())
+            return gzip.compress(body, compresslevel=level, mtime=0)
+        patcher = patch.dict(CODECS, gzip=compress)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def request(self, body: bytes, etag: str = None) -> web.Response:
+        """Обработать запрос, принимающий gzip, обработчиком, возвращающим `body`."""
+        async def handler(request: web.Request) -> web.Response:
+            response = web.Response(body=body, content_type='application/json')
+            if etag is not None:
+                response.headers[hdrs.ETAG] = etag
+            return response
+
+        request = make_mocked_request(hdrs.METH_GET, '/products', headers={hdrs.ACCEPT_ENCODING: 'gzip'})
+        return await self.middleware(request, handler)
+
+    async def test_small_body(self) -> None:
+        """Тело меньше минимального размера не сжимается."""
+        response = await self.request(b'[]')
+        self.assertNotIn(hdrs.CONTENT_ENCODING, response.headers)
+        self.assertEqual(response.body, b'[]')
+
+    async def test_compress(self) -> None:
+        """Тело сжимается выбранным алгоритмом; небольшое тело - в event loop-е."""
+        response = await self.request(b'[1, 2, 3, 4, 5]')
+        self.assertEqual(response.headers[hdrs.CONTENT_ENCODING], 'gzip')
+        self.assertEqual(gzip.decompress(response.body), b'[1, 2, 3, 4, 5]')
+        self.assertEqual(self.threads, [threading.current_thread()])
+
+    async def test_executor(self) -> None:
+        """Большое тело сжимается в executor-е."""
+        response = await self.request(b'[' + b'1, ' * 1000 + b'1]')
+        self.assertEqual(gzip.decompress(response.body), b'[' + b'1, ' * 1000 + b'1]')
+        self.assertNotEqual(self.threads, [threading.current_thread()])
+
+    async def test_cache_by_etag(self) -> None:
+        """Тело с тем же ETag-ом берется из кэша без повторного сжатия, ETag сжатого тела отличается."""
+        body = b'[' + b'1, ' * 100 + b'1]'
+        for _ in range(2):
+            response = await self.request(body, etag='"catalog-1"')
+            self.assertEqual(gzip.decompress(response.body), body)
+            self.assertEqual(response.headers[hdrs.ETAG], '"catalog-1-gzip"')
+        self.assertEqual(len(self.threads), 1)
+
+        await self.request(body, etag='"catalog-2"')
+        await self.request(body)
+        await self.request(body)
+        self.assertEqual(len(self.threads), 4)
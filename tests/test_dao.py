@@ -0,0 +1,77 @@
+import asyncio
+from decimal import Decimal
+from unittest import IsolatedAsyncioTestCase
+from uuid import uuid4
+
+from aiopg.sa import create_engine
+
+from dao import MemoryProductDAO, ProductDAO, SqlAlchemyProductDAO
+from db import product_table
+from dbtest import CONNECTION_PARAMS, PostgresTestCase
+from exceptions import ProductAlreadyExistsException, ProductNotEnoughException, ProductNotFoundException
+from memory import MemoryStore
+from settings import config
+from storage import Product
+
+
+class ProductMutationsMixin:
+    """Проверки изменений продуктов по slug, общие для всех реализаций DAO."""
+
+    async def check_mutations(self, dao: ProductDAO) -> None:
+        """Проверить создание, частичное обновление, списание со склада и удаление продукта."""
+        product = await dao.create(Product('Green tea', 'Loose leaf tea', Decimal(3), 10, id=uuid4()))
+        with self.assertRaises(ProductAlreadyExistsException):
+            await dao.create(Product('Green tea', 'Another green tea', Decimal(4), 1, id=uuid4()))
+
+        updated = await dao.update_by_slug(product.slug, {'price': Decimal(4)})
+        self.assertEqual((updated.price, updated.description, updated.left_in_stock), (4, 'Loose leaf tea', 10))
+        with self.assertRaises(ProductNotFoundException):
+            await dao.update_by_slug('black-tea', {'price': Decimal(1)})
+
+        taken = await dao.take_from_stock(product, 7)
+        self.assertEqual((taken.price, taken.left_in_stock), (4, 3))
+        with self.assertRaises(ProductNotEnoughException):
+            await dao.take_from_stock(product, 4)
+
+        deleted = await dao.delete_by_slug(product.slug)
+        self.assertEqual((deleted.id, deleted.left_in_stock), (product.id, 3))
+        with self.assertRaises(ProductNotFoundException):
+            await dao.delete_by_slug(product.slug)
+        with self.assertRaises(ProductNotEnoughException):
+            await dao.take_from_stock(product, 1)
+
+
+class MemoryProductDAOTest(ProductMutationsMixin, IsolatedAsyncioTestCase):
+    """Тесты изменений продуктов в хранилище в памяти."""
+
+    async def test_mutations(self) -> None:
+        """Продукты изменяются по slug, отсутствие продукта и нехватка остатка выбрасывают исключения."""
+        conn = MemoryStore().connect()
+        trans = await conn.begin()
+        await self.check_mutations(MemoryProductDAO(conn))
+        await trans.commit()
+
+
+class SqlAlchemyProductDAOTest(ProductMutationsMixin, PostgresTestCase):
+    """Тесты изменений продуктов одиночными запросами к PostgreSQL."""
+
+    def setUp(self) -> None:
+        """Создать таблицу продуктов."""
+        super().setUp()
+        product_table.create(bind=self.engine)
+
+    async def run_mutations(self) -> None:
+        """Проверить изменения продуктов в транзакции временной БД."""
+        params = {key: value for key, value in config['postgres'].items() if key in CONNECTION_PARAMS}
+        engine = await create_engine(**dict(params, database=self.database))
+        try:
+            async with engine.acquire() as conn:
+                async with conn.begin():
+                    await self.check_mutations(SqlAlchemyProductDAO(conn))
+        finally:
+            engine.close()
+            await engine.wait_closed()
+
+    def test_mutations(self) -> None:
+        """Продукты изменяются по slug, отсутствие продукта и нехватка остатка выбрасывают исключения."""
+        asyncio.run(self.run_mutations())
@@ -0,0 +1,25 @@
+from unittest.mock import patch
+
+import init_db
+from dbtest import PostgresTestCase
+
+PARTITIONING = {'enabled': True, 'partition_size': 100, 'premake': 1}
+
+
+class GenerateDataTest(PostgresTestCase):
+    """Тесты генерации данных."""
+
+    def test_orders_past_premade_partitions(self) -> None:
+        """Сгенерированные заказы загружаются в секции, не созданные вместе с таблицами."""
+        with patch.dict(init_db.config, partitioning=PARTITIONING):
+            init_db.create_tables(self.engine)
+            premade = self.engine.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = 'orders'::regclass")
+            self.assertEqual(premade.scalar(), 2)
+
+            init_db.generate_data(self.engine, users=5, products=5, orders=50, batch_size=7)
+
+        # 50 заказов с шагом номеров 10 занимают 5 секций по 100 номеров, и еще одна создается впрок.
+        self.assertEqual(self.engine.execute('SELECT count(*), max(number) FROM orders').first(), (50, 1490))
+        partitions = self.engine.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = 'orders'::regclass")
+        self.assertEqual(partitions.scalar(), 6)
+        self.assertEqual(self.engine.execute('SELECT count(*) FROM users_orders').scalar(), 50)
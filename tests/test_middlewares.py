@@ -0,0 +1,138 @@
+import asyncio
+from decimal import Decimal
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock
+from uuid import uuid4
+
+import psycopg2.extensions
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from dao import MemoryProductDAO
+from memory import MemoryStore
+from middlewares import memory_transaction_middleware, transaction_middleware
+from replicas import ReplicaRouter
+from storage import Product
+
+
+class MemoryTransactionMiddlewareTest(IsolatedAsyncioTestCase):
+    """Тесты транзакций запросов к хранилищу в памяти."""
+
+    def setUp(self) -> None:
+        """Создать приложение с хранилищем, содержащим один продукт."""
+        self.store = MemoryStore()
+        self.product = Product('Green tea', 'Loose leaf green tea', Decimal(3), 5, id=uuid4())
+        self.store.load(products=[self.product])
+        self.app = web.Application()
+        self.app['db'] = self.store
+
+    async def request(self, method: str, handler) -> web.StreamResponse:
+        """Обработать запрос обработчиком `handler` внутри middleware."""
+        return await memory_transaction_middleware(make_mocked_request(method, '/', app=self.app), handler)
+
+    async def test_writes_do_not_interleave(self) -> None:
+        """Пишущие запросы, читающие данные перед записью, выполняются по очереди."""
+        async def take_one(request: web.Request) -> web.Response:
+            dao = MemoryProductDAO(request['conn'])
+            product = await dao.get_by_slug(self.product.slug)
+            await asyncio.sleep(0)
+            await dao.update_by_slug(product.slug, {'left_in_stock': product.left_in_stock - 1})
+            return web.Response()
+
+        await asyncio.gather(*(self.request(hdrs.METH_POST, take_one) for _ in range(3)))
+        self.assertEqual(self.store.products.get(self.product.id).left_in_stock, 2)
+
+    async def test_reads_are_not_blocked(self) -> None:
+        """Читающие запросы не ждут завершения пишущего запроса."""
+        write_started, read_done = asyncio.Event(), asyncio.Event()
+
+        async def write(request: web.Request) -> web.Response:
+            write_started.set()
+            await read_done.wait()
+            return web.Response()
+
+        async def read(request: web.Request) -> web.Response:
+            read_done.set()
+            return web.Response()
+
+        writing = asyncio.ensure_future(self.request(hdrs.METH_POST, write))
+        await write_started.wait()
+        await asyncio.wait_for(self.request(hdrs.METH_GET, read), timeout=1)
+        await writing
+
+    async def test_rollback_on_error(self) -> None:
+        """Изменения обработчика, завершившегося ошибкой, откатываются, а блокировка освобождается."""
+        async def fail(request: web.Request) -> web.Response:
+            await MemoryProductDAO(request['conn']).update_by_slug(self.product.slug, {'left_in_stock': 0})
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            await self.request(hdrs.METH_PATCH, fail)
+        self.assertEqual(self.store.products.get(self.product.id).left_in_stock, 5)
+        self.assertFalse(self.store.write_lock.locked())
+
+
+class LockNotAvailableError(Exception):
+    """Ошибка ожидания блокировки, превысившего lock_timeout."""
+
+    pgcode = '55P03'
+
+
+class TransactionTimeoutsTest(IsolatedAsyncioTestCase):
+    """Тесты ограничений времени выполнения запросов к БД."""
+
+    def setUp(self) -> None:
+        """Создать приложение с engine-ом, выдающим одно соединение."""
+        self.conn = Mock(closed=False, execute=AsyncMock())
+        self.conn.connection.get_backend_pid = AsyncMock(return_value=1)
+        self.conn.connection.raw.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        self.trans = Mock(is_active=True, commit=AsyncMock(), rollback=AsyncMock())
+        self.conn.begin = AsyncMock(return_value=self.trans)
+        engine = Mock(acquire=AsyncMock(return_value=self.conn), release=AsyncMock())
+
+        self.app = web.Application()
+        self.app['db'] = engine
+        self.app['db_router'] = ReplicaRouter(engine, [])
+        self.app['config'] = {'timeouts': {
+            'default': {'statement_timeout': 5000, 'lock_timeout': 1000},
+            'routes': {'/products': {'statement_timeout': 2000}}
+        }}
+
+    async def request(self, path: str, handler) -> web.StreamResponse:
+        """Обработать запрос обработчиком `handler` внутри middleware."""
+        request = make_mocked_request(hdrs.METH_GET, path, app=self.app)
+        request.match_info.route.resource.canonical = path
+        return await transaction_middleware(request, handler)
+
+    async def test_set_timeouts(self) -> None:
+        """Ограничения маршрута дополняют ограничения по умолчанию и устанавливаются до конца транзакции."""
+        async def handler(request: web.Request) -> web.Response:
+            return web.Response()
+
+        for path, statement_timeout in (('/products', '2000'), ('/orders', '5000')):
+            self.conn.execute.reset_mock()
+            self.assertEqual((await self.request(path, handler)).status, 200)
+            self.conn.execute.assert_awaited_once_with(
+                'SELECT set_config(%s, %s, true), set_config(%s, %s, true)',
+                ['statement_timeout', statement_timeout, 'lock_timeout', '1000'])
+
+    async def test_lock_timeout(self) -> None:
+        """При превышении lock_timeout транзакция откатывается и возвращается ответ 503."""
+        async def handler(request: web.Request) -> web.Response:
+            raise LockNotAvailableError
+
+        self.assertEqual((await self.request('/products', handler)).status, 503)
+        self.trans.rollback.assert_awaited_once()
+
+    async def test_statement_timeout(self) -> None:
+        """Запрос, отмененный по statement_timeout, дает ответ 503, отмена обработчика - выбрасывается."""
+        async def handler(request: web.Request) -> web.Response:
+            raise asyncio.CancelledError
+
+        self.conn.connection.raw.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        self.assertEqual((await self.request('/products', handler)).status, 503)
+
+        self.conn.connection.raw.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        with self.assertRaises(asyncio.CancelledError):
+            await self.request('/products', handler)
+        self.assertEqual(self.trans.rollback.await_count, 2)
@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from ratelimit import TokenBucketLimiter
+
+
+class TokenBucketLimiterTest(TestCase):
+    """Тесты ограничителя частоты запросов (token bucket)."""
+
+    def setUp(self) -> None:
+        """Создать ограничитель: 2 запроса в секунду, до 3 запросов подряд."""
+        self.limiter = TokenBucketLimiter(rate=2, burst=3, max_clients=2)
+
+    def test_burst(self) -> None:
+        """Запросы до емкости корзины разрешаются, следующий ждет появления токена."""
+        self.assertEqual([self.limiter.acquire('user', now=0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.limiter.acquire('user', now=0), 0.5)
+
+    def test_refill(self) -> None:
+        """Корзина пополняется со скоростью `rate`, но не сверх емкости."""
+        for _ in range(3):
+            self.limiter.acquire('user', now=0)
+        self.assertEqual(self.limiter.acquire('user', now=0.5), 0)
+        self.assertGreater(self.limiter.acquire('user', now=0.5), 0)
+
+        self.assertEqual([self.limiter.acquire('user', now=100) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.limiter.acquire('user', now=100), 0)
+
+    def test_clients_are_independent(self) -> None:
+        """Корзины клиентов не зависят друг от друга."""
+        for _ in range(3):
+            self.limiter.acquire('first', now=0)
+        self.assertEqual(self.limiter.acquire('second', now=0), 0)
+
+    def test_eviction(self) -> None:
+        """Простаивающие корзины и корзины сверх `max_clients` вытесняются."""
+        self.limiter.acquire('first', now=0)
+        self.limiter.acquire('second', now=0)
+        self.limiter.acquire('third', now=0)
+        self.assertEqual(len(self.limiter), 2)
+
+        self.limiter.acquire('fourth', now=10)
+        self.assertEqual(len(self.limiter), 1)
@@ -0,0 +1,64 @@
+import time
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from replicas import Replica, ReplicaRouter
+
+PRIMARY = 'primary'
+
+
+class ReplicaRouterTest(IsolatedAsyncioTestCase):
+    """Тесты маршрутизации запросов на чтение между primary и репликами."""
+
+    def setUp(self) -> None:
+        """Создать маршрутизатор с тремя репликами: синхронной, отстающей и недоступной."""
+        self.lags = {'replica1': 0, 'replica2': 60, 'replica3': ConnectionRefusedError()}
+        self.router = ReplicaRouter(PRIMARY, [Replica(name, engine=name) for name in self.lags],
+                                    max_lag=5, sticky_seconds=10)
+
+        async def get_lag(engine) -> float:
+            lag = self.lags[engine]
+            if isinstance(lag, Exception):
+                raise lag
+            return lag
+        patcher = patch.object(ReplicaRouter, '_get_lag', staticmethod(get_lag))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_no_healthy_replicas(self) -> None:
+        """До первой проверки и без исправных реплик чтение выполняется с primary."""
+        self.assertEqual(self.router.choose(), PRIMARY)
+
+        self.lags['replica1'] = 60
+        await self.router.check()
+        self.assertEqual(self.router.choose(), PRIMARY)
+
+    async def test_healthy_replicas(self) -> None:
+        """Чтение распределяется по кругу между репликами, отставание которых допустимо."""
+        self.lags['replica2'] = 1
+        await self.router.check()
+
+        self.assertEqual([self.router.choose() for _ in range(4)], ['replica1', 'replica2'] * 2)
+        self.assertEqual([(replica.healthy, replica.lag) for replica in self.router.replicas],
+                         [(True, 0), (True, 1), (False, None)])
+
+    async def test_read_your_writes(self) -> None:
+        """Клиент, недавно выполнивший запись, читает с primary, остальные - с реплики."""
+        await self.router.check()
+        self.router.mark_write('writer')
+
+        self.assertEqual(self.router.choose('writer'), PRIMARY)
+        self.assertEqual(self.router.choose('reader'), 'replica1')
+        self.assertEqual(self.router.choose(last_write=time.time() - 1), PRIMARY)
+        self.assertEqual(self.router.choose(last_write=time.time() - 60), 'replica1')
+
+    async def test_expired_writes(self) -> None:
+        """Записи клиентов забываются по истечении `sticky_seconds`."""
+        router = ReplicaRouter(PRIMARY, [], sticky_seconds=0)
+        router.mark_write('first')
+        self.assertFalse(router.recently_wrote('first'))
+
+        router.mark_write('second')
+        self.assertEqual(list(router._recent_writes), [])
+        router.mark_write(None)
+        self.assertFalse(router.recently_wrote(None))
@@ -0,0 +1,62 @@
+from decimal import Decimal
+from typing import List
+from unittest import IsolatedAsyncioTestCase, TestCase
+from uuid import uuid4
+
+from multidict import MultiDict
+
+from dao import MemoryProductDAO
+from memory import MemoryStore
+from storage import Product, ProductSearch
+from views import _parse_product_search
+
+
+class MemoryProductSearchTest(IsolatedAsyncioTestCase):
+    """Тесты поиска продуктов в хранилище в памяти."""
+
+    def setUp(self) -> None:
+        """Заполнить хранилище продуктами."""
+        store = MemoryStore()
+        store.load(products=[
+            Product('Green tea', 'Loose leaf green tea', Decimal(3), 10, id=uuid4()),
+            Product('Green coffee', 'Unroasted coffee beans', Decimal(8), 0, id=uuid4()),
+            Product('Black tea', 'Strong black tea', Decimal(2), 5, id=uuid4())
+        ])
+        self.dao = MemoryProductDAO(store.connect())
+
+    async def search(self, *args, **kwargs) -> List[str]:
+        """Найти продукты и вернуть их slug-и в порядке выдачи."""
+        return [product.slug for product in await self.dao.search(ProductSearch(*args, **kwargs))]
+
+    async def test_modes(self) -> None:
+        """Продукты ищутся по префиксу наименования, подстроке и словам и упорядочиваются по релевантности."""
+        self.assertEqual(await self.search('gre', 'prefix'), ['green-tea', 'green-coffee'])
+        self.assertEqual(await self.search('tea', 'substring'), ['black-tea', 'green-tea'])
+        self.assertEqual(await self.search('Green TEA', 'fulltext'), ['green-tea'])
+        self.assertEqual(await self.search('tea', 'prefix'), [])
+
+    async def test_filters(self) -> None:
+        """Продукты отбираются по диапазону цен и наличию на складе."""
+        self.assertEqual(await self.search('green', 'substring', in_stock=True), ['green-tea'])
+        self.assertEqual(await self.search('e', 'substring', min_price=2.5, max_price=5), ['green-tea'])
+
+    async def test_pagination(self) -> None:
+        """Выдача разбивается на страницы."""
+        self.assertEqual(await self.search('tea', 'substring', limit=1, offset=1), ['green-tea'])
+
+
+class ParseProductSearchTest(TestCase):
+    """Тесты разбора параметров поиска продуктов."""
+
+    def test_parse(self) -> None:
+        """Параметры поиска разбираются из query-параметров."""
+        search = _parse_product_search(MultiDict(q=' tea ', mode='prefix', max_price='5', in_stock='true', limit='5'))
+        self.assertEqual((search.text, search.mode, search.max_price, search.in_stock, search.limit, search.offset),
+                         ('tea', 'prefix', 5.0, True, 5, 0))
+
+    def test_invalid(self) -> None:
+        """Некорректные параметры поиска отклоняются."""
+        for query in ({}, {'q': ' '}, {'q': 'tea', 'mode': 'regex'}, {'q': 'tea', 'limit': '0'},
+                      {'q': 'tea', 'offset': '-1'}, {'q': 'tea', 'min_price': 'cheap'}):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                _parse_product_search(MultiDict(query))
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterable, Tuple
+from unittest import IsolatedAsyncioTestCase
+from uuid import uuid4
+
+from dao import MemoryProductDAO
+from db import Gender, PRODUCT_CHANGES_CHANNEL
+from exceptions import ProductAlreadyExistsException, ProductNotEnoughException
+from memory import MemoryStore
+from services import ServiceFactory
+from snapshot import SharedCatalog, write_snapshot
+from storage import Order, OrderProduct, Product, User
+
+
+class MemoryServiceTestCase(IsolatedAsyncioTestCase):
+    """Базовый класс тестов сервисов на хранилище в памяти."""
+
+    def setUp(self) -> None:
+        """Заполнить хранилище пользователем и продуктом."""
+        self.store = MemoryStore()
+        self.user = User(id=uuid4(), login='user', password='', first_name='Ivan', surname='Ivanov',
+                         middle_name=None, sex=Gender.male, age=30)
+        self.product = Product('Dark chocolate', 'Bitter dark chocolate', Decimal('2.50'), 5, id=uuid4())
+        self.store.load(users=[self.user], products=[self.product])
+
+    def get_stock(self) -> int:
+        """Вернуть зафиксированный остаток продукта."""
+        return self.store.products.get(self.product.id).left_in_stock
+
+    async def create_order(self, quantity: int, interleave: bool = False) -> Tuple[Order, Iterable[OrderProduct]]:
+        """
+        Создать заказ в отдельной транзакции, как обработчик POST /orders.
+
+        :param quantity: количество продукта
+        :param interleave: уступить управление между чтением продукта и созданием заказа
+        :return: кортеж вида (заказ, список продуктов для заказа)
+        """
+        conn = self.store.connect()
+        trans = await conn.begin()
+        factory = ServiceFactory(conn, backend='memory')
+        try:
+            product = await factory.create_product_service().get_by_slug(self.product.slug)
+            if interleave:
+                await asyncio.sleep(0)
+            result = await factory.create_order_service().create(self.user, [(product, quantity)])
+        except BaseException:
+            await trans.rollback()
+            raise
+        await trans.commit()
+        return result
+
+
+class OrderServiceTest(MemoryServiceTestCase):
+    """Тесты создания заказов."""
+
+    async def test_create(self) -> None:
+        """Заказ сохраняет цены и сумму, списывает остаток и обновляет агрегаты продаж."""
+        order, order_products = await self.create_order(2)
+
+        self.assertEqual(order.total, Decimal('5.00'))
+        self.assertEqual([(line.quantity, line.price) for line in order_products], [(2, Decimal('2.50'))])
+        self.assertEqual(self.get_stock(), 3)
+        sales = self.store.product_sales.get(self.product.id)
+        self.assertEqual((sales.units_sold, sales.revenue), (2, Decimal('5.00')))
+
+        conn = self.store.connect()
+        orders = await ServiceFactory(conn, backend='memory').create_order_service().get_all(self.user)
+        self.assertEqual([found.number for found, _ in orders], [order.number])
+
+    async def test_not_enough_in_stock(self) -> None:
+        """Заказ сверх остатка отклоняется без изменения остатка."""
+        with self.assertRaises(ProductNotEnoughException):
+            await self.create_order(6)
+        self.assertEqual(self.get_stock(), 5)
+        self.assertEqual(list(self.store.orders.scan()), [])
+
+    async def test_concurrent_stock_decrements(self) -> None:
+        """Одновременные заказы, прочитавшие один и тот же остаток, не теряют списаний."""
+        results = await asyncio.gather(self.create_order(3, interleave=True), self.create_order(3, interleave=True),
+                                       return_exceptions=True)
+
+        self.assertEqual(sum(isinstance(result, ProductNotEnoughException) for result in results), 1)
+        self.assertEqual(self.get_stock(), 2)
+        self.assertEqual(len(list(self.store.orders.scan())), 1)
+
+    async def test_price_changed_before_decrement(self) -> None:
+        """Заказ сохраняет цену на момент списания, а не прочитанную до него."""
+        conn = self.store.connect()
+        factory = ServiceFactory(conn, backend='memory')
+        product = await factory.create_product_service().get_by_slug(self.product.slug)
+
+        other = self.store.connect()
+        trans = await other.begin()
+        await MemoryProductDAO(other).update_by_slug(self.product.slug, {'price': Decimal('3.00')})
+        await trans.commit()
+
+        order, order_products = await factory.create_order_service().create(self.user, [(product, 2)])
+
+        self.assertEqual(order.total, Decimal('6.00'))
+        self.assertEqual([line.price for line in order_products], [Decimal('3.00')])
+        self.assertEqual(self.store.product_sales.get(self.product.id).revenue, Decimal('6.00'))
+
+    async def test_rollback(self) -> None:
+        """Откат транзакции отменяет заказ, списание и агрегаты продаж, уведомления не доставляются."""
+        notifications = []
+        self.store.listen(PRODUCT_CHANGES_CHANNEL, notifications.append)
+        conn = self.store.connect()
+        trans = await conn.begin()
+        factory = ServiceFactory(conn, backend='memory')
+        product = await factory.create_product_service().get_by_slug(self.product.slug)
+        await factory.create_order_service().create(self.user, [(product, 2)])
+        await trans.rollback()
+
+        self.assertEqual(self.get_stock(), 5)
+        self.assertEqual(list(self.store.orders.scan()), [])
+        self.assertEqual(list(self.store.order_products.scan()), [])
+        self.assertIsNone(self.store.product_sales.get(self.product.id))
+        self.assertEqual(notifications, [])
+
+
+class OrderHistoryTest(MemoryServiceTestCase):
+    """Тесты истории заказов пользователя."""
+
+    async def test_pages(self) -> None:
+        """Заказы возвращаются страницами по убыванию номера вместе со своими продуктами."""
+        created = [(await self.create_order(quantity))[0] for quantity in (1, 2, 1)]
+        order_service = ServiceFactory(self.store.connect(), backend='memory').create_order_service()
+
+        first_page = await order_service.get_all(self.user, limit=2)
+        second_page = await order_service.get_all(self.user, before=first_page[-1][0].number, limit=2)
+
+        self.assertEqual([order.number for order, _ in first_page + second_page],
+                         [order.number for order in reversed(created)])
+        self.assertEqual([[line.quantity for line in lines] for _, lines in first_page + second_page], [[1], [2], [1]])
+        self.assertEqual(await order_service.get_all(self.user, before=created[0].number), [])
+
+
+class AnalyticsServiceTest(MemoryServiceTestCase):
+    """Тесты аналитики продаж."""
+
+    async def test_top_products(self) -> None:
+        """Самые продаваемые продукты упорядочиваются по количеству или выручке и отбираются по периоду."""
+        juice = Product('Juice', 'Fruit juice', Decimal('20.00'), 5, id=uuid4())
+        self.store.load(products=[juice])
+        conn = self.store.connect()
+        trans = await conn.begin()
+        factory = ServiceFactory(conn, backend='memory')
+        await factory.create_order_service().create(self.user, [(self.product, 3), (juice, 1)])
+        await factory.create_order_service().create(self.user, [(self.product, 1)])
+        await trans.commit()
+        analytics = factory.create_analytics_service()
+
+        by_units = await analytics.get_top_products()
+        self.assertEqual([(item.slug, item.units_sold, item.revenue) for item in by_units],
+                         [(self.product.slug, 4, Decimal('10.00')), (juice.slug, 1, Decimal('20.00'))])
+        by_revenue = await analytics.get_top_products(order_by='revenue', limit=1)
+        self.assertEqual([item.slug for item in by_revenue], [juice.slug])
+
+        now = datetime.now(timezone.utc)
+        recent = await analytics.get_top_products(since=now - timedelta(hours=1), until=now + timedelta(hours=1))
+        self.assertEqual([(item.slug, item.units_sold) for item in recent], [(self.product.slug, 4), (juice.slug, 1)])
+        self.assertEqual(await analytics.get_top_products(since=now + timedelta(hours=1)), [])
+
+
+class ProductServiceTest(MemoryServiceTestCase):
+    """Тесты создания продуктов."""
+
+    async def create_product(self, product: Product) -> Product:
+        """Создать продукт в отдельной транзакции."""
+        conn = self.store.connect()
+        trans = await conn.begin()
+        try:
+            created = await ServiceFactory(conn, backend='memory').create_product_service().create(product)
+        except BaseException:
+            await trans.rollback()
+            raise
+        await trans.commit()
+        return created
+
+    async def test_create_conflict(self) -> None:
+        """Продукт с существующим slug не создается."""
+        with self.assertRaises(ProductAlreadyExistsException):
+            await self.create_product(Product('Dark chocolate', 'Another chocolate', Decimal(1), 1))
+
+    async def test_concurrent_create_conflict(self) -> None:
+        """Из одновременно создаваемых продуктов с одним slug создается только один."""
+        results = await asyncio.gather(*(self.create_product(Product('Green tea', 'Loose leaf tea', Decimal(3), 10))
+                                         for _ in range(2)), return_exceptions=True)
+
+        self.assertEqual(sum(isinstance(result, ProductAlreadyExistsException) for result in results), 1)
+        self.assertEqual(sum(product.slug == 'green-tea' for product in self.store.products.scan()), 1)
+
+    async def test_catalog_version(self) -> None:
+        """Каталог из снимка возвращается с версией снимка, каталог из хранилища - без версии."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'catalog.snapshot')
+        catalog = SharedCatalog(path, check_interval=0)
+        self.addCleanup(catalog.close)
+        factory = ServiceFactory(self.store.connect(), backend='memory', catalog=catalog)
+
+        products, version = await factory.create_product_service().get_catalog()
+        self.assertEqual(([product.slug for product in products], version), ([self.product.slug], None))
+
+        write_snapshot(path, [self.product])
+        products, version = await factory.create_product_service().get_catalog()
+        self.assertEqual([product.slug for product in products], [self.product.slug])
+        self.assertEqual(version, catalog.get().tag)
+        write_snapshot(path, [self.product])
+        self.assertNotEqual(catalog.get().tag, version)
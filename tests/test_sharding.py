@@ -0,0 +1,37 @@
+from unittest import TestCase
+from uuid import UUID, uuid4
+
+from db import ORDER_NUMBER_INCREMENT, ORDER_NUMBER_START
+from sharding import Shard, ShardMap, validate_shard_ids
+
+
+class ShardMapTest(TestCase):
+    """Тесты отображения пользователей и номеров заказов на шарды."""
+
+    def setUp(self) -> None:
+        """Создать отображение на два шарда с несмежными идентификаторами."""
+        self.shards = ShardMap([Shard(id=3, name='second', engine=None), Shard(id=1, name='first', engine=None)])
+
+    def test_validate_shard_ids(self) -> None:
+        """Пустой список, повторяющиеся и не помещающиеся в шаг номеров идентификаторы отклоняются."""
+        for ids in ([], [0, 0], [-1], [ORDER_NUMBER_INCREMENT]):
+            with self.assertRaises(ValueError):
+                validate_shard_ids(ids)
+        validate_shard_ids(list(range(ORDER_NUMBER_INCREMENT)))
+
+    def test_for_user(self) -> None:
+        """Пользователь закреплен за шардом по остатку от деления идентификатора."""
+        self.assertEqual(self.shards.for_user(UUID(int=4)).id, 1)
+        self.assertEqual(self.shards.for_user(UUID(int=5)).id, 3)
+        user_id = uuid4()
+        self.assertIs(self.shards.for_user(user_id), self.shards.for_user(user_id))
+
+    def test_for_order(self) -> None:
+        """Шард заказа определяется по номеру из последовательности шарда."""
+        for shard in self.shards.shards:
+            numbers = (ORDER_NUMBER_START + shard.id + i * ORDER_NUMBER_INCREMENT for i in range(3))
+            self.assertTrue(all(self.shards.for_order(number) is shard for number in numbers))
+
+    def test_for_unknown_order(self) -> None:
+        """Для номера без шарда шард не находится."""
+        self.assertIsNone(self.shards.for_order(ORDER_NUMBER_START + 2))
@@ -0,0 +1,83 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(IsolatedAsyncioTestCase):
+    """Тесты объединения одновременных вызовов."""
+
+    def setUp(self) -> None:
+        """Создать группу вызовов и событие, до которого операции не завершаются."""
+        self.group = SingleFlight()
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def operation(self) -> int:
+        """Операция, завершающаяся по событию и возвращающая номер своего вызова."""
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return call
+
+    async def test_coalesces_concurrent_calls(self) -> None:
+        """Одновременные вызовы с одним ключом выполняют операцию один раз."""
+        calls = [asyncio.ensure_future(self.group.do('key', self.operation)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(*calls), [1, 1, 1])
+        self.assertEqual(self.calls, 1)
+
+    async def test_different_keys(self) -> None:
+        """Вызовы с разными ключами выполняются независимо."""
+        calls = [asyncio.ensure_future(self.group.do(key, self.operation)) for key in ('first', 'second')]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(sorted(await asyncio.gather(*calls)), [1, 2])
+
+    async def test_sequential_calls(self) -> None:
+        """Завершенная операция не переиспользуется следующим вызовом."""
+        self.release.set()
+        self.assertEqual(await self.group.do('key', self.operation), 1)
+        self.assertEqual(await self.group.do('key', self.operation), 2)
+
+    async def test_exception_is_shared(self) -> None:
+        """Исключение операции получают все ожидающие."""
+        async def fail() -> None:
+            await self.release.wait()
+            raise ValueError
+
+        calls = [asyncio.ensure_future(self.group.do('key', fail)) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.release.set()
+
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_leader_cancellation(self) -> None:
+        """При отмене лидера ожидающий не получает CancelledError, а выполняет операцию сам."""
+        leader = asyncio.ensure_future(self.group.do('key', self.operation))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(self.group.do('key', self.operation))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await follower, 2)
+        self.assertTrue(leader.cancelled())
+
+    async def test_follower_cancellation(self) -> None:
+        """Отмена ожидающего не влияет на лидера."""
+        leader = asyncio.ensure_future(self.group.do('key', self.operation))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(self.group.do('key', self.operation))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        self.assertEqual(await leader, 1)
+        self.assertTrue(follower.cancelled())
@@ -0,0 +1,112 @@
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from middlewares import LAST_WRITE_COOKIE, slug_index_middleware
+from replicas import ReplicaRouter
+from slugindex import BloomFilter, SlugIndex
+
+
+class BloomFilterTest(TestCase):
+    """Тесты фильтра Блума."""
+
+    def test_no_false_negatives(self) -> None:
+        """Каждая добавленная строка считается возможно присутствующей."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = ['product-{i}'.format(i=i) for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self) -> None:
+        """Доля ложноположительных ответов при заданной емкости близка к допустимой."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('product-{i}'.format(i=i))
+
+        false_positives = sum('missing-{i}'.format(i=i) in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.03)
+        self.assertAlmostEqual(bloom.expected_error_rate, 0.01, delta=0.005)
+
+    def test_empty(self) -> None:
+        """Пустой фильтр не содержит строк."""
+        self.assertNotIn('product', BloomFilter(capacity=0, error_rate=0.01))
+
+
+class SlugIndexTest(TestCase):
+    """Тесты индекса slug-ов продуктов."""
+
+    def setUp(self) -> None:
+        """Создать индекс без фильтра."""
+        self.index = SlugIndex(min_capacity=16)
+
+    def test_not_built(self) -> None:
+        """Пока фильтр не построен, любой slug возможно существует."""
+        self.assertTrue(self.index.might_contain('missing'))
+        self.assertEqual(self.index.definite_misses, 0)
+
+    def test_built(self) -> None:
+        """Построенный фильтр отвечает на запросы несуществующих продуктов и учитывает их."""
+        self.index.replace(self.index.build(['dark-chocolate', 'green-tea']))
+
+        self.assertTrue(self.index.might_contain('green-tea'))
+        self.assertFalse(self.index.might_contain('missing'))
+        self.assertEqual(self.index.definite_misses, 1)
+
+    def test_add_and_invalidate(self) -> None:
+        """Созданные продукты добавляются в фильтр, а сброшенный фильтр пропускает все slug-и."""
+        self.index.replace(self.index.build([]))
+        self.index.add('new-product')
+        self.assertTrue(self.index.might_contain('new-product'))
+
+        self.index.invalidate()
+        self.assertTrue(self.index.might_contain('missing'))
+
+    def test_needs_rebuild(self) -> None:
+        """Фильтр, заполненный сверх емкости, требует перестройки."""
+        self.index.replace(self.index.build([]))
+        for i in range(self.index.filter.capacity + 1):
+            self.index.add('product-{i}'.format(i=i))
+        self.assertTrue(self.index.needs_rebuild)
+
+
+class SlugIndexMiddlewareTest(IsolatedAsyncioTestCase):
+    """Тесты ответов на запросы несуществующих продуктов без обращения к БД."""
+
+    def setUp(self) -> None:
+        """Создать приложение с построенным индексом, не содержащим slug-ов."""
+        self.index = SlugIndex(min_capacity=16)
+        self.index.replace(self.index.build([]))
+        self.app = web.Application()
+        self.app['db_router'] = ReplicaRouter(primary=None, replicas=[])
+        self.middleware = slug_index_middleware(self.index)
+
+    async def request(self, headers: dict = None) -> web.StreamResponse:
+        """Запросить продукт с slug-ом, отсутствующим в индексе."""
+        request = make_mocked_request(hdrs.METH_GET, '/products/missing', headers=headers,
+                                      match_info={'slug': 'missing'}, app=self.app)
+        request.match_info.route.handler.product_slug_param = 'slug'
+
+        async def handler(request: web.Request) -> web.Response:
+            return web.Response()
+        return await self.middleware(request, handler)
+
+    async def test_definite_miss(self) -> None:
+        """Продукт, отсутствующий в индексе, не запрашивается из БД."""
+        response = await self.request()
+        self.assertEqual(response.status, 404)
+
+    async def test_recently_wrote(self) -> None:
+        """Клиент, недавно выполнивший запись в этом процессе, не проверяется по индексу."""
+        self.app['db_router'].mark_write('Bearer token')
+        response = await self.request({hdrs.AUTHORIZATION: 'Bearer token'})
+        self.assertEqual(response.status, 200)
+
+    async def test_recently_wrote_elsewhere(self) -> None:
+        """Клиент, недавно выполнивший запись в другом процессе, не проверяется по индексу."""
+        response = await self.request({hdrs.COOKIE: '{name}={time}'.format(name=LAST_WRITE_COOKIE, time=time.time())})
+        self.assertEqual(response.status, 200)
@@ -0,0 +1,90 @@
+import os
+import tempfile
+from decimal import Decimal
+from unittest import TestCase
+from uuid import uuid4
+
+from snapshot import CatalogSnapshot, HEADER, SNAPSHOT_MAGIC, SharedCatalog, write_snapshot
+from storage import Product
+
+
+class SnapshotTest(TestCase):
+    """Тесты формата снимка каталога продуктов."""
+
+    def setUp(self) -> None:
+        """Подготовить путь до файла снимка и продукты."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.snapshot')
+        self.products = [
+            Product('Milk chocolate', 'Milk chocolate bar', Decimal('1.99'), 3, id=uuid4()),
+            Product('Чай', 'Зеленый чай', Decimal('0.1'), 0, id=uuid4(), slug='чай'),
+            Product('Dark chocolate', 'Bitter dark chocolate', Decimal('12345678.123456789'), 7, id=uuid4())
+        ]
+
+    def open(self) -> CatalogSnapshot:
+        """Открыть снимок, закрываемый по окончании теста."""
+        snapshot = CatalogSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_round_trip(self) -> None:
+        """Продукты читаются из снимка без потерь, в том числе строки utf-8 и точные цены."""
+        write_snapshot(self.path, self.products)
+        snapshot = self.open()
+
+        self.assertEqual(snapshot.count, 3)
+        for product in self.products:
+            self.assertEqual(dict(snapshot.get_by_slug(product.slug)), dict(product))
+
+    def test_missing_slug(self) -> None:
+        """Отсутствующий slug не находится, в том числе до первого и после последнего продукта."""
+        write_snapshot(self.path, self.products)
+        snapshot = self.open()
+
+        for slug in ('a', 'milk', 'zzz', 'чая'):
+            self.assertIsNone(snapshot.get_by_slug(slug))
+
+    def test_get_all_sorted(self) -> None:
+        """Все продукты возвращаются в порядке slug-ов."""
+        write_snapshot(self.path, self.products)
+        slugs = [product.slug for product in self.open().get_all()]
+        self.assertEqual(slugs, sorted(slugs, key=lambda slug: slug.encode('utf-8')))
+
+    def test_empty(self) -> None:
+        """Снимок пустого каталога ничего не содержит."""
+        write_snapshot(self.path, [])
+        snapshot = self.open()
+        self.assertEqual((snapshot.get_all(), snapshot.get_by_slug('tea')), ([], None))
+
+    def test_versions(self) -> None:
+        """Каждый следующий снимок получает следующую версию."""
+        self.assertEqual([write_snapshot(self.path, self.products) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.open().version, 3)
+
+    def test_bad_magic(self) -> None:
+        """Файл без сигнатуры снимка не открывается."""
+        with open(self.path, 'wb') as file:
+            file.write(HEADER.pack(b'NOTACAT1', 1, 0, 0))
+        with self.assertRaises(ValueError):
+            CatalogSnapshot(self.path)
+
+    def test_shared_catalog(self) -> None:
+        """Общий снимок замечает замену файла и не используется, если устарел."""
+        catalog = SharedCatalog(self.path, check_interval=0)
+        self.addCleanup(catalog.close)
+        self.assertIsNone(catalog.get())
+
+        write_snapshot(self.path, self.products)
+        self.assertEqual(catalog.get().version, 1)
+        write_snapshot(self.path, self.products[:1])
+        self.assertEqual((catalog.get().version, catalog.get().count), (2, 1))
+
+        catalog.max_age = -1
+        self.assertIsNone(catalog.get())
+
+    def test_header(self) -> None:
+        """Заголовок снимка начинается с сигнатуры формата."""
+        write_snapshot(self.path, self.products)
+        with open(self.path, 'rb') as file:
+            self.assertEqual(HEADER.unpack(file.read(HEADER.size))[0], SNAPSHOT_MAGIC)
@@ -0,0 +1,89 @@
+import os
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+from uuid import uuid4
+
+from exceptions import InvalidTokenException
+from tokens import PLACEHOLDER_SECRET, TOKEN_SECRET_ENV, TokenSigner, close_tokens, init_tokens
+
+
+class TokenSignerTest(TestCase):
+    """Тесты подписанных токенов доступа."""
+
+    def setUp(self) -> None:
+        """Создать объект подписи токенов."""
+        self.signer = TokenSigner(secret='secret', ttl=60)
+        self.user_id = uuid4()
+
+    def test_issue_and_verify(self) -> None:
+        """Выпущенный токен проверяется и содержит пользователя и срок действия."""
+        token = self.signer.issue(self.user_id, 'user')
+        claims = self.signer.verify(token)
+
+        self.assertTrue(TokenSigner.is_signed(token))
+        self.assertEqual((claims.user_id, claims.login), (self.user_id, 'user'))
+        self.assertEqual(claims.expires_at - claims.issued_at, 60)
+
+    def test_unique_ids(self) -> None:
+        """Токены одного пользователя различаются идентификаторами."""
+        first, second = (self.signer.verify(self.signer.issue(self.user_id, 'user')) for _ in range(2))
+        self.assertNotEqual(first.id, second.id)
+
+    def test_opaque_token(self) -> None:
+        """Токен, хранимый в БД, не считается подписанным и не проверяется."""
+        self.assertFalse(TokenSigner.is_signed('user1-token'))
+        with self.assertRaises(InvalidTokenException):
+            self.signer.verify('user1-token')
+
+    def test_tampered_payload(self) -> None:
+        """Токен с измененной полезной нагрузкой отклоняется."""
+        prefix, payload, signature = self.signer.issue(self.user_id, 'user').split('.')
+        forged = TokenSigner(secret='secret', ttl=60).issue(self.user_id, 'admin').split('.')[1]
+        with self.assertRaises(InvalidTokenException):
+            self.signer.verify('.'.join((prefix, forged, signature)))
+
+    def test_other_secret(self) -> None:
+        """Токен, подписанный другим ключом, отклоняется."""
+        token = TokenSigner(secret='other', ttl=60).issue(self.user_id, 'user')
+        with self.assertRaises(InvalidTokenException):
+            self.signer.verify(token)
+
+    def test_expired(self) -> None:
+        """Просроченный токен отклоняется."""
+        token = self.signer.issue(self.user_id, 'user')
+        with patch('tokens.time.time', return_value=time.time() + 61):
+            with self.assertRaises(InvalidTokenException):
+                self.signer.verify(token)
+
+
+class InitTokensTest(IsolatedAsyncioTestCase):
+    """Тесты инициализации подписи токенов."""
+
+    async def init(self, token_format: str, secret: str = None) -> dict:
+        """Инициализировать подпись токенов для `token_format` с секретным ключом `secret` в окружении."""
+        app = {'config': {'tokens': {'format': token_format}}}
+        with patch.dict(os.environ):
+            os.environ.pop(TOKEN_SECRET_ENV, None)
+            if secret is not None:
+                os.environ[TOKEN_SECRET_ENV] = secret
+            await init_tokens(app)
+        self.addAsyncCleanup(close_tokens, app)
+        return app
+
+    async def test_secret_from_environment(self) -> None:
+        """Подписанные токены подписываются ключом из переменной окружения."""
+        app = await self.init('signed', secret='secret')
+        token = app['token_signer'].issue(uuid4(), 'user')
+        self.assertEqual(TokenSigner(secret='secret', ttl=60).verify(token).login, 'user')
+
+    async def test_missing_secret(self) -> None:
+        """Без ключа или с ключом-заглушкой приложение с подписанными токенами не запускается."""
+        for secret in (None, '', PLACEHOLDER_SECRET):
+            with self.subTest(secret=secret), self.assertRaisesRegex(ValueError, TOKEN_SECRET_ENV):
+                await self.init('signed', secret=secret)
+
+    async def test_opaque(self) -> None:
+        """Для хранимых в БД токенов ключ не требуется."""
+        app = await self.init('opaque')
+        self.assertIsNone(app['token_signer'])
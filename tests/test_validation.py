@@ -0,0 +1,91 @@
+import json
+from typing import AsyncIterator, Optional
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+import validation
+from validation import compile_schema, validate
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'login': {'type': 'string', 'minLength': 1}
+    },
+    'required': ['login']
+}
+
+
+class Payload:
+    """Тело запроса, читаемое частями."""
+
+    def __init__(self, body: bytes, chunk_size: int = 4) -> None:
+        """
+        Инициализация экземпляра класса.
+
+        :param body: тело запроса
+        :param chunk_size: размер части, в байтах
+        """
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def iter_any(self) -> AsyncIterator[bytes]:
+        """Вернуть тело по частям."""
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+
+class CompileSchemaTest(TestCase):
+    """Тесты компиляции json-схем."""
+
+    def check(self) -> None:
+        """Проверить функцию валидации, скомпилированную из схемы."""
+        validate_data = compile_schema(SCHEMA)
+        self.assertIsNone(validate_data({'login': 'user'}))
+        self.assertIsNotNone(validate_data({}))
+        self.assertIsNotNone(validate_data({'login': ''}))
+
+    def test_compiled(self) -> None:
+        """Схема компилируется, если установлен fastjsonschema."""
+        if validation.fastjsonschema is None:
+            self.skipTest('fastjsonschema is not installed')
+        self.check()
+
+    def test_jsonschema(self) -> None:
+        """Без fastjsonschema схема проверяется валидатором jsonschema."""
+        with patch.object(validation, 'fastjsonschema', None):
+            self.check()
+
+
+class ValidateTest(IsolatedAsyncioTestCase):
+    """Тесты декоратора валидации тела запроса."""
+
+    async def request(self, body: bytes, content_length: Optional[int] = None) -> web.Response:
+        """Обработать запрос с телом `body` методом view, декорированным validate."""
+        class LoginView(web.View):
+            @validate(request_schema=SCHEMA, max_body_size=32)
+            async def post(self, data: dict) -> web.Response:
+                return web.json_response(data)
+
+        headers = {hdrs.CONTENT_LENGTH: str(content_length)} if content_length is not None else {}
+        request = make_mocked_request(hdrs.METH_POST, '/login', headers=headers, payload=Payload(body))
+        return await LoginView(request).post()
+
+    async def test_valid(self) -> None:
+        """Разобранное тело передается в метод view."""
+        response = await self.request(b'{"login": "user"}')
+        self.assertEqual((response.status, json.loads(response.body)), (200, {'login': 'user'}))
+
+    async def test_invalid(self) -> None:
+        """Тело, не являющееся json-ом или не соответствующее схеме, отклоняется."""
+        for body in (b'{"login": ', b'{"login": ""}'):
+            with self.subTest(body=body):
+                self.assertEqual((await self.request(body)).status, 400)
+
+    async def test_too_large(self) -> None:
+        """Тело больше допустимого размера отклоняется, в том числе без заголовка Content-Length."""
+        body = json.dumps({'login': 'x' * 32}).encode('utf-8')
+        self.assertEqual((await self.request(body, content_length=len(body))).status, 413)
+        self.assertEqual((await self.request(body)).status, 413)